@@ -1,17 +1,114 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g, has_app_context, has_request_context
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import text
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text, bindparam, insert, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+from sqlalchemy.pool import NullPool
 from flask_cors import CORS
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from collections import Counter, OrderedDict, deque
+from functools import wraps
+import atexit
+import bisect
+import csv
+import hashlib
+import io
+import itertools
+import json
+import math
 import os
+import queue
+import random
+import re
+import sqlite3
+import statistics
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import click
+import msgpack
+import numpy as np
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # only needed for Parquet exports
+    pa = pq = None
 
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=['X-Next-Cursor', 'X-Export-Watermark'])
 
 DB_URL = os.environ.get('DATABASE_URL') or 'sqlite:///app.db'
 app.config['SQLALCHEMY_DATABASE_URI'] = DB_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-db = SQLAlchemy(app)
+# Engine profiles, picked with DB_PROFILE. "default" is SQLAlchemy's stock
+# engine. "production" sizes and pre-pings the PostgreSQL pool, and puts
+# SQLite in WAL mode so readers no longer block on (and behind) writers.
+ENGINE_PROFILES = {
+    'default': {},
+    'production': {
+        'postgresql': {
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+            'pool_pre_ping': True,
+            'pool_recycle': 1800,
+            'pool_timeout': 10,
+        },
+        'sqlite': {
+            'journal_mode': 'WAL',
+            'synchronous': 'NORMAL',
+            'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+            'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        },
+    },
+}
+
+DB_PROFILE = os.environ.get('DB_PROFILE', 'default')
+if DB_PROFILE not in ENGINE_PROFILES:
+    raise RuntimeError(f"DB_PROFILE must be one of {', '.join(ENGINE_PROFILES)}")
+DB_BACKEND = make_url(DB_URL).get_backend_name()
+if DB_BACKEND != 'sqlite':
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = ENGINE_PROFILES[DB_PROFILE].get(DB_BACKEND, {})
+
+# Read replicas, a comma-separated DATABASE_READ_URL, become the binds
+# replica_0, replica_1, ... (see "Read replicas" below for the routing).
+# SQLite replicas are snapshot files replaced wholesale on refresh, so their
+# connections are not pooled and always open the current file.
+READ_URLS = [url.strip() for url in os.environ.get('DATABASE_READ_URL', '').split(',') if url.strip()]
+app.config['SQLALCHEMY_BINDS'] = {
+    f'replica_{i}': {'url': url, 'poolclass': NullPool} if make_url(url).get_backend_name() == 'sqlite'
+    else {'url': url, **ENGINE_PROFILES[DB_PROFILE].get(make_url(url).get_backend_name(), {})}
+    for i, url in enumerate(READ_URLS)
+}
+
+
+class RoutingSession(Session):
+    """Session that runs the statements of a replica-routed request on that replica."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = g.get('read_bind') if bind is None and has_app_context() else None
+        if replica is not None:
+            return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+
+SQLITE_PRAGMAS = ENGINE_PROFILES[DB_PROFILE].get('sqlite', {}) if DB_BACKEND == 'sqlite' else {}
+if SQLITE_PRAGMAS:
+    with app.app_context():
+        @event.listens_for(db.engine, 'connect')
+        def apply_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for pragma, value in SQLITE_PRAGMAS.items():
+                cursor.execute(f'PRAGMA {pragma} = {value}')
+            cursor.close()
 
 ### Models
 
@@ -32,7 +129,10 @@ class Driver(db.Model):
     license_no = db.Column(db.String, nullable=True)
     vehicle_no = db.Column(db.String, nullable=True)
     rating = db.Column(db.Numeric, default=0)
-    status = db.Column(db.String, default='available')  # available/busy
+    status = db.Column(db.String, default='available', index=True)  # available/busy
+    lat = db.Column(db.Float, nullable=True)
+    lng = db.Column(db.Float, nullable=True)
+    location_updated_at = db.Column(db.DateTime, nullable=True)
 
 class Restaurant(db.Model):
     __tablename__ = 'restaurants'
@@ -45,7 +145,7 @@ class Restaurant(db.Model):
 class MenuItem(db.Model):
     __tablename__ = 'menu_items'
     item_id = db.Column(db.Integer, primary_key=True)
-    restaurant_id = db.Column(db.Integer, db.ForeignKey('restaurants.restaurant_id'), nullable=False)
+    restaurant_id = db.Column(db.Integer, db.ForeignKey('restaurants.restaurant_id'), nullable=False, index=True)
     name = db.Column(db.String, nullable=False)
     price = db.Column(db.Numeric, nullable=False)
     availability = db.Column(db.Boolean, default=True)
@@ -57,33 +157,40 @@ class DeliveryPartner(db.Model):
     name = db.Column(db.String, nullable=False)
     phone = db.Column(db.String, nullable=True)
     vehicle_no = db.Column(db.String, nullable=True)
-    status = db.Column(db.String, default='available')
+    status = db.Column(db.String, default='available', index=True)
+    lat = db.Column(db.Float, nullable=True)
+    lng = db.Column(db.Float, nullable=True)
+    location_updated_at = db.Column(db.DateTime, nullable=True)
 
 class Ride(db.Model):
     __tablename__ = 'rides'
     ride_id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
-    driver_id = db.Column(db.Integer, db.ForeignKey('drivers.driver_id'), nullable=False)
+    driver_id = db.Column(db.Integer, db.ForeignKey('drivers.driver_id'), nullable=False, index=True)
     source = db.Column(db.String, nullable=False)
     destination = db.Column(db.String, nullable=False)
     fare = db.Column(db.Numeric, nullable=False)
     status = db.Column(db.String, default='requested')
-    timestamp = db.Column(db.DateTime, server_default=db.func.now())
+    timestamp = db.Column(db.DateTime, server_default=db.func.now(), index=True)
+
+    __table_args__ = (db.Index('ix_rides_user_id_timestamp', 'user_id', 'timestamp'),)
 
 class Order(db.Model):
     __tablename__ = 'orders'
     order_id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
-    restaurant_id = db.Column(db.Integer, db.ForeignKey('restaurants.restaurant_id'), nullable=False)
-    partner_id = db.Column(db.Integer, db.ForeignKey('delivery_partners.partner_id'), nullable=True)
+    restaurant_id = db.Column(db.Integer, db.ForeignKey('restaurants.restaurant_id'), nullable=False, index=True)
+    partner_id = db.Column(db.Integer, db.ForeignKey('delivery_partners.partner_id'), nullable=True, index=True)
     total_amount = db.Column(db.Numeric, nullable=False)
     status = db.Column(db.String, default='placed')
-    timestamp = db.Column(db.DateTime, server_default=db.func.now())
+    timestamp = db.Column(db.DateTime, server_default=db.func.now(), index=True)
+
+    __table_args__ = (db.Index('ix_orders_user_id_timestamp', 'user_id', 'timestamp'),)
 
 class OrderItem(db.Model):
     __tablename__ = 'order_items'
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('orders.order_id'), nullable=False)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.order_id'), nullable=False, index=True)
     item_id = db.Column(db.Integer, db.ForeignKey('menu_items.item_id'), nullable=False)
     quantity = db.Column(db.Integer, nullable=False)
 
@@ -91,11 +198,20 @@ class Payment(db.Model):
     __tablename__ = 'payments'
     payment_id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.user_id'), nullable=False)
-    ride_id = db.Column(db.Integer, db.ForeignKey('rides.ride_id'), nullable=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('orders.order_id'), nullable=True)
+    ride_id = db.Column(db.Integer, db.ForeignKey('rides.ride_id'), nullable=True, index=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.order_id'), nullable=True, index=True)
     amount = db.Column(db.Numeric, nullable=False)
     mode = db.Column(db.String, nullable=False)
     status = db.Column(db.String, default='pending')
+    timestamp = db.Column(db.DateTime, server_default=db.func.now())
+
+    __table_args__ = (
+        db.Index('ix_payments_user_id_timestamp', 'user_id', 'timestamp'),
+        # The settlement worker's queue (see settle_payments).
+        db.Index('ix_payments_pending_wallet', 'payment_id',
+                 sqlite_where=db.text("status = 'pending' AND mode = 'wallet'"),
+                 postgresql_where=db.text("status = 'pending' AND mode = 'wallet'")),
+    )
 
 class Rating(db.Model):
     __tablename__ = 'ratings'
@@ -107,12 +223,2512 @@ class Rating(db.Model):
     comment = db.Column(db.String, nullable=True)
     timestamp = db.Column(db.DateTime, server_default=db.func.now())
 
+    __table_args__ = (db.Index('ix_ratings_target_type_target_id', 'target_type', 'target_id'),)
+
+### Rollup tables (maintained by the write routes, read by /api/analytics/*)
+
+class PlatformTotal(db.Model):
+    __tablename__ = 'platform_totals'
+    metric = db.Column(db.String, primary_key=True)  # see TOTAL_METRICS
+    value = db.Column(db.Numeric, nullable=False, default=0)
+
+class DailyRevenue(db.Model):
+    __tablename__ = 'daily_revenue'
+    revenue_date = db.Column(db.Date, primary_key=True)
+    ride_count = db.Column(db.Integer, nullable=False, default=0)
+    ride_revenue = db.Column(db.Numeric, nullable=False, default=0)
+    order_count = db.Column(db.Integer, nullable=False, default=0)
+    order_revenue = db.Column(db.Numeric, nullable=False, default=0)
+
+class DriverStats(db.Model):
+    __tablename__ = 'driver_stats'
+    driver_id = db.Column(db.Integer, db.ForeignKey('drivers.driver_id'), primary_key=True)
+    ride_count = db.Column(db.Integer, nullable=False, default=0, index=True)
+    revenue = db.Column(db.Numeric, nullable=False, default=0)
+
+class RestaurantStats(db.Model):
+    __tablename__ = 'restaurant_stats'
+    restaurant_id = db.Column(db.Integer, db.ForeignKey('restaurants.restaurant_id'), primary_key=True)
+    order_count = db.Column(db.Integer, nullable=False, default=0, index=True)
+    revenue = db.Column(db.Numeric, nullable=False, default=0)
+
+class RatingAggregate(db.Model):
+    __tablename__ = 'rating_aggregates'
+    target_type = db.Column(db.String, primary_key=True)  # 'driver' or 'restaurant'
+    target_id = db.Column(db.Integer, primary_key=True)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+    score_sum = db.Column(db.Integer, nullable=False, default=0)
+    score_1 = db.Column(db.Integer, nullable=False, default=0)
+    score_2 = db.Column(db.Integer, nullable=False, default=0)
+    score_3 = db.Column(db.Integer, nullable=False, default=0)
+    score_4 = db.Column(db.Integer, nullable=False, default=0)
+    score_5 = db.Column(db.Integer, nullable=False, default=0)
+
+class ArchiveWatermark(db.Model):
+    __tablename__ = 'archive_watermarks'
+    table_name = db.Column(db.String, primary_key=True)  # 'rides' or 'orders'
+    archived_before = db.Column(db.DateTime, nullable=False)  # the archive holds only older rows
+
 ### Helpers
 
+# Upper bound on ``?limit=`` for paginated list requests.
+MAX_PAGE_SIZE = 1000
+# Rows fetched per round trip from the server-side cursor when streaming.
+STREAM_BATCH_SIZE = 500
+
+
+class ApiError(Exception):
+    """Raised by helpers to abort the current request with a JSON error body."""
+
+    def __init__(self, message, status=400, **extra):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+        self.extra = extra
+
+
+@app.errorhandler(ApiError)
+def handle_api_error(err):
+    db.session.rollback()
+    return jsonify({'error': err.message, **err.extra}), err.status
+
+
 def result_to_dict(result):
     """Converts SQLAlchemy ResultProxy items to a list of dictionaries."""
     return [dict(row._mapping) for row in result]
 
+
+def int_arg(name, default=None, minimum=1, maximum=None):
+    """Reads an integer query parameter, clamping it to ``maximum``."""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    if not value.isdigit() or int(value) < minimum:
+        raise ApiError(f'{name} must be an integer >= {minimum}')
+    value = int(value)
+    return min(value, maximum) if maximum is not None else value
+
+
+def float_arg(name, minimum, maximum, default=None):
+    value = request.args.get(name)
+    if value is None:
+        if default is None:
+            raise ApiError(f'{name} is required')
+        return default
+    try:
+        value = float(value)
+    except ValueError:
+        raise ApiError(f'{name} must be a number')
+    if not minimum <= value <= maximum:
+        raise ApiError(f'{name} must be between {minimum} and {maximum}')
+    return value
+
+
+def date_arg(name, default=None):
+    value = request.args.get(name)
+    if value is None:
+        return default
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ApiError(f'{name} must be a YYYY-MM-DD date')
+
+
+def primary_key_of(model):
+    return model.__table__.primary_key.columns.values()[0].name
+
+
+def parse_fields(model, fields=None):
+    """Returns the columns requested through ``?fields=a,b`` (all columns by default).
+
+    ``fields`` overrides the query parameter with a comma separated string or a list.
+    """
+    columns = model.__table__.columns.keys()
+    if fields is None:
+        fields = request.args.get('fields')
+    if not fields:
+        return list(columns)
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    selected = [str(f).strip() for f in fields if str(f).strip()]
+    unknown = [f for f in selected if f not in columns]
+    if unknown:
+        raise ApiError('unknown field(s): ' + ', '.join(unknown))
+    return selected
+
+
+def list_rows(model):
+    """Keyset-paginated, optionally streamed ``SELECT`` over one table.
+
+    Query parameters:
+      fields  comma separated column projection
+      order   ``asc`` (default) or ``desc`` on the primary key
+      after   primary key cursor; only rows past it are returned
+      start   only rows with ``timestamp >= start`` (ISO date or datetime)
+      end     only rows with ``timestamp < end``; a range reaching back past
+              the archive watermark also reads the archive tier
+      limit   page size (capped at MAX_PAGE_SIZE). When present the page is
+              returned with an ``X-Next-Cursor`` header if more rows may follow.
+              Without it the whole table is streamed from a server-side cursor.
+    """
+    pk = primary_key_of(model)
+    selected = parse_fields(model)
+    if pk not in selected:
+        # The cursor is taken from the last row, so the key is always returned.
+        selected.insert(0, pk)
+
+    order = request.args.get('order', 'asc').lower()
+    if order not in ('asc', 'desc'):
+        raise ApiError("order must be 'asc' or 'desc'")
+
+    conditions, params = time_range(model)
+    after = request.args.get('after')
+    if after is not None:
+        if not after.lstrip('-').isdigit():
+            raise ApiError('after must be an integer cursor')
+        conditions.append(f"{pk} {'>' if order == 'asc' else '<'} :after")
+        params['after'] = int(after)
+
+    sql = tiered_select(model, selected, conditions, params)
+    sql += f' ORDER BY {pk} {order.upper()}'
+
+    limit = int_arg('limit', maximum=MAX_PAGE_SIZE)
+    if limit is not None:
+        sql += ' LIMIT :limit'
+        params['limit'] = limit
+        rows = db.session.execute(text(sql), params).all()
+        response = rows_response(selected, rows)
+        if len(rows) == limit:
+            response.headers['X-Next-Cursor'] = str(rows[-1][selected.index(pk)])
+        return response
+
+    stmt = text(sql).execution_options(stream_results=True, yield_per=STREAM_BATCH_SIZE)
+    return stream_rows_response(db.session.execute(stmt, params))
+
+def user_history(model, user_id):
+    """Newest-first page of one user's rows from ``model``'s table.
+
+    Keyset-paginated on ``(timestamp, primary key)`` so every page is a range
+    scan of the composite ``(user_id, timestamp)`` index. Accepts ``fields``,
+    ``limit`` (default 20), ``start``/``end`` (see ``time_range``) and
+    ``after``, the value of the previous page's ``X-Next-Cursor`` header
+    (``<timestamp>|<primary key>``).
+    """
+    pk = primary_key_of(model)
+    selected = parse_fields(model)
+    for column in ('timestamp', pk):
+        if column not in selected:
+            selected.append(column)
+
+    limit = int_arg('limit', 20, maximum=MAX_PAGE_SIZE)
+    conditions, params = time_range(model)
+    conditions.append('user_id = :user_id')
+    params.update(user_id=user_id, limit=limit)
+    after = request.args.get('after')
+    if after:
+        after_ts, sep, after_pk = after.rpartition('|')
+        if not sep or not after_pk.isdigit():
+            raise ApiError('after must be a cursor taken from X-Next-Cursor')
+        conditions.append(f'(timestamp, {pk}) < (:after_ts, :after_pk)')
+        params.update(after_ts=after_ts, after_pk=int(after_pk))
+
+    sql = tiered_select(model, selected, conditions, params) + f" ORDER BY timestamp DESC, {pk} DESC LIMIT :limit"
+    rows = db.session.execute(text(sql), params).all()
+    response = rows_response(selected, rows)
+    if len(rows) == limit:
+        last = rows[-1]
+        response.headers['X-Next-Cursor'] = f"{last[selected.index('timestamp')]}|{last[selected.index(pk)]}"
+    return response
+
+### Serialization
+#
+# The list routes hand SQLAlchemy rows straight to a serializer picked by
+# Accept negotiation instead of building a dict per row for jsonify. Decimal
+# and date/datetime columns are converted once per column (found from the
+# first non-null value) and everything else goes through the C JSON encoder
+# or msgpack as-is. A serializer needs a ``mimetype``, ``body(columns, rows)``
+# for a page, ``stream(columns, batches)`` for a streamed listing and
+# ``document(bodies)`` to nest named pages in one object; add one to
+# SERIALIZERS to offer another format.
+
+NATIVE_CONVERTERS = {
+    Decimal: float,
+    datetime: lambda value: value.isoformat(sep=' '),
+    date: date.isoformat,
+}
+
+
+def native_value(value):
+    """Encoder fallback for a value whose column held another type in the sampled rows."""
+    converter = NATIVE_CONVERTERS.get(type(value))
+    if converter is None:
+        raise TypeError(f'{type(value).__name__} is not serializable')
+    return converter(value)
+
+
+ROW_ENCODER = json.JSONEncoder(separators=(',', ':'), default=native_value)
+
+
+def native_rows(rows):
+    """Rows as tuples/lists of JSON- and MessagePack-native values."""
+    if not rows:
+        return []
+    pending, converters = set(range(len(rows[0]))), []
+    for row in rows:
+        for index in list(pending):
+            if row[index] is not None:
+                pending.discard(index)
+                converter = NATIVE_CONVERTERS.get(type(row[index]))
+                if converter is not None:
+                    converters.append((index, converter))
+        if not pending:
+            break
+    if not converters:
+        return [tuple(row) for row in rows]
+    converted = []
+    for row in rows:
+        values = list(row)
+        for index, converter in converters:
+            if values[index] is not None:
+                values[index] = converter(values[index])
+        converted.append(values)
+    return converted
+
+
+class JsonObjectSerializer:
+    """``[{"col": value, ...}, ...]``, the default."""
+    mimetype = 'application/json'
+
+    def body(self, columns, rows):
+        return ROW_ENCODER.encode([dict(zip(columns, row)) for row in rows])
+
+    def stream(self, columns, batches):
+        yield '['
+        separator = ''
+        for rows in batches:
+            if rows:
+                yield separator + ROW_ENCODER.encode([dict(zip(columns, row)) for row in rows])[1:-1]
+                separator = ','
+        yield ']'
+
+    def document(self, bodies):
+        return '{' + ','.join(f'{ROW_ENCODER.encode(key)}:{body}' for key, body in bodies.items()) + '}'
+
+
+class ColumnarJsonSerializer:
+    """``{"columns": [...], "rows": [[...], ...]}``: no repeated keys, no per-row objects."""
+    mimetype = 'application/vnd.columnar+json'
+
+    def body(self, columns, rows):
+        return ROW_ENCODER.encode({'columns': columns, 'rows': rows})
+
+    def stream(self, columns, batches):
+        yield '{"columns":' + ROW_ENCODER.encode(columns) + ',"rows":['
+        separator = ''
+        for rows in batches:
+            if rows:
+                yield separator + ROW_ENCODER.encode(rows)[1:-1]
+                separator = ','
+        yield ']}'
+
+    document = JsonObjectSerializer.document
+
+
+class MsgpackSerializer:
+    """The columnar layout in MessagePack.
+
+    A streamed listing can't announce its row count up front, so it is sent
+    as a sequence of objects: ``{"columns": [...]}`` followed by one array of
+    rows per batch (read it with ``msgpack.Unpacker``).
+    """
+    mimetype = 'application/msgpack'
+
+    def body(self, columns, rows):
+        return msgpack.packb({'columns': columns, 'rows': rows}, default=native_value)
+
+    def stream(self, columns, batches):
+        packer = msgpack.Packer(default=native_value)
+        yield packer.pack({'columns': columns})
+        for rows in batches:
+            if rows:
+                yield packer.pack(rows)
+
+    def document(self, bodies):
+        packer = msgpack.Packer()
+        return packer.pack_map_header(len(bodies)) + b''.join(packer.pack(key) + body for key, body in bodies.items())
+
+
+SERIALIZERS = {s.mimetype: s for s in (JsonObjectSerializer(), ColumnarJsonSerializer(), MsgpackSerializer())}
+
+
+def negotiate_serializer():
+    mimetype = request.accept_mimetypes.best_match(SERIALIZERS, default=JsonObjectSerializer.mimetype)
+    return SERIALIZERS[mimetype]
+
+
+def rows_response(columns, rows):
+    """A page of rows in the negotiated format."""
+    serializer = negotiate_serializer()
+    response = app.response_class(serializer.body(columns, native_rows(rows)), mimetype=serializer.mimetype)
+    response.vary.add('Accept')
+    return response
+
+
+def stream_rows_response(result):
+    """Streams a server-side cursor in the negotiated format, one batch at a time."""
+    serializer = negotiate_serializer()
+    batches = (native_rows(rows) for rows in result.partitions(STREAM_BATCH_SIZE))
+    response = Response(stream_with_context(serializer.stream(list(result.keys()), batches)),
+                        mimetype=serializer.mimetype)
+    response.vary.add('Accept')
+    return response
+
+### Rollup maintenance
+#
+# Every write route that changes a counted entity calls one of these in the
+# same transaction, so the analytics endpoints never have to scan the base
+# tables. `rebuild_rollups` recomputes everything from scratch. Money columns
+# are rounded to cents on every update; otherwise float addition on SQLite
+# drifts away from what a fresh SUM returns.
+
+TOTAL_METRICS = ('users', 'drivers', 'restaurants', 'rides', 'orders', 'ride_revenue', 'order_revenue')
+
+UPSERT_TOTAL = text("""
+    INSERT INTO platform_totals (metric, value) VALUES (:metric, :delta)
+    ON CONFLICT (metric) DO UPDATE SET value = ROUND(platform_totals.value + excluded.value, 2)
+""")
+
+UPSERT_DAILY_REVENUE = text("""
+    INSERT INTO daily_revenue (revenue_date, ride_count, ride_revenue, order_count, order_revenue)
+    VALUES (:day, :ride_count, :ride_revenue, :order_count, :order_revenue)
+    ON CONFLICT (revenue_date) DO UPDATE SET
+        ride_count = daily_revenue.ride_count + excluded.ride_count,
+        ride_revenue = ROUND(daily_revenue.ride_revenue + excluded.ride_revenue, 2),
+        order_count = daily_revenue.order_count + excluded.order_count,
+        order_revenue = ROUND(daily_revenue.order_revenue + excluded.order_revenue, 2)
+""").bindparams(bindparam('day', type_=db.Date))
+
+UPSERT_DRIVER_STATS = text("""
+    INSERT INTO driver_stats (driver_id, ride_count, revenue) VALUES (:driver_id, :count, :revenue)
+    ON CONFLICT (driver_id) DO UPDATE SET
+        ride_count = driver_stats.ride_count + excluded.ride_count,
+        revenue = ROUND(driver_stats.revenue + excluded.revenue, 2)
+""")
+
+UPSERT_RESTAURANT_STATS = text("""
+    INSERT INTO restaurant_stats (restaurant_id, order_count, revenue) VALUES (:restaurant_id, :count, :revenue)
+    ON CONFLICT (restaurant_id) DO UPDATE SET
+        order_count = restaurant_stats.order_count + excluded.order_count,
+        revenue = ROUND(restaurant_stats.revenue + excluded.revenue, 2)
+""")
+
+
+def bump_totals(**deltas):
+    db.session.execute(UPSERT_TOTAL, [{'metric': m, 'delta': d} for m, d in deltas.items()])
+
+
+def _group_deltas(entries, sign):
+    """Sums ``(key, day, amount)`` entries per key and per day."""
+    per_key, per_day = {}, {}
+    for key, day, amount in entries:
+        count, total = per_key.get(key, (0, 0))
+        per_key[key] = (count + sign, total + sign * amount)
+        count, total = per_day.get(day, (0, 0))
+        per_day[day] = (count + sign, total + sign * amount)
+    return ({key: (count, round(total, 2)) for key, (count, total) in per_key.items()},
+            {day: (count, round(total, 2)) for day, (count, total) in per_day.items()})
+
+
+def record_rides(rides, sign=1):
+    """Adds (sign=1) or removes (sign=-1) ``(driver_id, day, fare)`` rides from every rollup."""
+    per_driver, per_day = _group_deltas(rides, sign)
+    if not per_day:
+        return
+    bump_totals(rides=sum(c for c, _ in per_day.values()), ride_revenue=sum(t for _, t in per_day.values()))
+    db.session.execute(UPSERT_DAILY_REVENUE, [
+        {'day': day, 'ride_count': count, 'ride_revenue': total, 'order_count': 0, 'order_revenue': 0}
+        for day, (count, total) in per_day.items()
+    ])
+    db.session.execute(UPSERT_DRIVER_STATS, [
+        {'driver_id': driver_id, 'count': count, 'revenue': total}
+        for driver_id, (count, total) in per_driver.items()
+    ])
+
+
+def record_orders(orders, sign=1):
+    """Adds (sign=1) or removes (sign=-1) ``(restaurant_id, day, amount)`` orders from every rollup."""
+    per_restaurant, per_day = _group_deltas(orders, sign)
+    if not per_day:
+        return
+    bump_totals(orders=sum(c for c, _ in per_day.values()), order_revenue=sum(t for _, t in per_day.values()))
+    db.session.execute(UPSERT_DAILY_REVENUE, [
+        {'day': day, 'ride_count': 0, 'ride_revenue': 0, 'order_count': count, 'order_revenue': total}
+        for day, (count, total) in per_day.items()
+    ])
+    db.session.execute(UPSERT_RESTAURANT_STATS, [
+        {'restaurant_id': restaurant_id, 'count': count, 'revenue': total}
+        for restaurant_id, (count, total) in per_restaurant.items()
+    ])
+
+
+def rebuild_rollups():
+    """Recomputes every rollup table from the base tables in set-based statements.
+
+    Rides and orders are read from the live and archive tables together, so
+    archiving never changes the analytics.
+    """
+    ensure_archive_tables()
+    rides = both_tiers('rides', 'driver_id, fare, timestamp')
+    orders = both_tiers('orders', 'restaurant_id, total_amount, timestamp')
+    for table in ('platform_totals', 'daily_revenue', 'driver_stats', 'restaurant_stats'):
+        db.session.execute(text(f"DELETE FROM {table}"))
+    db.session.execute(text(f"""
+        INSERT INTO platform_totals (metric, value)
+        SELECT 'users', COUNT(*) FROM users
+        UNION ALL SELECT 'drivers', COUNT(*) FROM drivers
+        UNION ALL SELECT 'restaurants', COUNT(*) FROM restaurants
+        UNION ALL SELECT 'rides', COUNT(*) FROM {rides}
+        UNION ALL SELECT 'orders', COUNT(*) FROM {orders}
+        UNION ALL SELECT 'ride_revenue', ROUND(COALESCE(SUM(fare), 0), 2) FROM {rides}
+        UNION ALL SELECT 'order_revenue', ROUND(COALESCE(SUM(total_amount), 0), 2) FROM {orders}
+    """))
+    db.session.execute(text(f"""
+        INSERT INTO daily_revenue (revenue_date, ride_count, ride_revenue, order_count, order_revenue)
+        SELECT day, SUM(ride_count), ROUND(SUM(ride_revenue), 2), SUM(order_count), ROUND(SUM(order_revenue), 2) FROM (
+            SELECT date(timestamp) AS day, COUNT(*) AS ride_count, SUM(fare) AS ride_revenue,
+                   0 AS order_count, 0 AS order_revenue
+            FROM {rides} GROUP BY date(timestamp)
+            UNION ALL
+            SELECT date(timestamp), 0, 0, COUNT(*), SUM(total_amount)
+            FROM {orders} GROUP BY date(timestamp)
+        ) per_day GROUP BY day
+    """))
+    db.session.execute(text(f"""
+        INSERT INTO driver_stats (driver_id, ride_count, revenue)
+        SELECT driver_id, COUNT(*), ROUND(SUM(fare), 2) FROM {rides} GROUP BY driver_id
+    """))
+    db.session.execute(text(f"""
+        INSERT INTO restaurant_stats (restaurant_id, order_count, revenue)
+        SELECT restaurant_id, COUNT(*), ROUND(SUM(total_amount), 2) FROM {orders} GROUP BY restaurant_id
+    """))
+    db.session.commit()
+
+
+def both_tiers(table, columns):
+    return f"(SELECT {columns} FROM {table} UNION ALL SELECT {columns} FROM {archive_of(table)}) AS {table}"
+
+### Rating aggregates
+#
+# rating_aggregates keeps a running count, sum and 1-5 histogram per rated
+# driver/restaurant. Rating writes apply their delta in the same transaction
+# and copy the new average onto drivers.rating / restaurants.rating, so
+# nothing ever re-averages the ratings table. A target that was never rated
+# keeps the rating it was registered with; one whose ratings were all deleted
+# keeps its (zeroed) aggregate row and drops to 0, the unrated default.
+
+RATING_TARGETS = {'driver': ('drivers', 'driver_id'), 'restaurant': ('restaurants', 'restaurant_id')}
+RATING_SCORES = range(1, 6)
+
+UPSERT_RATING_AGGREGATE = text(f"""
+    INSERT INTO rating_aggregates (target_type, target_id, rating_count, score_sum,
+                                   {', '.join(f'score_{s}' for s in RATING_SCORES)})
+    VALUES (:target_type, :target_id, :count, :sum, {', '.join(f':score_{s}' for s in RATING_SCORES)})
+    ON CONFLICT (target_type, target_id) DO UPDATE SET
+        rating_count = rating_aggregates.rating_count + excluded.rating_count,
+        score_sum = rating_aggregates.score_sum + excluded.score_sum,
+        {', '.join(f'score_{s} = rating_aggregates.score_{s} + excluded.score_{s}' for s in RATING_SCORES)}
+""")
+
+
+def validate_rating(target_type, score):
+    if target_type not in RATING_TARGETS:
+        raise ApiError(f"target_type must be one of {', '.join(RATING_TARGETS)}")
+    if not isinstance(score, int) or isinstance(score, bool) or score not in RATING_SCORES:
+        raise ApiError('score must be an integer from 1 to 5')
+
+
+def refresh_target_ratings(target_type, target_ids=None):
+    """Copies the running averages onto the target table (all targets when ``target_ids`` is None)."""
+    table, pk = RATING_TARGETS[target_type]
+    aggregate = f"""
+        FROM rating_aggregates a WHERE a.target_type = :target_type AND a.target_id = {table}.{pk}
+    """
+    sql = f"""
+        UPDATE {table} SET rating = COALESCE(
+            (SELECT ROUND(a.score_sum * 1.0 / a.rating_count, 2) {aggregate} AND a.rating_count > 0), 0)
+        WHERE EXISTS (SELECT 1 {aggregate})
+    """
+    params = {'target_type': target_type}
+    if target_ids is not None:
+        sql += f" AND {pk} IN :ids"
+        params['ids'] = list(target_ids)
+        stmt = text(sql).bindparams(bindparam('ids', expanding=True))
+    else:
+        stmt = text(sql)
+    db.session.execute(stmt, params)
+
+
+def record_ratings(ratings, sign=1):
+    """Adds (sign=1) or removes (sign=-1) ``(target_type, target_id, score)`` ratings."""
+    per_target = {}
+    for target_type, target_id, score in ratings:
+        histogram = per_target.setdefault((target_type, target_id), [0] * len(RATING_SCORES))
+        histogram[score - 1] += sign
+    if not per_target:
+        return
+    db.session.execute(UPSERT_RATING_AGGREGATE, [
+        {'target_type': target_type, 'target_id': target_id,
+         'count': sum(histogram), 'sum': sum(s * n for s, n in zip(RATING_SCORES, histogram)),
+         **{f'score_{s}': n for s, n in zip(RATING_SCORES, histogram)}}
+        for (target_type, target_id), histogram in per_target.items()
+    ])
+    for target_type in RATING_TARGETS:
+        ids = [target_id for kind, target_id in per_target if kind == target_type]
+        if ids:
+            refresh_target_ratings(target_type, ids)
+            response_cache.bump(RATING_TARGETS[target_type][0])
+
+
+def rebuild_ratings():
+    """Recomputes rating_aggregates and the denormalized ratings in set-based statements.
+
+    Existing aggregate rows are zeroed rather than deleted, so targets whose
+    ratings were all removed keep a row and drop to 0 as they do on delete.
+    """
+    columns = ['rating_count', 'score_sum'] + [f'score_{s}' for s in RATING_SCORES]
+    db.session.execute(text(f"UPDATE rating_aggregates SET {', '.join(f'{c} = 0' for c in columns)}"))
+    db.session.execute(text(f"""
+        INSERT INTO rating_aggregates (target_type, target_id, {', '.join(columns)})
+        SELECT target_type, target_id, COUNT(*), SUM(score),
+               {', '.join(f'SUM(CASE WHEN score = {s} THEN 1 ELSE 0 END)' for s in RATING_SCORES)}
+        FROM ratings WHERE true GROUP BY target_type, target_id
+        ON CONFLICT (target_type, target_id) DO UPDATE SET
+            {', '.join(f'{c} = excluded.{c}' for c in columns)}
+    """))
+    for target_type in RATING_TARGETS:
+        refresh_target_ratings(target_type)
+        response_cache.bump(RATING_TARGETS[target_type][0])
+    db.session.commit()
+
+### Archive tier
+#
+# Finished rides and orders older than a cutoff move, with their order items
+# and payments, into ``<table>_archive`` tables so the live tables and their
+# indexes only hold recent data. On PostgreSQL the rides and orders archives
+# are partitioned by month (the live tables stay unpartitioned, since their
+# ids are referenced by foreign keys); on SQLite they are plain tables in the
+# same database. ``archive_watermarks`` records the cutoff per table: the
+# archive only holds rows older than it, so reads whose time range starts at
+# or after it never touch the archive.
+
+def archive_of(table):
+    return f'{table}_archive'
+
+
+ARCHIVED_MODELS = (Ride, Order, OrderItem, Payment)
+ARCHIVED_TABLES = {archive_of(model.__tablename__) for model in ARCHIVED_MODELS}
+PARTITIONED_ARCHIVES = ('rides', 'orders')
+ARCHIVE_BATCH_SIZE = 5000
+ORDER_STATUSES = ('placed', 'assigned', 'preparing', 'delivering', 'delivered', 'completed', 'cancelled')
+ORDER_FINAL_STATUSES = ('delivered', 'completed', 'cancelled')
+
+
+def ensure_archive_tables():
+    """Creates the archive tables (mirroring the live columns and indexes) if missing."""
+    dialect = db.engine.dialect
+    for model in ARCHIVED_MODELS:
+        table, pk = model.__table__, primary_key_of(model)
+        name = archive_of(table.name)
+        columns = [f'{c.name} {c.type.compile(dialect=dialect)}' for c in table.columns]
+        # Partial indexes serve queues on the live table only.
+        index_columns = [[c.name for c in index.columns] for index in table.indexes
+                         if index.dialect_options['postgresql']['where'] is None]
+        if dialect.name == 'postgresql' and table.name in PARTITIONED_ARCHIVES:
+            # A primary key on a partitioned table must include the partition key.
+            db.session.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} ({', '.join(columns)}) PARTITION BY RANGE (timestamp)"
+            ))
+            db.session.execute(text(f"CREATE TABLE IF NOT EXISTS {name}_default PARTITION OF {name} DEFAULT"))
+            index_columns.append([pk])
+        else:
+            db.session.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {name} ({', '.join(columns)}, PRIMARY KEY ({pk}))"
+            ))
+        for cols in index_columns:
+            db.session.execute(text(
+                f"CREATE INDEX IF NOT EXISTS ix_{name}_{'_'.join(cols)} ON {name} ({', '.join(cols)})"
+            ))
+    db.session.commit()
+
+
+def ensure_archive_partitions(table, first, last):
+    """Monthly partitions of ``table``'s archive covering ``first``..``last`` (PostgreSQL only)."""
+    if db.engine.dialect.name != 'postgresql' or table not in PARTITIONED_ARCHIVES:
+        return
+    name = archive_of(table)
+    month = date(first.year, first.month, 1)
+    while month <= last:
+        following = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+        db.session.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name}_y{month:%Y}m{month:%m} PARTITION OF {name} "
+            f"FOR VALUES FROM ('{month}') TO ('{following}')"
+        ))
+        month = following
+
+
+def move_rows(model, key, ids):
+    """Copies ``model`` rows whose ``key`` is in ``ids`` to the archive and deletes them."""
+    table = model.__table__.name
+    columns = ', '.join(model.__table__.columns.keys())
+    in_ids = bindparam('ids', expanding=True)
+    db.session.execute(text(
+        f"INSERT INTO {archive_of(table)} ({columns}) SELECT {columns} FROM {table} WHERE {key} IN :ids"
+    ).bindparams(in_ids), {'ids': ids})
+    return db.session.execute(text(f"DELETE FROM {table} WHERE {key} IN :ids").bindparams(in_ids),
+                              {'ids': ids}).rowcount
+
+
+def archive_before(model, cutoff, statuses, children, batch_size=ARCHIVE_BATCH_SIZE):
+    """Moves finished rows older than ``cutoff`` and their ``(child model, key)`` rows.
+
+    Rows with a pending payment stay live until it is settled (settlement
+    only reads the live table); a later run moves them. One transaction per
+    batch of ``batch_size`` parent rows; returns the number of rows moved
+    per table.
+    """
+    table, pk = model.__table__.name, primary_key_of(model)
+    params = {'cutoff': cutoff.isoformat(sep=' '), 'statuses': list(statuses), 'limit': batch_size}
+    candidates = f"FROM {table} WHERE timestamp < :cutoff AND status IN :statuses"
+    for child, key in children:
+        if child is Payment:
+            candidates += (f" AND NOT EXISTS (SELECT 1 FROM payments p"
+                           f" WHERE p.{key} = {table}.{pk} AND p.status = 'pending')")
+    expand = bindparam('statuses', expanding=True)
+    oldest = db.session.execute(text(f"SELECT MIN(timestamp) {candidates}").bindparams(expand), params).scalar()
+    moved = {table: 0, **{child.__table__.name: 0 for child, _ in children}}
+    if oldest is None:
+        return moved
+    if isinstance(oldest, str):
+        oldest = datetime.fromisoformat(oldest)
+    ensure_archive_partitions(table, oldest.date(), cutoff.date())
+
+    select_batch = text(f"SELECT {pk} {candidates} ORDER BY {pk} LIMIT :limit").bindparams(expand)
+    while True:
+        ids = db.session.execute(select_batch, params).scalars().all()
+        if not ids:
+            break
+        for child, key in children:
+            moved[child.__table__.name] += move_rows(child, key, ids)
+        moved[table] += move_rows(model, pk, ids)
+        db.session.execute(text("""
+            INSERT INTO archive_watermarks (table_name, archived_before) VALUES (:table, :cutoff)
+            ON CONFLICT (table_name) DO UPDATE SET archived_before = excluded.archived_before
+            WHERE excluded.archived_before > archive_watermarks.archived_before
+        """), {'table': table, 'cutoff': params['cutoff']})
+        db.session.commit()
+    return moved
+
+
+def time_range(model, args=None):
+    """SQL conditions for the ``start`` (inclusive) and ``end`` (exclusive) query parameters.
+
+    ``args`` is the mapping to read them from, the query string by default.
+    """
+    args = request.args if args is None else args
+    conditions, params = [], {}
+    for name, op in (('start', '>='), ('end', '<')):
+        value = args.get(name)
+        if value is None:
+            continue
+        if 'timestamp' not in model.__table__.columns:
+            raise ApiError(f'{model.__table__.name} cannot be filtered by time')
+        try:
+            params[name] = datetime.fromisoformat(str(value)).isoformat(sep=' ')
+        except ValueError:
+            raise ApiError(f'{name} must be an ISO date or datetime')
+        conditions.append(f'timestamp {op} :{name}')
+    return conditions, params
+
+
+def read_tiers(model, params):
+    """The tables a time-ranged read must cover; reads without a range see only the live table.
+
+    A payment is archived with its ride or order and may be newer than the
+    cutoff, so ranged payment reads include the archive once anything has
+    been archived.
+    """
+    table = model.__table__.name
+    if archive_of(table) not in ARCHIVED_TABLES or not params.keys() & {'start', 'end'}:
+        return [table]
+    if table in PARTITIONED_ARCHIVES:
+        watermark = db.session.execute(text(
+            "SELECT archived_before FROM archive_watermarks WHERE table_name = :table"
+        ), {'table': table}).scalar()
+        if watermark is None or params.get('start', '') >= str(watermark):
+            return [table]
+    elif db.session.execute(text("SELECT 1 FROM archive_watermarks LIMIT 1")).first() is None:
+        return [table]
+    return [table, archive_of(table)]
+
+
+def tiered_select(model, columns, conditions, params):
+    """``SELECT columns`` over the tiers ``read_tiers`` picks, with ``conditions`` applied in each."""
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    branches = [f"SELECT {', '.join(columns)} FROM {source}{where}" for source in read_tiers(model, params)]
+    if len(branches) == 1:
+        return branches[0]
+    return f"SELECT * FROM ({' UNION ALL '.join(branches)}) AS tiers"
+
+
+### Response cache
+
+class ResponseCache:
+    """In-process cache of serialized list responses for read-mostly tables.
+
+    Each table has a version counter that write routes bump after they
+    commit; an entry is only served while its table version is unchanged
+    and it is younger than ``ttl`` seconds (the TTL bounds staleness from
+    writes made by other worker processes). Entries are evicted least
+    recently used once ``max_bytes`` of bodies are held.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entry_bytes=8 * 1024 * 1024, ttl=30):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._versions = {}
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def version(self, table):
+        return self._versions.get(table, 0)
+
+    def bump(self, *tables):
+        with self._lock:
+            for table in tables:
+                self._versions[table] = self._versions.get(table, 0) + 1
+
+    def get(self, key, table):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['version'] != self.version(table) \
+                    or time.monotonic() - entry['stored_at'] > self.ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, table, version, body, headers):
+        if len(body) > self.max_entry_bytes:
+            return None
+        entry = {
+            'version': version,
+            'stored_at': time.monotonic(),
+            'body': body,
+            'etag': hashlib.sha1(body).hexdigest(),
+            'headers': headers,
+        }
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous['body'])
+            self._entries[key] = entry
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted['body'])
+                self.evictions += 1
+        return entry
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'versions': dict(self._versions),
+            }
+
+
+response_cache = ResponseCache()
+
+# Response headers kept alongside a cached body.
+CACHED_HEADERS = ('Content-Type', 'X-Next-Cursor')
+
+
+def cached(table):
+    """Serves a GET list route through ``response_cache`` with ETag support.
+
+    Hits (and ``If-None-Match`` revalidations of them) are answered without
+    touching the database. Responses larger than the per-entry limit are
+    streamed through uncached.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            key = (table, negotiate_serializer().mimetype, request.query_string)
+            entry = response_cache.get(key, table)
+            if entry is None:
+                version = response_cache.version(table)
+                response = view(*args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                chunks, size = [], 0
+                body_iter = iter(response.response)
+                for chunk in body_iter:
+                    chunk = chunk.encode() if isinstance(chunk, str) else chunk
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size > response_cache.max_entry_bytes:
+                        response.response = itertools.chain(chunks, body_iter)
+                        return response
+                headers = {h: response.headers[h] for h in CACHED_HEADERS if h in response.headers}
+                body = b''.join(chunks)
+                if hasattr(response, 'close'):
+                    response.close()
+                entry = response_cache.put(key, table, version, body, headers)
+            response = app.response_class(entry['body'], headers=entry['headers'])
+            response.vary.add('Accept')
+            response.set_etag(entry['etag'])
+            response.cache_control.no_cache = True
+            return response.make_conditional(request)
+        return wrapper
+    return decorator
+
+### Instrumentation
+#
+# Every request is timed and counted per route (the URL rule, so ids don't
+# explode the label space), and cursor hooks count and time the SQL it runs.
+# A statement slower than SLOW_QUERY_SECONDS, or the same statement issued
+# N_PLUS_ONE_THRESHOLD or more times in one request (a loop of single-row
+# queries), is logged and counted. Everything is exported in the Prometheus
+# text format at /metrics; with SERVER_TIMING=1 each response also carries a
+# Server-Timing header. Metrics are per process.
+
+SLOW_QUERY_SECONDS = float(os.environ.get('SLOW_QUERY_SECONDS', 0.1))
+N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 10))
+SERVER_TIMING = os.environ.get('SERVER_TIMING', '').lower() in ('1', 'true', 'yes')
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Metrics:
+    """Thread-safe counters and cumulative histograms rendered as Prometheus text."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._help = {}
+        self._counters = {}    # name -> {labels: value}
+        self._histograms = {}  # name -> (buckets, {labels: [bucket counts..., sum, count]})
+
+    def counter(self, name, help_text):
+        self._help[name] = ('counter', help_text)
+        self._counters[name] = {}
+
+    def histogram(self, name, help_text, buckets):
+        self._help[name] = ('histogram', help_text)
+        self._histograms[name] = (buckets, {})
+
+    def inc(self, name, labels, amount=1):
+        with self._lock:
+            series = self._counters[name]
+            series[labels] = series.get(labels, 0) + amount
+
+    def observe(self, name, labels, value):
+        buckets, series = self._histograms[name]
+        index = bisect.bisect_left(buckets, value)
+        with self._lock:
+            counts = series.get(labels)
+            if counts is None:
+                counts = series[labels] = [0] * (len(buckets) + 2)
+            if index < len(buckets):
+                counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def render(self):
+        def label_text(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ''
+            return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+        lines = []
+        with self._lock:
+            for name, (kind, help_text) in self._help.items():
+                lines.append(f'# HELP {name} {help_text}')
+                lines.append(f'# TYPE {name} {kind}')
+                if kind == 'counter':
+                    for labels, value in self._counters[name].items():
+                        lines.append(f'{name}{label_text(labels)} {value}')
+                    continue
+                buckets, series = self._histograms[name]
+                for labels, counts in series.items():
+                    cumulative = 0
+                    for bound, count in zip(buckets, counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{label_text(labels, [("le", bound)])} {cumulative}')
+                    lines.append(f'{name}_bucket{label_text(labels, [("le", "+Inf")])} {counts[-1]}')
+                    lines.append(f'{name}_sum{label_text(labels)} {counts[-2]}')
+                    lines.append(f'{name}_count{label_text(labels)} {counts[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+metrics.counter('http_requests_total', 'Requests by route, method and status code.')
+metrics.histogram('http_request_duration_seconds', 'Request latency by route.', LATENCY_BUCKETS)
+metrics.histogram('http_response_size_bytes', 'Response body size by route (streamed bodies excluded).', SIZE_BUCKETS)
+metrics.histogram('db_queries_per_request', 'SQL statements issued per request.', QUERY_COUNT_BUCKETS)
+metrics.histogram('db_time_per_request_seconds', 'Time spent in SQL per request.', LATENCY_BUCKETS)
+metrics.counter('db_slow_queries_total', f'Statements slower than {SLOW_QUERY_SECONDS}s by route.')
+metrics.counter('db_n_plus_one_total', f'Requests repeating one statement {N_PLUS_ONE_THRESHOLD}+ times, by route.')
+
+
+def route_label():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    g.sql_count = 0
+    g.sql_seconds = 0.0
+    g.sql_statements = Counter()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    if not has_request_context() or 'sql_statements' not in g:
+        return
+    g.sql_count += 1
+    g.sql_seconds += elapsed
+    if not executemany:
+        g.sql_statements[statement] += 1
+    if elapsed >= SLOW_QUERY_SECONDS:
+        metrics.inc('db_slow_queries_total', (('route', route_label()),))
+        app.logger.warning('slow query (%.0f ms) in %s: %s', elapsed * 1000, route_label(), ' '.join(statement.split())[:300])
+
+
+with app.app_context():
+    for engine in db.engines.values():
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    route = (('route', route_label()),)
+    metrics.inc('http_requests_total', route + (('method', request.method), ('status', response.status_code)))
+    metrics.observe('http_request_duration_seconds', route, elapsed)
+    if not response.is_streamed:
+        metrics.observe('http_response_size_bytes', route, response.calculate_content_length() or 0)
+    metrics.observe('db_queries_per_request', route, g.sql_count)
+    metrics.observe('db_time_per_request_seconds', route, g.sql_seconds)
+    if g.sql_statements:
+        statement, repeats = g.sql_statements.most_common(1)[0]
+        if repeats >= N_PLUS_ONE_THRESHOLD:
+            metrics.inc('db_n_plus_one_total', route)
+            app.logger.warning('possible N+1 in %s: statement ran %d times: %s',
+                               route_label(), repeats, ' '.join(statement.split())[:300])
+    if SERVER_TIMING:
+        response.headers.add('Server-Timing', f'db;dur={g.sql_seconds * 1000:.2f};desc="{g.sql_count} queries"')
+        response.headers.add('Server-Timing', f'app;dur={elapsed * 1000:.2f}')
+    return response
+
+### Read replicas
+#
+# With DATABASE_READ_URL set, GET requests (and the read-only /api/batch)
+# run on a read replica, taken round-robin from the ones that passed their
+# last health check; with none healthy they read from the primary. Every
+# other request writes, and stays on the primary. A successful write sets a
+# short-lived ``read_primary`` cookie, and a request carrying it or the
+# ``X-Read-Primary`` header reads from the primary too, so a client sees its
+# own writes. Replicas are checked every REPLICA_CHECK_SECONDS by a
+# background thread: one that cannot be queried, or lags the primary by
+# more than REPLICA_MAX_LAG_SECONDS, is skipped until it passes again. A
+# replica that fails during a request is taken out straight away.
+
+REPLICA_CHECK_SECONDS = float(os.environ.get('REPLICA_CHECK_SECONDS', 5))
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 30))
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+# POST endpoints that only read.
+REPLICA_READ_ENDPOINTS = {'batch_read'}
+
+# Seconds a replica is behind. A PostgreSQL standby reports its replay
+# delay; a SQLite snapshot (flask replica_snapshot) records when it was taken.
+REPLICA_LAG_SQL = {
+    'postgresql': text("""
+        SELECT CASE WHEN pg_is_in_recovery()
+                    THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                    ELSE 0 END
+    """),
+    'sqlite': text("SELECT (julianday('now') - julianday(taken_at)) * 86400 FROM replica_snapshot"),
+}
+
+
+class ReplicaPool:
+    """Round-robin over the healthy read replicas, health-checked in the background."""
+
+    def __init__(self, names, check_seconds=REPLICA_CHECK_SECONDS, max_lag=REPLICA_MAX_LAG_SECONDS):
+        self.names = list(names)
+        self.check_seconds = check_seconds
+        self.max_lag = max_lag
+        self._lock = threading.Lock()
+        self._next = itertools.cycle(self.names)
+        self._health = {name: {'healthy': True, 'lag_seconds': None, 'error': None, 'checked_at': None}
+                        for name in self.names}
+        self._thread = None
+        self.reads = Counter()
+        self.primary_reads = 0
+
+    def pick(self):
+        """Name of the next healthy replica, or None to read from the primary."""
+        self._start()
+        with self._lock:
+            for _ in self.names:
+                name = next(self._next)
+                if self._health[name]['healthy']:
+                    self.reads[name] += 1
+                    return name
+            self.primary_reads += 1
+            return None
+
+    def mark_down(self, name, error):
+        with self._lock:
+            self._health[name].update(healthy=False, error=error)
+
+    def check(self, name):
+        """Queries a replica's lag and records whether it may serve reads."""
+        engine = db.engines[name]
+        lag, error = None, None
+        try:
+            with engine.connect() as conn:
+                lag = float(conn.execute(REPLICA_LAG_SQL.get(engine.dialect.name, text('SELECT 0'))).scalar() or 0)
+            if lag > self.max_lag:
+                error = f'{lag:.1f}s behind the primary'
+        except SQLAlchemyError as exc:
+            error = str(exc).splitlines()[0]
+        with self._lock:
+            self._health[name].update(healthy=error is None, error=error,
+                                      lag_seconds=None if lag is None else round(lag, 3),
+                                      checked_at=datetime.now(timezone.utc).isoformat(timespec='seconds'))
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='replica-health', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            with app.app_context():
+                for name in self.names:
+                    self.check(name)
+            time.sleep(self.check_seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'replicas': {name: {**self._health[name], 'url': db.engines[name].url.render_as_string(),
+                                    'reads': self.reads[name]} for name in self.names},
+                'primary_reads': self.primary_reads,
+            }
+
+
+with app.app_context():
+    replicas = ReplicaPool(name for name in db.engines if name is not None)
+
+
+def reads_primary():
+    """True when the request must see the primary: a write, or a client reading its own writes."""
+    if request.method not in ('GET', 'HEAD') and request.endpoint not in REPLICA_READ_ENDPOINTS:
+        return True
+    return bool(request.headers.get('X-Read-Primary') or request.cookies.get('read_primary'))
+
+
+@app.before_request
+def route_reads():
+    if replicas.names and not reads_primary():
+        g.read_bind = replicas.pick()
+
+
+@app.after_request
+def stick_to_primary(response):
+    if replicas.names and request.method not in ('GET', 'HEAD', 'OPTIONS') \
+            and request.endpoint not in REPLICA_READ_ENDPOINTS and response.status_code < 400:
+        response.set_cookie('read_primary', '1', max_age=REPLICA_STICKY_SECONDS, samesite='Lax')
+    return response
+
+
+@app.teardown_request
+def drop_failed_replica(exc):
+    if isinstance(exc, DBAPIError) and g.get('read_bind'):
+        replicas.mark_down(g.read_bind, str(exc).splitlines()[0])
+
+### Live locations
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+COURIER_STATUSES = ('available', 'busy', 'offline')
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class LocationGrid:
+    """In-memory uniform grid over the positions of available couriers.
+
+    Positions are bucketed into ``cell_deg`` x ``cell_deg`` cells. A k-nearest
+    query walks rings of cells outwards from the query point and stops as
+    soon as the next ring cannot hold anything closer than the k-th best
+    candidate, so its cost follows local density rather than fleet size.
+
+    The database stays the source of truth: the grid is (re)loaded from it
+    on first use and every ``refresh_seconds`` afterwards, which also picks
+    up changes made by other worker processes.
+    """
+
+    def __init__(self, table, pk, cell_deg=0.01, refresh_seconds=30):
+        self.table = table
+        self.pk = pk
+        self.cell_deg = cell_deg
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._cells = {}
+        self._positions = {}
+        self._loaded_at = None
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def _put(self, key, lat, lng):
+        self._discard(key)
+        cell = self._cell(lat, lng)
+        self._positions[key] = (lat, lng, cell)
+        self._cells.setdefault(cell, set()).add(key)
+
+    def _discard(self, key):
+        previous = self._positions.pop(key, None)
+        if previous is not None:
+            members = self._cells[previous[2]]
+            members.discard(key)
+            if not members:
+                del self._cells[previous[2]]
+
+    def _ensure_loaded(self):
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return
+        rows = db.session.execute(text(f"""
+            SELECT {self.pk}, lat, lng FROM {self.table}
+            WHERE status = 'available' AND lat IS NOT NULL AND lng IS NOT NULL
+        """))
+        self._cells, self._positions = {}, {}
+        for key, lat, lng in rows:
+            self._put(key, lat, lng)
+        self._loaded_at = time.monotonic()
+
+    def update(self, key, lat, lng, available):
+        with self._lock:
+            if available and lat is not None and lng is not None:
+                self._put(key, lat, lng)
+            else:
+                self._discard(key)
+
+    def discard(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def _collect(self, cells):
+        """Copies ``(key, lat, lng)`` out of ``cells``; call with the lock held."""
+        return [(key, *self._positions[key][:2]) for cell in cells for key in self._cells.get(cell, ())]
+
+    @staticmethod
+    def _ring(row, col, ring, stretch):
+        """Cells ``ring`` rows or ``ring * stretch`` columns out that no smaller ring covers."""
+        if not ring:
+            return [(row, col)]
+        span, inner = ring * stretch, (ring - 1) * stretch
+        cells = [(r, c) for r in (row - ring, row + ring) for c in range(col - span, col + span + 1)]
+        for r in range(row - ring + 1, row + ring):
+            cells.extend((r, c) for c in range(col - span, col - inner))
+            cells.extend((r, c) for c in range(col + inner + 1, col + span + 1))
+        return cells
+
+    def nearest(self, lat, lng, k, radius_km):
+        """Returns up to ``k`` ``(distance_km, key)`` pairs within ``radius_km``.
+
+        The lock is only held while positions are copied out of the grid;
+        distances are computed outside it.
+        """
+        edge_km = self.cell_deg * KM_PER_DEGREE
+        max_ring = int(radius_km / edge_km) + 1
+        # Longitude cells narrow towards the poles, so a ring reaches `stretch`
+        # columns per row; ring r then lies at least (r - 1) * edge_km away.
+        narrowest = math.cos(math.radians(min(abs(lat) + (max_ring + 1) * self.cell_deg, 90)))
+        stretch = math.ceil(1 / max(narrowest, 1e-9))
+        row, col = self._cell(lat, lng)
+        found = []
+
+        def consider(candidates):
+            for key, p_lat, p_lng in candidates:
+                distance = haversine_km(lat, lng, p_lat, p_lng)
+                if distance <= radius_km:
+                    found.append((distance, key))
+            found.sort()
+            del found[k:]
+
+        with self._lock:
+            self._ensure_loaded()
+            scan = (2 * max_ring + 1) * (2 * max_ring * stretch + 1) > len(self._cells)
+            if scan:
+                # Fewer occupied cells than the rings would visit (a sparse
+                # fleet, or a query near a pole): check them all instead.
+                candidates = self._collect([cell for cell in self._cells if abs(cell[0] - row) <= max_ring])
+        if scan:
+            consider(candidates)
+            return found
+        for ring in range(max_ring + 1):
+            if len(found) >= k and found[k - 1][0] <= (ring - 1) * edge_km:
+                break
+            cells = self._ring(row, col, ring, stretch)
+            with self._lock:
+                candidates = self._collect(cells)
+            consider(candidates)
+        return found
+
+
+driver_locations = LocationGrid('drivers', 'driver_id')
+partner_locations = LocationGrid('delivery_partners', 'partner_id')
+
+
+def position_of(data):
+    """Parses ``lat``/``lng`` from a request body, raising ApiError unless both are valid."""
+    try:
+        lat, lng = float(data['lat']), float(data['lng'])
+    except (KeyError, TypeError, ValueError):
+        raise ApiError('lat and lng are required numbers')
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ApiError('lat/lng out of range')
+    return lat, lng
+
+
+def update_location(model, grid, key):
+    """Persists a reported position (and optional status) and updates the grid."""
+    data = request.json or {}
+    lat, lng = position_of(data)
+    if data.get('status') and data['status'] not in COURIER_STATUSES:
+        raise ApiError('status must be one of: ' + ', '.join(COURIER_STATUSES))
+    table, pk = model.__table__.name, primary_key_of(model)
+    params = {'id': key, 'lat': lat, 'lng': lng, 'now': datetime.now(timezone.utc).replace(tzinfo=None)}
+    status_sql = ''
+    if data.get('status'):
+        status_sql = ', status = :status'
+        params['status'] = data['status']
+    if prefers_async():
+        return enqueue_write('location', {'table': table, 'status': None, **params})
+    sql = text(f"""
+        UPDATE {table} SET lat = :lat, lng = :lng, location_updated_at = :now{status_sql}
+        WHERE {pk} = :id
+        RETURNING status
+    """)
+    status = db.session.execute(sql, params).scalar()
+    if status is None:
+        return jsonify({'error':'not found'}), 404
+    db.session.commit()
+    response_cache.bump(table)
+    grid.update(key, lat, lng, status == 'available')
+    return jsonify({'status': 'updated', pk: key, 'lat': lat, 'lng': lng, 'availability': status})
+
+
+def nearby(model, grid):
+    """k nearest available couriers to ``?lat=&lng=`` (``k`` default 5, ``radius_km`` default 10)."""
+    lat = float_arg('lat', -90, 90)
+    lng = float_arg('lng', -180, 180)
+    k = int_arg('k', 5, maximum=100)
+    radius_km = float_arg('radius_km', 0, 100, default=10)
+    found = grid.nearest(lat, lng, k, radius_km)
+    if not found:
+        return jsonify([])
+    pk = primary_key_of(model)
+    sql = text(f"SELECT * FROM {model.__table__.name} WHERE {pk} IN :ids").bindparams(
+        bindparam('ids', expanding=True))
+    rows = {row[pk]: row for row in result_to_dict(db.session.execute(sql, {'ids': [key for _, key in found]}))}
+    return jsonify([
+        dict(rows[key], distance_km=round(distance, 3))
+        for distance, key in found if key in rows
+    ])
+
+### Fare engine
+
+# Straight-line distance is scaled by this to approximate road distance.
+ROAD_FACTOR = 1.3
+RATE_CARDS = {
+    'bike': {'base': 20, 'per_km': 6, 'minimum': 30},
+    'auto': {'base': 30, 'per_km': 10, 'minimum': 40},
+    'mini': {'base': 50, 'per_km': 12, 'minimum': 80},
+    'sedan': {'base': 70, 'per_km': 15, 'minimum': 100},
+    'suv': {'base': 100, 'per_km': 20, 'minimum': 150},
+}
+DEFAULT_VEHICLE_CLASS = 'mini'
+MAX_QUOTES_PER_REQUEST = 1000
+
+# Named pickup/drop points understood in place of "lat,lng".
+KNOWN_PLACES = {
+    'koramangala': (12.9352, 77.6245),
+    'indiranagar': (12.9716, 77.6412),
+    'whitefield': (12.9698, 77.7500),
+    'jayanagar': (12.9250, 77.5838),
+    'mg road': (12.9750, 77.6060),
+    'banashankari': (12.9250, 77.5480),
+    'basavanagudi': (12.9417, 77.5755),
+    'hsr layout': (12.9121, 77.6446),
+    'airport': (13.1986, 77.7066),
+}
+
+
+def resolve_place(place):
+    """Turns ``"lat,lng"`` or a known place name into a coordinate pair."""
+    if not isinstance(place, str):
+        raise ValueError('locations must be strings')
+    if ',' in place:
+        try:
+            lat, lng = (float(part) for part in place.split(','))
+        except ValueError:
+            raise ValueError(f'cannot parse coordinates {place!r}')
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            raise ValueError(f'coordinates out of range: {place!r}')
+        return round(lat, 5), round(lng, 5)
+    coords = KNOWN_PLACES.get(place.strip().lower())
+    if coords is None:
+        raise ValueError(f'unknown location {place!r}')
+    return coords
+
+
+class RouteCache:
+    """Bounded LRU of route distances keyed by (source, destination) coordinates."""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+route_cache = RouteCache()
+
+
+def route_distances_km(pairs):
+    """Road-distance estimates for ``((lat, lng), (lat, lng))`` pairs.
+
+    Cached pairs are answered from the LRU; the rest go through one
+    vectorised haversine pass.
+    """
+    distances = [route_cache.get(pair) for pair in pairs]
+    missing = [i for i, distance in enumerate(distances) if distance is None]
+    if missing:
+        coords = np.radians(np.array([pairs[i][0] + pairs[i][1] for i in missing], dtype=float))
+        lat1, lng1, lat2, lng2 = coords.T
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+        km = 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a)) * ROAD_FACTOR
+        for i, distance in zip(missing, km.tolist()):
+            distances[i] = distance
+            route_cache.put(pairs[i], distance)
+    return distances
+
+
+def quote_fares(trips):
+    """Prices ``{source, destination, vehicle_class}`` trips in one pass.
+
+    Raises ApiError listing every invalid trip.
+    """
+    pairs, classes, errors = [], [], []
+    for index, trip in enumerate(trips):
+        try:
+            if not isinstance(trip, dict):
+                raise ValueError('trip must be a JSON object')
+            vehicle_class = trip.get('vehicle_class') or DEFAULT_VEHICLE_CLASS
+            if vehicle_class not in RATE_CARDS:
+                raise ValueError('vehicle_class must be one of: ' + ', '.join(RATE_CARDS))
+            pairs.append((resolve_place(trip.get('source')), resolve_place(trip.get('destination'))))
+            classes.append(vehicle_class)
+        except ValueError as err:
+            errors.append({'row': index, 'error': str(err)})
+    if errors:
+        raise ApiError('invalid trips', errors=errors[:MAX_BULK_ERRORS])
+    if not pairs:
+        return []
+
+    distances = np.array(route_distances_km(pairs))
+    base = np.array([RATE_CARDS[c]['base'] for c in classes], dtype=float)
+    per_km = np.array([RATE_CARDS[c]['per_km'] for c in classes], dtype=float)
+    minimum = np.array([RATE_CARDS[c]['minimum'] for c in classes], dtype=float)
+    fares = np.round(np.maximum(base + per_km * distances, minimum), 2)
+    return [
+        {
+            'source': trip['source'],
+            'destination': trip['destination'],
+            'vehicle_class': vehicle_class,
+            'distance_km': round(distance, 2),
+            'fare': fare,
+        }
+        for trip, vehicle_class, distance, fare in zip(trips, classes, distances.tolist(), fares.tolist())
+    ]
+
+### Ride dispatch
+
+RIDE_STATUSES = ('requested', 'accepted', 'ongoing', 'completed', 'cancelled')
+# Ride statuses that hand the driver back to the available pool.
+RIDE_FINAL_STATUSES = ('completed', 'cancelled')
+
+
+def claim_driver(candidate_ids=None):
+    """Atomically flips one available driver to busy and returns its id.
+
+    ``candidate_ids`` restricts the claim to those drivers, tried in the
+    given order. Returns None when nobody could be claimed. PostgreSQL uses
+    ``FOR UPDATE SKIP LOCKED`` so concurrent dispatchers move on to the next
+    free driver instead of queueing behind each other; SQLite holds the
+    database write lock for the conditional UPDATE, which makes the
+    check-and-set atomic there.
+    """
+    where, order = "status = 'available'", 'driver_id'
+    if candidate_ids is not None:
+        if not candidate_ids:
+            return None
+        where += ' AND driver_id IN :ids'
+        order = 'CASE driver_id ' + ' '.join(
+            f'WHEN {int(key)} THEN {rank}' for rank, key in enumerate(candidate_ids)) + ' END'
+
+    def prepare(sql):
+        stmt = text(sql)
+        if candidate_ids is not None:
+            stmt = stmt.bindparams(bindparam('ids', value=list(candidate_ids), expanding=True))
+        return stmt
+
+    if db.engine.dialect.name == 'postgresql':
+        driver_id = db.session.execute(prepare(f"""
+            SELECT driver_id FROM drivers WHERE {where}
+            ORDER BY {order} LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        """)).scalar()
+        if driver_id is not None:
+            db.session.execute(text("UPDATE drivers SET status = 'busy' WHERE driver_id = :id"), {'id': driver_id})
+        return driver_id
+
+    return db.session.execute(prepare(f"""
+        UPDATE drivers SET status = 'busy'
+        WHERE status = 'available' AND driver_id = (
+            SELECT driver_id FROM drivers WHERE {where} ORDER BY {order} LIMIT 1
+        )
+        RETURNING driver_id
+    """)).scalar()
+
+
+def release_driver(driver_id):
+    """Returns a busy driver to the available pool; gives back its position row or None.
+
+    A driver who still has another unfinished ride stays busy.
+    """
+    return db.session.execute(text("""
+        UPDATE drivers SET status = 'available'
+        WHERE driver_id = :id AND status = 'busy'
+          AND NOT EXISTS (SELECT 1 FROM rides WHERE driver_id = :id AND status NOT IN :final)
+        RETURNING lat, lng
+    """).bindparams(bindparam('final', expanding=True)), {'id': driver_id, 'final': RIDE_FINAL_STATUSES}).first()
+
+### Order assignment
+#
+# Placed orders without a partner are matched to available delivery partners
+# in batches ("ticks") rather than one at a time. Orders are grouped by their
+# restaurant's position (restaurants.location, a known place or "lat,lng"),
+# each restaurant keeps its ASSIGN_CANDIDATES nearest partners per waiting
+# order as candidate pairs, and the pairs are taken greedily in order of
+# distance: a partner serves one order and a restaurant's oldest orders get
+# its closest partners. The order updates and partner status flips commit in
+# one transaction. Run `flask assign_orders` as the periodic worker.
+
+ASSIGN_INTERVAL_SECONDS = float(os.environ.get('ASSIGN_INTERVAL_SECONDS', 5))
+ASSIGN_MAX_KM = float(os.environ.get('ASSIGN_MAX_KM', 15))
+ASSIGN_BATCH_LIMIT = 20000
+ASSIGN_CANDIDATES = 3
+# Bounds the site x partner distance matrix computed at once.
+ASSIGN_MATRIX_CELLS = 2_000_000
+
+
+def haversine_matrix_km(lat1, lng1, lat2, lng2):
+    """Distances between every point of the first set (rows) and the second (columns)."""
+    lat1, lng1 = np.radians(lat1)[:, None], np.radians(lng1)[:, None]
+    lat2, lng2 = np.radians(lat2)[None, :], np.radians(lng2)[None, :]
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def candidate_pairs(sites, demand, partners, max_km):
+    """``(site, partner, km)`` arrays: each site's nearest ``demand * ASSIGN_CANDIDATES`` partners within ``max_km``."""
+    site_of, partner_of, distances = [], [], []
+    rows = max(1, ASSIGN_MATRIX_CELLS // len(partners))
+    for start in range(0, len(sites), rows):
+        km = haversine_matrix_km(sites[start:start + rows, 0], sites[start:start + rows, 1],
+                                 partners[:, 0], partners[:, 1])
+        for offset, row in enumerate(km):
+            keep = min(len(partners), int(demand[start + offset]) * ASSIGN_CANDIDATES)
+            if not keep:
+                continue
+            nearest = np.argpartition(row, keep - 1)[:keep] if keep < len(partners) else np.arange(len(partners))
+            nearest = nearest[row[nearest] <= max_km]
+            site_of.append(np.full(len(nearest), start + offset))
+            partner_of.append(nearest)
+            distances.append(row[nearest])
+    if not site_of:
+        return np.empty(0, int), np.empty(0, int), np.empty(0)
+    return np.concatenate(site_of), np.concatenate(partner_of), np.concatenate(distances)
+
+
+def match_partners(site_coords, demand, partner_coords, max_km=ASSIGN_MAX_KM):
+    """Greedy distance matching of sites (with ``demand`` orders each) to partners.
+
+    Returns ``(site index, partner index, distance)`` triples; each partner
+    appears at most once and site ``i`` at most ``demand[i]`` times. When
+    every candidate of a site was taken by closer matches, the leftover
+    sites and partners are matched again in another pass.
+    """
+    sites, partners = np.asarray(site_coords, dtype=float), np.asarray(partner_coords, dtype=float)
+    remaining = np.array(demand, dtype=int)
+    free = np.arange(len(partners))
+    matches = []
+    while len(free) and remaining.any():
+        site_of, partner_of, km = candidate_pairs(sites, remaining, partners[free], max_km)
+        taken = np.zeros(len(free), dtype=bool)
+        matched = len(matches)
+        for pair in np.argsort(km, kind='stable').tolist():
+            site, partner = site_of[pair], partner_of[pair]
+            if remaining[site] and not taken[partner]:
+                remaining[site] -= 1
+                taken[partner] = True
+                matches.append((int(site), int(free[partner]), float(km[pair])))
+        if len(matches) == matched:
+            break
+        free = free[~taken]
+    return matches
+
+
+def assign_orders(limit=ASSIGN_BATCH_LIMIT, max_km=ASSIGN_MAX_KM):
+    """One dispatch tick: matches waiting orders to available partners and commits.
+
+    On PostgreSQL the orders and partners are read ``FOR UPDATE SKIP LOCKED``,
+    so concurrent ticks (or claims) work on disjoint rows. On SQLite the
+    writes are conditional and the tick is rolled back if any of them lost a
+    race. Returns a dict of counts.
+    """
+    locking = ' FOR UPDATE OF o SKIP LOCKED' if db.engine.dialect.name == 'postgresql' else ''
+    orders = db.session.execute(text(f"""
+        SELECT o.order_id, r.location FROM orders o JOIN restaurants r ON r.restaurant_id = o.restaurant_id
+        WHERE o.status = 'placed' AND o.partner_id IS NULL
+        ORDER BY o.order_id LIMIT :limit{locking}
+    """), {'limit': limit}).all()
+    stats = {'pending': len(orders), 'partners': 0, 'assigned': 0, 'unlocated': 0}
+    if not orders:
+        db.session.rollback()
+        return stats
+    partners = db.session.execute(text(f"""
+        SELECT partner_id, lat, lng FROM delivery_partners
+        WHERE status = 'available' AND lat IS NOT NULL AND lng IS NOT NULL
+        ORDER BY partner_id{locking.replace(' OF o', '')}
+    """)).all()
+    stats['partners'] = len(partners)
+
+    # Orders waiting at each distinct restaurant position, oldest first.
+    sites, places = {}, {}
+    for order_id, location in orders:
+        if location not in places:
+            try:
+                places[location] = resolve_place(location)
+            except ValueError:
+                places[location] = None
+        coords = places[location]
+        if coords is None:
+            stats['unlocated'] += 1
+        else:
+            sites.setdefault(coords, []).append(order_id)
+    site_coords = list(sites)
+    matches = match_partners(site_coords, [len(sites[c]) for c in site_coords],
+                             [(lat, lng) for _, lat, lng in partners], max_km)
+    if not matches:
+        db.session.rollback()
+        return stats
+
+    queues = [iter(sites[c]) for c in site_coords]
+    assignments = [{'order_id': next(queues[site]), 'partner_id': partners[partner].partner_id}
+                   for site, partner, _ in matches]
+    updated = db.session.execute(text("""
+        UPDATE orders SET partner_id = :partner_id, status = 'assigned'
+        WHERE order_id = :order_id AND status = 'placed' AND partner_id IS NULL
+    """), assignments).rowcount
+    flipped = db.session.execute(text("""
+        UPDATE delivery_partners SET status = 'busy' WHERE partner_id = :partner_id AND status = 'available'
+    """), assignments).rowcount
+    if not locking and (updated != len(assignments) or flipped != len(assignments)):
+        db.session.rollback()
+        stats['conflicts'] = len(assignments)
+        return stats
+    db.session.commit()
+
+    for assignment in assignments:
+        partner_locations.discard(assignment['partner_id'])
+    stats['assigned'] = len(assignments)
+    stats['mean_km'] = round(sum(km for _, _, km in matches) / len(matches), 3)
+    publish('orders', 'bulk_updated', {'count': len(assignments)})
+    publish('delivery_partners', 'bulk_updated', {'count': len(assignments)})
+    return stats
+
+
+def release_partner(partner_id):
+    """Returns a busy delivery partner to the available pool; gives back its position row or None.
+
+    A partner who still carries another unfinished order stays busy.
+    """
+    return db.session.execute(text("""
+        UPDATE delivery_partners SET status = 'available'
+        WHERE partner_id = :id AND status = 'busy'
+          AND NOT EXISTS (SELECT 1 FROM orders WHERE partner_id = :id AND status NOT IN :final)
+        RETURNING lat, lng
+    """).bindparams(bindparam('final', expanding=True)), {'id': partner_id, 'final': ORDER_FINAL_STATUSES}).first()
+
+### Order pricing
+
+MAX_CART_LINES = 100
+
+
+def is_int(value):
+    """True for a JSON integer; bools are ints to Python but not to the API."""
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def cart_line(item):
+    """Returns ``(item_id, quantity)`` for a well-formed cart line, else None."""
+    if not isinstance(item, dict):
+        return None
+    item_id, quantity = item.get('item_id'), item.get('quantity', 1)
+    if not is_int(item_id) or not is_int(quantity) or quantity < 1:
+        return None
+    return item_id, quantity
+
+
+def price_cart(restaurant_id, items):
+    """Prices ``[{item_id, quantity}, ...]`` from the menu in one query.
+
+    Returns ``(total, lines)`` with repeated items merged. Raises ApiError for
+    a malformed cart, for items that are unknown or from another restaurant
+    (400), and for unavailable items (409).
+    """
+    if not isinstance(items, list) or not items:
+        raise ApiError('items must be a non-empty list of {item_id, quantity}')
+    if len(items) > MAX_CART_LINES:
+        raise ApiError(f'at most {MAX_CART_LINES} items per order')
+    quantities = Counter()
+    for item in items:
+        line = cart_line(item)
+        if line is None:
+            raise ApiError('items need an integer item_id and a positive quantity')
+        quantities[line[0]] += line[1]
+
+    menu = {row.item_id: row for row in db.session.execute(text("""
+        SELECT item_id, restaurant_id, price, availability FROM menu_items WHERE item_id IN :ids
+    """).bindparams(bindparam('ids', expanding=True)), {'ids': list(quantities)})}
+    unknown = [i for i in quantities if i not in menu or menu[i].restaurant_id != restaurant_id]
+    if unknown:
+        raise ApiError('items not on this restaurant\'s menu', items=unknown)
+    unavailable = [i for i in quantities if not menu[i].availability]
+    if unavailable:
+        raise ApiError('some items are unavailable', status=409, items=unavailable)
+
+    total = sum(Decimal(str(menu[i].price)) * quantity for i, quantity in quantities.items())
+    return total.quantize(Decimal('0.01')), [
+        {'item_id': i, 'quantity': quantity} for i, quantity in quantities.items()
+    ]
+
+### Payment settlement
+#
+# Wallet payments are created ``pending``; the settlement worker (flask
+# settle_payments) takes them in payment_id order, a chunk per transaction.
+# Each user's payments in the chunk are decided oldest first against what is
+# left of the balance: a payment that fits is paid, one that doesn't fails
+# and later, smaller ones may still be paid. Payments for a cancelled ride or
+# order fail without a debit. The outcomes are then written with set-based
+# statements: one UPDATE per outcome and one UPDATE ... FROM that debits the
+# wallets by what was paid.
+
+PAYMENT_STATUSES = ('pending', 'paid', 'failed')
+SETTLE_INTERVAL_SECONDS = float(os.environ.get('SETTLE_INTERVAL_SECONDS', 10))
+SETTLE_BATCH_SIZE = 5000
+
+SETTLE_CLAIM_SQL = """
+    SELECT p.payment_id, p.user_id, p.amount,
+           CASE WHEN COALESCE(r.status, o.status) = 'cancelled' THEN 1 ELSE 0 END AS cancelled
+    FROM payments p
+    LEFT JOIN rides r ON r.ride_id = p.ride_id
+    LEFT JOIN orders o ON o.order_id = p.order_id
+    WHERE p.status = 'pending' AND p.mode = 'wallet'
+    ORDER BY p.payment_id LIMIT :limit{locking}
+"""
+
+WALLET_BALANCES_SQL = """
+    SELECT user_id, wallet_balance FROM users WHERE user_id IN :ids ORDER BY user_id{locking}
+"""
+
+MARK_PAYMENTS_SQL = text("""
+    UPDATE payments SET status = :status WHERE payment_id IN :ids AND status = 'pending'
+""").bindparams(bindparam('ids', expanding=True))
+
+DEBIT_WALLETS_SQL = text("""
+    UPDATE users SET wallet_balance = users.wallet_balance - s.total
+    FROM (SELECT user_id, SUM(amount) AS total FROM payments WHERE payment_id IN :ids GROUP BY user_id) s
+    WHERE users.user_id = s.user_id
+""").bindparams(bindparam('ids', expanding=True))
+
+
+def settle_outcomes(claimed, balances):
+    """Splits claimed payments (in payment_id order) into ``(paid ids, failed ids)``.
+
+    Each user's payments are paid in order while they fit what is left of
+    ``balances[user_id]``; a payment that doesn't fit fails without
+    holding up the ones after it.
+    """
+    remaining = {user_id: Decimal(str(balance or 0)) for user_id, balance in balances.items()}
+    paid, failed = [], []
+    for row in claimed:
+        amount = Decimal(str(row.amount))
+        if row.cancelled or row.user_id not in remaining or amount > remaining[row.user_id]:
+            failed.append(row.payment_id)
+        else:
+            remaining[row.user_id] -= amount
+            paid.append(row.payment_id)
+    return paid, failed
+
+
+def settle_payments(batch_size=SETTLE_BATCH_SIZE):
+    """Settles the oldest chunk of pending wallet payments and commits.
+
+    On PostgreSQL the chunk is claimed ``FOR UPDATE SKIP LOCKED`` and the
+    owners' wallets are locked in user_id order before the balances are
+    read, so concurrent workers never overdraw a wallet or deadlock. On
+    SQLite the first UPDATE takes the write lock; the chunk is then checked
+    against the current rows and rolled back (counted in ``conflicts``) if
+    another worker settled any of its payments or changed a balance since
+    they were read. Payments created meanwhile get higher ids and wait for
+    the next chunk. Returns a dict of counts.
+    """
+    postgres = db.engine.dialect.name == 'postgresql'
+    claimed = db.session.execute(text(SETTLE_CLAIM_SQL.format(
+        locking=' FOR UPDATE OF p SKIP LOCKED' if postgres else ''
+    )), {'limit': batch_size}).all()
+    stats = {'claimed': len(claimed), 'paid': 0, 'failed': 0, 'debited': 0.0}
+    if not claimed:
+        db.session.rollback()
+        return stats
+    read_balances = text(WALLET_BALANCES_SQL.format(locking=' FOR UPDATE' if postgres else '')).bindparams(
+        bindparam('ids', expanding=True))
+    user_ids = sorted({row.user_id for row in claimed})
+    balances = dict(db.session.execute(read_balances, {'ids': user_ids}).all())
+    paid, failed = settle_outcomes(claimed, balances)
+
+    marked = sum(db.session.execute(MARK_PAYMENTS_SQL, {'status': status, 'ids': ids}).rowcount
+                 for status, ids in (('paid', paid), ('failed', failed)) if ids)
+    if not postgres and (marked != len(claimed) or dict(
+            db.session.execute(read_balances, {'ids': user_ids}).all()) != balances):
+        db.session.rollback()
+        stats['conflicts'] = 1
+        return stats
+    if paid:
+        db.session.execute(DEBIT_WALLETS_SQL, {'ids': paid})
+    db.session.commit()
+
+    paid_ids = set(paid)
+    paid_rows = [row for row in claimed if row.payment_id in paid_ids]
+    stats['paid'], stats['failed'] = len(paid), len(failed)
+    stats['debited'] = float(sum(Decimal(str(row.amount)) for row in paid_rows))
+    publish('payments', 'bulk_updated', {'count': len(claimed)})
+    if paid:
+        publish('users', 'bulk_updated', {'count': len({row.user_id for row in paid_rows})})
+    return stats
+
+### Full-text search
+#
+# Restaurants and menu items are mirrored into one ``search_documents`` index:
+# an FTS5 virtual table on SQLite, a table with a generated tsvector column and
+# a GIN index on PostgreSQL. Documents are keyed by ``doc_id`` (the FTS5 rowid
+# on SQLite), derived from the entity id so updates never need a scan.
+
+MAX_SEARCH_TERMS = 8
+MAX_SEARCH_OFFSET = 1000
+
+SEARCH_DDL = {
+    'sqlite': ["""
+        CREATE VIRTUAL TABLE IF NOT EXISTS search_documents USING fts5(
+            kind UNINDEXED, ref_id UNINDEXED, restaurant_id UNINDEXED,
+            name, cuisine, location,
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        )
+    """],
+    'postgresql': ["""
+        CREATE TABLE IF NOT EXISTS search_documents (
+            doc_id BIGINT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            ref_id INTEGER NOT NULL,
+            restaurant_id INTEGER NOT NULL,
+            name TEXT,
+            cuisine TEXT,
+            location TEXT,
+            document tsvector GENERATED ALWAYS AS (
+                setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+                setweight(to_tsvector('simple', coalesce(cuisine, '')), 'B') ||
+                setweight(to_tsvector('simple', coalesce(location, '')), 'C')
+            ) STORED
+        )
+    """, """
+        CREATE INDEX IF NOT EXISTS ix_search_documents_document ON search_documents USING GIN (document)
+    """],
+}
+
+
+def search_key():
+    return 'rowid' if db.engine.dialect.name == 'sqlite' else 'doc_id'
+
+
+def search_doc_id(kind, ref_id):
+    return ref_id * 2 + (1 if kind == 'menu_item' else 0)
+
+
+def ensure_search_index():
+    for ddl in SEARCH_DDL[db.engine.dialect.name]:
+        db.session.execute(text(ddl))
+    db.session.commit()
+
+
+def index_documents(docs):
+    """Adds ``{kind, ref_id, restaurant_id, name, cuisine, location}`` documents."""
+    docs = [dict(doc, doc_id=search_doc_id(doc['kind'], doc['ref_id'])) for doc in docs]
+    if docs:
+        db.session.execute(text(f"""
+            INSERT INTO search_documents ({search_key()}, kind, ref_id, restaurant_id, name, cuisine, location)
+            VALUES (:doc_id, :kind, :ref_id, :restaurant_id, :name, :cuisine, :location)
+        """), docs)
+
+
+def restaurant_document(restaurant_id, row):
+    return {'kind': 'restaurant', 'ref_id': restaurant_id, 'restaurant_id': restaurant_id,
+            'name': row.get('name'), 'cuisine': row.get('cuisine'), 'location': row.get('location')}
+
+
+def menu_item_document(item_id, row):
+    return {'kind': 'menu_item', 'ref_id': item_id, 'restaurant_id': row['restaurant_id'],
+            'name': row.get('name'), 'cuisine': None, 'location': None}
+
+
+def remove_documents(kind, ref_ids):
+    ids = [search_doc_id(kind, ref_id) for ref_id in ref_ids]
+    if ids:
+        db.session.execute(text(f"DELETE FROM search_documents WHERE {search_key()} IN :ids").bindparams(
+            bindparam('ids', expanding=True)), {'ids': ids})
+
+
+def rebuild_search_index():
+    """Repopulates ``search_documents`` from the base tables in two statements."""
+    ensure_search_index()
+    key = search_key()
+    db.session.execute(text("DELETE FROM search_documents"))
+    db.session.execute(text(f"""
+        INSERT INTO search_documents ({key}, kind, ref_id, restaurant_id, name, cuisine, location)
+        SELECT restaurant_id * 2, 'restaurant', restaurant_id, restaurant_id, name, cuisine, location
+        FROM restaurants
+    """))
+    db.session.execute(text(f"""
+        INSERT INTO search_documents ({key}, kind, ref_id, restaurant_id, name, cuisine, location)
+        SELECT item_id * 2 + 1, 'menu_item', item_id, restaurant_id, name, NULL, NULL
+        FROM menu_items
+    """))
+    db.session.commit()
+
+
+def search_documents(terms, kind, limit, offset):
+    """Ranked prefix search; every term must match (as a prefix) somewhere."""
+    params = {'limit': limit, 'offset': offset}
+    kind_filter = ''
+    if kind:
+        kind_filter = 'AND search_documents.kind = :kind'
+        params['kind'] = kind
+    select = """
+        SELECT search_documents.kind, search_documents.ref_id AS id, search_documents.restaurant_id,
+               search_documents.name, r.name AS restaurant_name, r.cuisine, r.location, r.rating,
+               m.price, m.availability, {rank} AS rank
+        FROM search_documents
+        JOIN restaurants r ON r.restaurant_id = search_documents.restaurant_id
+        LEFT JOIN menu_items m ON search_documents.kind = 'menu_item' AND m.item_id = search_documents.ref_id
+    """
+    if db.engine.dialect.name == 'sqlite':
+        params['query'] = ' '.join(f'"{term}"*' for term in terms)
+        # bm25 weights follow the column order: kind, ref_id, restaurant_id, name, cuisine, location
+        sql = select.format(rank='bm25(search_documents, 0, 0, 0, 10.0, 4.0, 2.0)') + f"""
+            WHERE search_documents MATCH :query {kind_filter}
+            ORDER BY rank LIMIT :limit OFFSET :offset
+        """
+    else:
+        params['query'] = ' & '.join(f'{term}:*' for term in terms)
+        sql = select.format(rank="ts_rank(document, to_tsquery('simple', :query))") + f"""
+            WHERE document @@ to_tsquery('simple', :query) {kind_filter}
+            ORDER BY rank DESC LIMIT :limit OFFSET :offset
+        """
+    return result_to_dict(db.session.execute(text(sql), params))
+
+### Bulk ingest
+
+# Rows per multi-row INSERT statement.
+BULK_CHUNK_SIZE = 1000
+# Validation errors reported before a bulk request is rejected.
+MAX_BULK_ERRORS = 20
+
+
+def bulk_rows():
+    """Yields the rows of a bulk request body, a JSON array or NDJSON lines.
+
+    NDJSON (``application/x-ndjson``) is read line by line from the request
+    stream, so the body is never held in memory as a whole.
+    """
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        for line_no, line in enumerate(request.stream, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                raise ApiError(f'line {line_no}: invalid JSON')
+    else:
+        rows = request.get_json(silent=True)
+        if not isinstance(rows, list):
+            raise ApiError('expected a JSON array or an application/x-ndjson body')
+        yield from rows
+
+
+def coerce_value(column, value):
+    """Checks a JSON value against a column type, returning the value to bind."""
+    if value is None:
+        if not column.nullable:
+            raise ValueError(f'{column.name} is required')
+        return None
+    kind = column.type
+    if isinstance(kind, db.Boolean):
+        if not isinstance(value, bool):
+            raise ValueError(f'{column.name} must be a boolean')
+    elif isinstance(kind, db.Integer):
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError(f'{column.name} must be an integer')
+    elif isinstance(kind, db.Numeric):
+        if isinstance(value, str):
+            try:
+                value = float(value)
+            except ValueError:
+                raise ValueError(f'{column.name} must be a number')
+        elif isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f'{column.name} must be a number')
+    elif isinstance(kind, db.DateTime):
+        try:
+            value = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise ValueError(f'{column.name} must be an ISO 8601 timestamp')
+    elif isinstance(kind, db.String):
+        if not isinstance(value, str):
+            raise ValueError(f'{column.name} must be a string')
+    return value
+
+
+def prepare_bulk_row(model, row, now):
+    """Validates one input row and fills in column defaults.
+
+    Every row ends up with the same keys, which lets a chunk go out as a
+    single multi-row INSERT.
+    """
+    if not isinstance(row, dict):
+        raise ValueError('row must be a JSON object')
+    columns = [c for c in model.__table__.columns if not c.primary_key]
+    unknown = set(row) - {c.name for c in columns}
+    if unknown:
+        raise ValueError('unknown field(s): ' + ', '.join(sorted(unknown)))
+    prepared = {}
+    for column in columns:
+        if column.name in row:
+            prepared[column.name] = coerce_value(column, row[column.name])
+        elif column.default is not None:
+            prepared[column.name] = column.default.arg
+        elif column.server_default is not None:
+            prepared[column.name] = now
+        else:
+            prepared[column.name] = coerce_value(column, None)
+    if model is Rating:
+        try:
+            validate_rating(prepared['target_type'], prepared['score'])
+        except ApiError as err:
+            raise ValueError(err.message)
+    return prepared
+
+
+def validate_chunk(model, rows, offset, now):
+    prepared, errors = [], []
+    for index, row in enumerate(rows, offset):
+        try:
+            prepared.append(prepare_bulk_row(model, row, now))
+        except ValueError as err:
+            errors.append({'row': index, 'error': str(err)})
+            if len(errors) >= MAX_BULK_ERRORS:
+                break
+    if errors:
+        raise ApiError('validation failed', errors=errors)
+    return prepared
+
+
+def insert_chunk(model, rows, entity):
+    """Inserts one validated chunk and keeps the rollups in step; returns new ids."""
+    table = model.__table__
+    pk = table.c[primary_key_of(model)]
+    stmt = insert(table).returning(pk, sort_by_parameter_order=True)
+    ids = list(db.session.execute(stmt, rows).scalars())
+    if entity in ('users', 'drivers', 'restaurants'):
+        bump_totals(**{entity: len(rows)})
+    if entity == 'restaurants':
+        index_documents(restaurant_document(key, row) for key, row in zip(ids, rows))
+    elif entity == 'menu_items':
+        index_documents(menu_item_document(key, row) for key, row in zip(ids, rows))
+    elif entity == 'rides':
+        record_rides((r['driver_id'], r['timestamp'].date(), r['fare']) for r in rows)
+    elif entity == 'orders':
+        record_orders((r['restaurant_id'], r['timestamp'].date(), r['total_amount']) for r in rows)
+    elif entity == 'ratings':
+        record_ratings((r['target_type'], r['target_id'], r['score']) for r in rows)
+    return ids
+
+
+def insert_order_items(order_ids, items_per_order, offset):
+    """Writes the line items of a chunk of orders in one multi-row INSERT."""
+    item_rows, errors = [], []
+    for index, (order_id, items) in enumerate(zip(order_ids, items_per_order), offset):
+        for item in items or []:
+            line = cart_line(item)
+            if line is None:
+                errors.append({'row': index, 'error': 'items need an integer item_id and a positive quantity'})
+                break
+            item_rows.append({'order_id': order_id, 'item_id': line[0], 'quantity': line[1]})
+    if errors:
+        raise ApiError('validation failed', errors=errors[:MAX_BULK_ERRORS])
+    if item_rows:
+        db.session.execute(insert(OrderItem.__table__), item_rows)
+
+
+BULK_MODELS = {
+    'users': User,
+    'drivers': Driver,
+    'restaurants': Restaurant,
+    'menu_items': MenuItem,
+    'delivery_partners': DeliveryPartner,
+    'rides': Ride,
+    'orders': Order,
+    'payments': Payment,
+    'ratings': Rating,
+}
+
+### Write-behind queue
+#
+# Ratings, location/status pings and pending payments are low-criticality,
+# high-volume writes. A client that sends ``Prefer: respond-async`` gets
+# ``202 Accepted`` with a tracking id as soon as the validated write is queued;
+# a background thread commits queued writes in batches, one transaction per
+# WRITE_BEHIND_FLUSH_MS or WRITE_BEHIND_BATCH_ROWS, whichever comes first. A
+# full queue answers 503 with Retry-After instead of growing, and the queue
+# is drained when the process exits. Queued writes are lost if the process
+# is killed outright, so only writes that can tolerate that belong here.
+
+WRITE_BEHIND_FLUSH_MS = int(os.environ.get('WRITE_BEHIND_FLUSH_MS', 50))
+WRITE_BEHIND_BATCH_ROWS = int(os.environ.get('WRITE_BEHIND_BATCH_ROWS', 500))
+WRITE_BEHIND_MAX_QUEUED = int(os.environ.get('WRITE_BEHIND_MAX_QUEUED', 10000))
+
+
+def queued_at():
+    """Request time for a queued row, in the format CURRENT_TIMESTAMP stores."""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+def apply_ratings(items):
+    rows = [params for _, params in items]
+    db.session.execute(text("""
+        INSERT INTO ratings (user_id, target_id, target_type, score, comment, timestamp)
+        VALUES (:user_id, :target_id, :target_type, :score, :comment, :timestamp)
+    """), rows)
+    record_ratings((r['target_type'], r['target_id'], r['score']) for r in rows)
+    return {}
+
+
+def apply_payments(items):
+    db.session.execute(text("""
+        INSERT INTO payments (user_id, ride_id, order_id, amount, mode, status, timestamp)
+        VALUES (:user_id, :ride_id, :order_id, :amount, :mode, :status, :timestamp)
+    """), [params for _, params in items])
+    return {}
+
+
+LOCATION_TABLES = {'drivers': ('driver_id', driver_locations), 'delivery_partners': ('partner_id', partner_locations)}
+
+
+def apply_locations(items):
+    """Applies pings per table; only the latest ping per courier is written."""
+    failures, per_table = {}, {}
+    for tracking_id, params in items:
+        per_table.setdefault(params['table'], {}).setdefault(params['id'], []).append((tracking_id, params))
+    for table, pings in per_table.items():
+        pk, grid = LOCATION_TABLES[table]
+        latest = [entries[-1][1] for entries in pings.values()]
+        db.session.execute(text(f"""
+            UPDATE {table} SET lat = :lat, lng = :lng, location_updated_at = :now,
+                               status = COALESCE(:status, status)
+            WHERE {pk} = :id
+        """), latest)
+        found = dict(db.session.execute(
+            text(f"SELECT {pk}, status FROM {table} WHERE {pk} IN :ids").bindparams(bindparam('ids', expanding=True)),
+            {'ids': list(pings)},
+        ).all())
+        for params in latest:
+            if params['id'] in found:
+                grid.update(params['id'], params['lat'], params['lng'], found[params['id']] == 'available')
+            else:
+                failures.update((tracking_id, 'not found') for tracking_id, _ in pings[params['id']])
+        response_cache.bump(table)
+    return failures
+
+
+WRITE_HANDLERS = {'rating': apply_ratings, 'payment': apply_payments, 'location': apply_locations}
+
+
+class WriteBehindQueue:
+    """Bounded in-process queue of writes committed in batches by one thread."""
+
+    def __init__(self, flush_ms, batch_rows, max_queued, max_tracked=100000):
+        self.flush_seconds = flush_ms / 1000
+        self.batch_rows = batch_rows
+        self.max_tracked = max_tracked
+        self.accepted = 0
+        self.rejected = 0
+        self.committed = 0
+        self.failed = 0
+        self.flushes = 0
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._statuses = OrderedDict()
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def submit(self, kind, params):
+        """Queues a write and returns its tracking id, or None when the queue is full."""
+        self._start()
+        tracking_id = uuid.uuid4().hex
+        with self._lock:
+            self._track(tracking_id, {'status': 'queued'})
+        try:
+            self._queue.put_nowait((tracking_id, kind, params))
+        except queue.Full:
+            with self._lock:
+                self._statuses.pop(tracking_id, None)
+                self.rejected += 1
+            return None
+        with self._lock:
+            self.accepted += 1
+        return tracking_id
+
+    def status(self, tracking_id):
+        with self._lock:
+            return self._statuses.get(tracking_id)
+
+    def wait_idle(self):
+        """Blocks until every queued write has been committed or failed."""
+        self._queue.join()
+
+    def close(self, timeout=30):
+        """Stops the flush loop once everything still queued has been written."""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'queued': self._queue.qsize(),
+                'accepted': self.accepted,
+                'rejected': self.rejected,
+                'committed': self.committed,
+                'failed': self.failed,
+                'flushes': self.flushes,
+            }
+
+    def _track(self, tracking_id, status):
+        self._statuses[tracking_id] = status
+        self._statuses.move_to_end(tracking_id)
+        while len(self._statuses) > self.max_tracked:
+            self._statuses.popitem(last=False)
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+                    self._thread.start()
+
+    def _take_batch(self):
+        try:
+            batch = [self._queue.get(timeout=self.flush_seconds)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_rows:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not (self._stopping.is_set() and self._queue.empty()):
+            batch = self._take_batch()
+            if batch:
+                with app.app_context():
+                    self._flush(batch)
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _apply(self, batch):
+        per_kind, failures = {}, {}
+        for tracking_id, kind, params in batch:
+            per_kind.setdefault(kind, []).append((tracking_id, params))
+        for kind, items in per_kind.items():
+            failures.update(WRITE_HANDLERS[kind](items))
+        db.session.commit()
+        return failures
+
+    def _flush(self, batch):
+        try:
+            results = [(batch, self._apply(batch))]
+        except Exception:
+            db.session.rollback()
+            # One bad write must not sink the batch: retry each on its own.
+            results = []
+            for item in batch:
+                try:
+                    results.append(([item], self._apply([item])))
+                except Exception as exc:
+                    db.session.rollback()
+                    app.logger.warning('write-behind %s %s failed: %s', item[1], item[0], exc)
+                    results.append(([item], {item[0]: str(exc).splitlines()[0][:200]}))
+        with self._lock:
+            self.flushes += 1
+            for items, failures in results:
+                for tracking_id, _, _ in items:
+                    error = failures.get(tracking_id)
+                    if error is None:
+                        self.committed += 1
+                        self._track(tracking_id, {'status': 'committed'})
+                    else:
+                        self.failed += 1
+                        self._track(tracking_id, {'status': 'failed', 'error': error})
+
+
+write_behind = WriteBehindQueue(WRITE_BEHIND_FLUSH_MS, WRITE_BEHIND_BATCH_ROWS, WRITE_BEHIND_MAX_QUEUED)
+atexit.register(write_behind.close)
+
+
+def prefers_async():
+    return 'respond-async' in request.headers.get('Prefer', '')
+
+
+def enqueue_write(kind, params):
+    """202 with a tracking id for a queued write, or 503 when the queue is full."""
+    tracking_id = write_behind.submit(kind, params)
+    if tracking_id is None:
+        return jsonify({'error': 'write queue is full, retry shortly'}), 503, {'Retry-After': '1'}
+    response = jsonify({'status': 'accepted', 'tracking_id': tracking_id})
+    response.status_code = 202
+    response.headers['Location'] = f'/api/writes/{tracking_id}'
+    response.headers['Preference-Applied'] = 'respond-async'
+    return response
+
+### Change feed
+#
+# The write routes publish a small event after each commit (``created`` with
+# the new row, ``updated`` with the changed fields, ``deleted`` with the id)
+# to an in-process bus, and GET /api/stream relays them to browsers as
+# Server-Sent Events so pages apply deltas instead of re-fetching lists. The
+# bus keeps the last EVENT_BUFFER_SIZE events in a ring buffer; a client that
+# reconnects with ``Last-Event-ID`` is replayed what it missed, or sent a
+# ``reset`` event when that has already left the buffer (or the id came from
+# another process) so it knows to reload. Events are per process: behind
+# several gunicorn workers a client only sees writes handled by its worker.
+#
+# Every open stream holds a server thread, so a process serves at most
+# EVENT_MAX_STREAMS of them (by default half of GUNICORN_THREADS, leaving the
+# rest for API requests) and closes each after EVENT_STREAM_SECONDS. A
+# closed or refused stream is reconnected by the browser after the
+# ``retry:`` delay and resumes from its Last-Event-ID, so nothing is lost.
+
+EVENT_TOPICS = ('users', 'drivers', 'restaurants', 'menu_items', 'delivery_partners',
+                'rides', 'orders', 'payments', 'ratings')
+EVENT_BUFFER_SIZE = int(os.environ.get('EVENT_BUFFER_SIZE', 1024))
+EVENT_HEARTBEAT_SECONDS = 15
+EVENT_RETRY_MS = 2000
+EVENT_MAX_STREAMS = int(os.environ.get('EVENT_MAX_STREAMS', max(int(os.environ.get('GUNICORN_THREADS', 4)) // 2, 1)))
+EVENT_STREAM_SECONDS = float(os.environ.get('EVENT_STREAM_SECONDS', 300))
+# Reconnect delay sent to a client refused because all stream slots are taken.
+EVENT_BUSY_RETRY_MS = 10000
+
+
+class EventBus:
+    """Fan-out of change events with a bounded replay buffer; thread-safe."""
+
+    def __init__(self, size, max_streams):
+        # Ids are "<bus>:<seq>"; the bus part tells a replayable id from one
+        # issued by another process or before a restart.
+        self.bus_id = uuid.uuid4().hex[:8]
+        self._events = deque(maxlen=size)
+        self._seq = 0
+        self._changed = threading.Condition()
+        self.max_streams = max_streams
+        self.streams = 0
+        self.refused = 0
+
+    def open_stream(self):
+        """Takes a stream slot; False when all EVENT_MAX_STREAMS are in use."""
+        with self._changed:
+            if self.streams >= self.max_streams:
+                self.refused += 1
+                return False
+            self.streams += 1
+            return True
+
+    def close_stream(self):
+        with self._changed:
+            self.streams -= 1
+
+    def publish(self, topic, kind, data, user_id=None):
+        with self._changed:
+            self._seq += 1
+            payload = ROW_ENCODER.encode({'type': kind, 'topic': topic, 'data': data})
+            self._events.append((self._seq, topic, user_id, payload))
+            self._changed.notify_all()
+
+    def position(self, last_event_id):
+        """The sequence number to resume after, or None when the events since ``last_event_id`` are gone."""
+        if not last_event_id:
+            return self._seq
+        bus_id, _, seq = last_event_id.partition(':')
+        if bus_id != self.bus_id or not seq.isdigit() or int(seq) > self._seq:
+            return None
+        with self._changed:
+            oldest = self._events[0][0] if self._events else self._seq + 1
+        return int(seq) if int(seq) >= oldest - 1 else None
+
+    def wait(self, after, timeout):
+        """Events newer than ``after``, blocking up to ``timeout`` seconds for the first."""
+        with self._changed:
+            self._changed.wait_for(lambda: self._seq > after, timeout)
+            return [event for event in self._events if event[0] > after]
+
+    def stats(self):
+        with self._changed:
+            return {'bus_id': self.bus_id, 'last_id': f'{self.bus_id}:{self._seq}', 'buffered': len(self._events),
+                    'streams': self.streams, 'max_streams': self.max_streams, 'refused': self.refused}
+
+
+events = EventBus(EVENT_BUFFER_SIZE, EVENT_MAX_STREAMS)
+
+
+def publish(topic, kind, row):
+    """Publishes a change to ``row`` (a dict or Row); call it after the commit."""
+    data = dict(row._mapping) if hasattr(row, '_mapping') else dict(row)
+    events.publish(topic, kind, data, data.get('user_id'))
+
+
+def event_stream(after, topics, user_id):
+    """SSE frames for the events after ``after`` matching the filters, with periodic heartbeats.
+
+    Ends after EVENT_STREAM_SECONDS, or at once (asking the client to retry
+    later) when no stream slot is free.
+    """
+    if not events.open_stream():
+        yield f'retry: {EVENT_BUSY_RETRY_MS}\n\n'
+        return
+    try:
+        yield f'retry: {EVENT_RETRY_MS}\n\n'
+        if after is None:
+            after = events.position(None)
+            yield f'id: {events.bus_id}:{after}\nevent: reset\ndata: {{}}\n\n'
+        deadline = time.monotonic() + EVENT_STREAM_SECONDS
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            batch = events.wait(after, min(EVENT_HEARTBEAT_SECONDS, remaining))
+            if not batch:
+                yield ': heartbeat\n\n'
+                continue
+            frames, delivered = [], None
+            for seq, topic, event_user_id, payload in batch:
+                if topic in topics and (user_id is None or event_user_id == user_id):
+                    frames.append(f'id: {events.bus_id}:{seq}\nevent: {topic}\ndata: {payload}\n\n')
+                    delivered = seq
+            after = batch[-1][0]
+            if delivered != after:
+                # A data-less frame moves the client's Last-Event-ID past the
+                # filtered-out events without dispatching anything.
+                frames.append(f'id: {events.bus_id}:{after}\n\n')
+            yield ''.join(frames)
+    finally:
+        events.close_stream()
+
 ### Routes (RAW SQL implementation)
 
 @app.route('/')
@@ -126,6 +2742,7 @@ def create_user():
     sql = text("""
         INSERT INTO users (name, phone, email, address, wallet_balance) 
         VALUES (:name, :phone, :email, :address, :wallet_balance)
+        RETURNING user_id
     """)
     params = {
         'name': data.get('name'), 
@@ -134,8 +2751,10 @@ def create_user():
         'address': data.get('address'), 
         'wallet_balance': data.get('wallet_balance', 0)
     }
-    db.session.execute(sql, params)
+    user_id = db.session.execute(sql, params).scalar()
+    bump_totals(users=1)
     db.session.commit()
+    publish('users', 'created', {'user_id': user_id, **params})
     
     # Fetch the created user (assuming last inserted for simplicity or query by phone/email ideal)
     # For SQLite: SELECT * FROM users WHERE rowid = last_insert_rowid()
@@ -144,9 +2763,42 @@ def create_user():
 
 @app.route('/api/users/list', methods=['GET'])
 def list_users():
-    sql = text("SELECT * FROM users")
-    result = db.session.execute(sql)
-    return jsonify(result_to_dict(result))
+    return list_rows(User)
+
+@app.route('/api/users/<int:user_id>/rides', methods=['GET'])
+def list_user_rides(user_id):
+    return user_history(Ride, user_id)
+
+@app.route('/api/users/<int:user_id>/orders', methods=['GET'])
+def list_user_orders(user_id):
+    return user_history(Order, user_id)
+
+@app.route('/api/users/<int:user_id>/payments', methods=['GET'])
+def list_user_payments(user_id):
+    return user_history(Payment, user_id)
+
+@app.route('/api/users/<int:user_id>/summary', methods=['GET'])
+def user_summary(user_id):
+    user = db.session.execute(text("SELECT * FROM users WHERE user_id = :id"), {'id': user_id}).first()
+    if user is None:
+        return jsonify({'error':'not found'}), 404
+    # Each aggregate is a range scan over that table's (user_id, timestamp) index,
+    # once in the live table and once in its archive.
+    rides = both_tiers('rides', 'user_id, fare')
+    orders = both_tiers('orders', 'user_id, total_amount')
+    payments = both_tiers('payments', 'user_id, amount, status')
+    sql = text(f"""
+        SELECT
+            (SELECT COUNT(*) FROM {rides} WHERE user_id = :id) AS ride_count,
+            (SELECT ROUND(COALESCE(SUM(fare), 0), 2) FROM {rides} WHERE user_id = :id) AS ride_spend,
+            (SELECT COUNT(*) FROM {orders} WHERE user_id = :id) AS order_count,
+            (SELECT ROUND(COALESCE(SUM(total_amount), 0), 2) FROM {orders} WHERE user_id = :id) AS order_spend,
+            (SELECT ROUND(COALESCE(SUM(amount), 0), 2) FROM {payments} WHERE user_id = :id AND status = 'paid') AS paid_amount
+    """)
+    summary = dict(db.session.execute(sql, {'id': user_id}).one()._mapping)
+    summary['lifetime_spend'] = round(summary['ride_spend'] + summary['order_spend'], 2)
+    summary['user'] = dict(user._mapping)
+    return jsonify(summary)
 
 @app.route('/api/drivers/create', methods=['POST'])
 def create_driver():
@@ -154,6 +2806,7 @@ def create_driver():
     sql = text("""
         INSERT INTO drivers (name, phone, license_no, vehicle_no, rating, status)
         VALUES (:name, :phone, :license_no, :vehicle_no, :rating, :status)
+        RETURNING driver_id
     """)
     params = {
         'name': data.get('name'),
@@ -163,15 +2816,25 @@ def create_driver():
         'rating': data.get('rating', 0),
         'status': data.get('status', 'available')
     }
-    db.session.execute(sql, params)
+    driver_id = db.session.execute(sql, params).scalar()
+    bump_totals(drivers=1)
     db.session.commit()
+    response_cache.bump('drivers')
+    publish('drivers', 'created', {'driver_id': driver_id, **params})
     return jsonify({'status': 'created', 'data': data})
 
 @app.route('/api/drivers/list', methods=['GET'])
+@cached('drivers')
 def list_drivers():
-    sql = text("SELECT * FROM drivers")
-    result = db.session.execute(sql)
-    return jsonify(result_to_dict(result))
+    return list_rows(Driver)
+
+@app.route('/api/drivers/<int:driver_id>/location', methods=['POST'])
+def update_driver_location(driver_id):
+    return update_location(Driver, driver_locations, driver_id)
+
+@app.route('/api/drivers/nearby', methods=['GET'])
+def nearby_drivers():
+    return nearby(Driver, driver_locations)
 
 @app.route('/api/restaurants/create', methods=['POST'])
 def create_restaurant():
@@ -179,6 +2842,7 @@ def create_restaurant():
     sql = text("""
         INSERT INTO restaurants (name, location, cuisine, rating)
         VALUES (:name, :location, :cuisine, :rating)
+        RETURNING restaurant_id
     """)
     params = {
         'name': data.get('name'),
@@ -186,15 +2850,18 @@ def create_restaurant():
         'cuisine': data.get('cuisine'),
         'rating': data.get('rating', 0)
     }
-    db.session.execute(sql, params)
+    restaurant_id = db.session.execute(sql, params).scalar()
+    index_documents([restaurant_document(restaurant_id, params)])
+    bump_totals(restaurants=1)
     db.session.commit()
+    response_cache.bump('restaurants')
+    publish('restaurants', 'created', {'restaurant_id': restaurant_id, **params})
     return jsonify({'status': 'created', 'data': data})
 
 @app.route('/api/restaurants/list', methods=['GET'])
+@cached('restaurants')
 def list_restaurants():
-    sql = text("SELECT * FROM restaurants")
-    result = db.session.execute(sql)
-    return jsonify(result_to_dict(result))
+    return list_rows(Restaurant)
 
 @app.route('/api/menu_items/create', methods=['POST'])
 def create_menu_item():
@@ -202,6 +2869,7 @@ def create_menu_item():
     sql = text("""
         INSERT INTO menu_items (restaurant_id, name, price, availability)
         VALUES (:restaurant_id, :name, :price, :availability)
+        RETURNING item_id
     """)
     params = {
         'restaurant_id': data['restaurant_id'],
@@ -209,15 +2877,17 @@ def create_menu_item():
         'price': data['price'],
         'availability': data.get('availability', True)
     }
-    db.session.execute(sql, params)
+    item_id = db.session.execute(sql, params).scalar()
+    index_documents([menu_item_document(item_id, params)])
     db.session.commit()
+    response_cache.bump('menu_items')
+    publish('menu_items', 'created', {'item_id': item_id, **params})
     return jsonify({'status': 'created', 'data': data})
 
 @app.route('/api/menu_items/list', methods=['GET'])
+@cached('menu_items')
 def list_menu_items():
-    sql = text("SELECT * FROM menu_items")
-    result = db.session.execute(sql)
-    return jsonify(result_to_dict(result))
+    return list_rows(MenuItem)
 
 # Alias for frontend compatibility
 @app.route('/api/menu-items/list', methods=['GET'])
@@ -231,6 +2901,7 @@ def create_partner():
     sql = text("""
         INSERT INTO delivery_partners (name, phone, vehicle_no, status)
         VALUES (:name, :phone, :vehicle_no, :status)
+        RETURNING partner_id
     """)
     params = {
         'name': data.get('name'),
@@ -238,83 +2909,222 @@ def create_partner():
         'vehicle_no': data.get('vehicle_no'),
         'status': data.get('status', 'available')
     }
-    db.session.execute(sql, params)
+    partner_id = db.session.execute(sql, params).scalar()
     db.session.commit()
+    publish('delivery_partners', 'created', {'partner_id': partner_id, **params})
     return jsonify({'status': 'created', 'data': data})
 
 
 @app.route('/api/delivery_partners/list', methods=['GET'])
 def list_partners():
-    sql = text("SELECT * FROM delivery_partners")
-    result = db.session.execute(sql)
-    return jsonify(result_to_dict(result))
+    return list_rows(DeliveryPartner)
+
+@app.route('/api/delivery_partners/<int:partner_id>/location', methods=['POST'])
+def update_partner_location(partner_id):
+    return update_location(DeliveryPartner, partner_locations, partner_id)
+
+@app.route('/api/delivery_partners/nearby', methods=['GET'])
+def nearby_partners():
+    return nearby(DeliveryPartner, partner_locations)
 
 @app.route('/api/orders/create', methods=['POST'])
 def create_order():
+    """Places an order priced from the menu: ``{user_id, restaurant_id, items: [{item_id, quantity}]}``.
+
+    Any client ``total_amount`` is ignored; the response carries the computed one.
+    Orders start as ``placed`` without a partner; ``assign_orders`` assigns one.
+    """
     data = request.json or {}
+    for field in ('user_id', 'restaurant_id'):
+        if not is_int(data.get(field)):
+            raise ApiError(f'{field} must be an integer')
+    total, items = price_cart(data['restaurant_id'], data.get('items'))
+
     # 1. Insert Order
     sql_order = text("""
-        INSERT INTO orders (user_id, restaurant_id, partner_id, total_amount, status)
-        VALUES (:user_id, :restaurant_id, :partner_id, :total_amount, :status)
-    """)
+        INSERT INTO orders (user_id, restaurant_id, total_amount, status)
+        VALUES (:user_id, :restaurant_id, :total_amount, 'placed')
+        RETURNING order_id, user_id, restaurant_id, partner_id, total_amount, status, timestamp
+    """).bindparams(bindparam('total_amount', type_=db.Numeric)).columns(timestamp=db.DateTime)
     params_order = {
         'user_id': data['user_id'],
         'restaurant_id': data['restaurant_id'],
-        'partner_id': data.get('partner_id'),
-        'total_amount': data['total_amount'],
-        'status': data.get('status', 'placed')
+        'total_amount': total,
     }
-    db.session.execute(sql_order, params_order)
-    # Get ID explicitly (SQLite specific, but good for demo)
-    order_id = db.session.execute(text("SELECT last_insert_rowid()")).scalar()
-    
-    # 2. Insert Items
-    items = data.get('items', [])
-    if items and order_id:
-        sql_item = text("""
-            INSERT INTO order_items (order_id, item_id, quantity)
-            VALUES (:order_id, :item_id, :quantity)
-        """)
-        for item in items:
-            db.session.execute(sql_item, {
-                'order_id': order_id,
-                'item_id': item['item_id'],
-                'quantity': item.get('quantity', 1)
-            })
-            
-    db.session.commit()
-    return jsonify({'status': 'created', 'order_id': order_id})
+    order = db.session.execute(sql_order, params_order).one()
+    order_id = order.order_id
+    record_orders([(order.restaurant_id, order.timestamp.date(), order.total_amount)])
+
+    # 2. Insert Items, one multi-row INSERT for all line items
+    db.session.execute(insert(OrderItem.__table__).values([{'order_id': order_id, **item} for item in items]))
+
+    db.session.commit()
+    publish('orders', 'created', order)
+    return jsonify({'status': 'created', 'order_id': order_id, 'total_amount': float(total), 'items': items})
+
+@app.route('/api/orders/<int:order_id>/status', methods=['POST'])
+def update_order_status(order_id):
+    status = (request.json or {}).get('status')
+    if status not in ORDER_STATUSES:
+        raise ApiError('status must be one of: ' + ', '.join(ORDER_STATUSES))
+    # A finished order keeps its status; its partner was released when it finished.
+    order = db.session.execute(text("""
+        UPDATE orders SET status = :status WHERE order_id = :id AND status NOT IN :final
+        RETURNING order_id, user_id, partner_id, status
+    """).bindparams(bindparam('final', expanding=True)),
+        {'status': status, 'id': order_id, 'final': ORDER_FINAL_STATUSES}).first()
+    if order is None:
+        current = db.session.execute(text("SELECT status FROM orders WHERE order_id = :id"), {'id': order_id}).scalar()
+        if current is None:
+            return jsonify({'error':'not found'}), 404
+        raise ApiError(f'order is already {current}', status=409, order_status=current)
+    released = None
+    if status in ORDER_FINAL_STATUSES and order.partner_id is not None:
+        released = release_partner(order.partner_id)
+    db.session.commit()
+    if released is not None:
+        partner_locations.update(order.partner_id, released.lat, released.lng, True)
+    publish('orders', 'updated', order)
+    return jsonify({'status': 'updated', 'order_id': order_id, 'order_status': status})
 
 @app.route('/api/orders/list', methods=['GET'])
 def list_orders():
-    sql = text("SELECT * FROM orders")
-    result = db.session.execute(sql)
-    return jsonify(result_to_dict(result))
+    return list_rows(Order)
 
 @app.route('/api/rides/create', methods=['POST'])
 def create_ride():
+    """Records a ride for a given driver.
+
+    A ride that is not yet finished claims its driver like ``dispatch_ride``
+    does (409 when the driver is not available); a finished one, e.g. an
+    imported past ride, leaves the driver alone.
+    """
     data = request.json or {}
+    for field in ('user_id', 'driver_id'):
+        if not is_int(data.get(field)):
+            raise ApiError(f'{field} must be an integer')
+    for field in ('source', 'destination'):
+        if data.get(field) is None:
+            raise ApiError(f'{field} is required')
+    status = data.get('status', 'requested')
+    if status not in RIDE_STATUSES:
+        raise ApiError('status must be one of: ' + ', '.join(RIDE_STATUSES))
+    fare = data['fare'] if data.get('fare') is not None else quote_fares([data])[0]['fare']
+    claims = status not in RIDE_FINAL_STATUSES
+    if claims and claim_driver([data['driver_id']]) is None:
+        db.session.rollback()
+        return jsonify({'error': 'driver not available'}), 409
     sql = text("""
         INSERT INTO rides (user_id, driver_id, source, destination, fare, status)
         VALUES (:user_id, :driver_id, :source, :destination, :fare, :status)
-    """)
+        RETURNING ride_id, user_id, driver_id, source, destination, fare, status, timestamp
+    """).columns(timestamp=db.DateTime)
     params = {
         'user_id': data['user_id'],
         'driver_id': data['driver_id'],
         'source': data['source'],
         'destination': data['destination'],
-        'fare': data['fare'],
-        'status': data.get('status', 'requested')
+        'fare': fare,
+        'status': status
     }
-    db.session.execute(sql, params)
+    ride = db.session.execute(sql, params).one()
+    record_rides([(ride.driver_id, ride.timestamp.date(), ride.fare)])
     db.session.commit()
+    if claims:
+        response_cache.bump('drivers')
+        driver_locations.discard(ride.driver_id)
+    publish('rides', 'created', ride)
     return jsonify({'status': 'created', 'data': data})
 
+@app.route('/api/fares/quote', methods=['POST'])
+def quote():
+    """Quotes a batch of trips: ``{"trips": [{source, destination, vehicle_class}, ...]}``."""
+    data = request.json
+    trips = data.get('trips') if isinstance(data, dict) else data
+    if not isinstance(trips, list):
+        raise ApiError('expected {"trips": [...]}')
+    if len(trips) > MAX_QUOTES_PER_REQUEST:
+        raise ApiError(f'at most {MAX_QUOTES_PER_REQUEST} trips per request')
+    return jsonify({'quotes': quote_fares(trips)})
+
+@app.route('/api/rides/dispatch', methods=['POST'])
+def dispatch_ride():
+    """Claims a driver and creates the ride in one transaction.
+
+    With ``driver_id`` only that driver is claimed; with pickup ``lat``/``lng``
+    the nearest available drivers are tried in order of distance; otherwise
+    any available driver is taken. Answers 409 when nobody can be claimed.
+    The fare is always priced server-side from ``source``, ``destination``
+    and ``vehicle_class``.
+    """
+    data = request.json or {}
+    for field in ('user_id', 'source', 'destination'):
+        if data.get(field) is None:
+            raise ApiError(f'{field} is required')
+    for field in ('user_id', 'driver_id'):
+        if data.get(field) is not None and not is_int(data[field]):
+            raise ApiError(f'{field} must be an integer')
+    fare = quote_fares([data])[0]['fare']
+
+    if data.get('driver_id') is not None:
+        candidates = [data['driver_id']]
+    elif data.get('lat') is not None and data.get('lng') is not None:
+        nearest = driver_locations.nearest(*position_of(data), 10, 10)
+        candidates = [key for _, key in nearest]
+    else:
+        candidates = None
+
+    driver_id = claim_driver(candidates)
+    if driver_id is None:
+        db.session.rollback()
+        return jsonify({'error': 'no driver available'}), 409
+
+    sql = text("""
+        INSERT INTO rides (user_id, driver_id, source, destination, fare, status)
+        VALUES (:user_id, :driver_id, :source, :destination, :fare, 'accepted')
+        RETURNING ride_id, user_id, driver_id, source, destination, fare, status, timestamp
+    """).columns(timestamp=db.DateTime)
+    ride = db.session.execute(sql, {
+        'user_id': data['user_id'],
+        'driver_id': driver_id,
+        'source': data['source'],
+        'destination': data['destination'],
+        'fare': fare,
+    }).one()
+    record_rides([(ride.driver_id, ride.timestamp.date(), ride.fare)])
+    db.session.commit()
+    response_cache.bump('drivers')
+    driver_locations.discard(driver_id)
+    publish('rides', 'created', ride)
+    return jsonify({'status': 'created', 'ride_id': ride.ride_id, 'driver_id': driver_id, 'fare': fare}), 201
+
+@app.route('/api/rides/<int:ride_id>/status', methods=['POST'])
+def update_ride_status(ride_id):
+    status = (request.json or {}).get('status')
+    if status not in RIDE_STATUSES:
+        raise ApiError('status must be one of: ' + ', '.join(RIDE_STATUSES))
+    # A finished ride keeps its status; its driver was released when it finished.
+    ride = db.session.execute(text("""
+        UPDATE rides SET status = :status WHERE ride_id = :id AND status NOT IN :final
+        RETURNING ride_id, user_id, driver_id, status
+    """).bindparams(bindparam('final', expanding=True)),
+        {'status': status, 'id': ride_id, 'final': RIDE_FINAL_STATUSES}).first()
+    if ride is None:
+        current = db.session.execute(text("SELECT status FROM rides WHERE ride_id = :id"), {'id': ride_id}).scalar()
+        if current is None:
+            return jsonify({'error':'not found'}), 404
+        raise ApiError(f'ride is already {current}', status=409, ride_status=current)
+    released = release_driver(ride.driver_id) if status in RIDE_FINAL_STATUSES else None
+    db.session.commit()
+    if released is not None:
+        response_cache.bump('drivers')
+        driver_locations.update(ride.driver_id, released.lat, released.lng, True)
+    publish('rides', 'updated', ride)
+    return jsonify({'status': 'updated', 'ride_id': ride_id, 'ride_status': status})
+
 @app.route('/api/rides/list', methods=['GET'])
 def list_rides():
-    sql = text("SELECT * FROM rides")
-    result = db.session.execute(sql)
-    return jsonify(result_to_dict(result))
+    return list_rows(Ride)
 
 @app.route('/api/payments/create', methods=['POST'])
 def create_payment():
@@ -322,6 +3132,7 @@ def create_payment():
     sql = text("""
         INSERT INTO payments (user_id, ride_id, order_id, amount, mode, status)
         VALUES (:user_id, :ride_id, :order_id, :amount, :mode, :status)
+        RETURNING payment_id
     """)
     params = {
         'user_id': data['user_id'],
@@ -331,15 +3142,16 @@ def create_payment():
         'mode': data['mode'],
         'status': data.get('status', 'pending')
     }
-    db.session.execute(sql, params)
+    if params['status'] == 'pending' and prefers_async():
+        return enqueue_write('payment', {**params, 'timestamp': queued_at()})
+    payment_id = db.session.execute(sql, params).scalar()
     db.session.commit()
+    publish('payments', 'created', {'payment_id': payment_id, **params})
     return jsonify({'status': 'created', 'data': data})
 
 @app.route('/api/payments/list', methods=['GET'])
 def list_payments():
-    sql = text("SELECT * FROM payments")
-    result = db.session.execute(sql)
-    return jsonify(result_to_dict(result))
+    return list_rows(Payment)
 
 @app.route('/api/ratings/create', methods=['POST'])
 def create_rating():
@@ -347,6 +3159,7 @@ def create_rating():
     sql = text("""
         INSERT INTO ratings (user_id, target_id, target_type, score, comment)
         VALUES (:user_id, :target_id, :target_type, :score, :comment)
+        RETURNING rating_id
     """)
     params = {
         'user_id': data['user_id'],
@@ -355,15 +3168,623 @@ def create_rating():
         'score': data['score'],
         'comment': data.get('comment')
     }
-    db.session.execute(sql, params)
+    validate_rating(params['target_type'], params['score'])
+    if prefers_async():
+        return enqueue_write('rating', {**params, 'timestamp': queued_at()})
+    rating_id = db.session.execute(sql, params).scalar()
+    record_ratings([(params['target_type'], params['target_id'], params['score'])])
     db.session.commit()
+    publish('ratings', 'created', {'rating_id': rating_id, **params})
     return jsonify({'status': 'created', 'data': data})
 
 @app.route('/api/ratings/list', methods=['GET'])
 def list_ratings():
-    sql = text("SELECT * FROM ratings")
-    result = db.session.execute(sql)
-    return jsonify(result_to_dict(result))
+    return list_rows(Rating)
+
+### Batch reads
+#
+# POST /api/batch answers several list queries in one round trip. Every
+# sub-request is validated and compiled to SQL up front; the queries then run
+# concurrently, each on its own pooled connection (a worker thread gets its
+# own app context and therefore its own session), and the pages are returned
+# together in the negotiated format, keyed by the sub-request's ``key``.
+
+BATCH_MODELS = {
+    **BULK_MODELS,
+    'order_items': OrderItem,
+    'platform_totals': PlatformTotal,
+    'daily_revenue': DailyRevenue,
+    'driver_stats': DriverStats,
+    'restaurant_stats': RestaurantStats,
+    'rating_aggregates': RatingAggregate,
+}
+BATCH_MAX_REQUESTS = 20
+BATCH_DEFAULT_LIMIT = 100
+BATCH_MAX_WORKERS = int(os.environ.get('BATCH_MAX_WORKERS', 4))
+BATCH_SPEC_KEYS = {'key', 'entity', 'fields', 'filters', 'start', 'end', 'order', 'after', 'limit'}
+
+batch_pool = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix='batch-read')
+
+
+def compile_batch_query(spec):
+    """Validates one sub-request and returns ``(columns, sql, params)``.
+
+    ``{"entity": "rides", "fields": [...], "filters": {"status": "completed",
+    "driver_id": [1, 2]}, "start": ..., "end": ..., "order": "desc",
+    "after": 120, "limit": 5}``; a filter value that is a list matches any of
+    its items.
+    """
+    if not isinstance(spec, dict):
+        raise ApiError('each request must be an object')
+    unknown = set(spec) - BATCH_SPEC_KEYS
+    if unknown:
+        raise ApiError('unknown key(s): ' + ', '.join(sorted(unknown)))
+    model = BATCH_MODELS.get(spec.get('entity'))
+    if model is None:
+        raise ApiError('entity must be one of: ' + ', '.join(BATCH_MODELS))
+    pk = primary_key_of(model)
+    selected = parse_fields(model, spec.get('fields') or '')
+    if pk not in selected:
+        selected.insert(0, pk)
+
+    order = str(spec.get('order', 'asc')).lower()
+    if order not in ('asc', 'desc'):
+        raise ApiError("order must be 'asc' or 'desc'")
+    limit = spec.get('limit', BATCH_DEFAULT_LIMIT)
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+        raise ApiError('limit must be an integer >= 1')
+
+    conditions, params = time_range(model, spec)
+    filters = spec.get('filters') or {}
+    if not isinstance(filters, dict):
+        raise ApiError('filters must be an object')
+    columns = model.__table__.columns
+    expanding = []
+    for index, (column, value) in enumerate(filters.items()):
+        if column not in columns:
+            raise ApiError(f'unknown filter field: {column}')
+        name = f'filter_{index}'
+        if isinstance(value, list):
+            if not value:
+                raise ApiError(f'filter {column} needs at least one value')
+            conditions.append(f'{column} IN :{name}')
+            expanding.append(bindparam(name, expanding=True))
+        elif isinstance(value, dict):
+            raise ApiError(f'filter {column} must be a value or a list of values')
+        else:
+            conditions.append(f'{column} = :{name}' if value is not None else f'{column} IS NULL')
+        params[name] = value
+    if isinstance(spec.get('after'), (dict, list)):
+        raise ApiError('after must be a primary key value')
+    if spec.get('after') is not None:
+        conditions.append(f"{pk} {'>' if order == 'asc' else '<'} :after")
+        params['after'] = spec['after']
+
+    sql = tiered_select(model, selected, conditions, params)
+    sql += f' ORDER BY {pk} {order.upper()} LIMIT :limit'
+    params['limit'] = min(limit, MAX_PAGE_SIZE)
+    return selected, text(sql).bindparams(*expanding), params
+
+
+def run_batch_query(stmt, params, read_bind=None):
+    """Runs one compiled sub-request on a connection of its own; returns the rows and the time taken."""
+    with app.app_context():
+        g.read_bind = read_bind
+        started = time.perf_counter()
+        rows = db.session.execute(stmt, params).all()
+        return rows, time.perf_counter() - started
+
+
+@app.route('/api/batch', methods=['POST'])
+def batch_read():
+    """Runs up to BATCH_MAX_REQUESTS list queries concurrently and returns every page.
+
+    Body: ``{"requests": [{"key": "recent_rides", "entity": "rides", ...}, ...]}``
+    (see ``compile_batch_query``). The response maps each key (the entity
+    name when omitted) to its page in the negotiated format.
+    """
+    data = request.json or {}
+    specs = data.get('requests')
+    if not isinstance(specs, list) or not specs:
+        raise ApiError('requests must be a non-empty list')
+    if len(specs) > BATCH_MAX_REQUESTS:
+        raise ApiError(f'at most {BATCH_MAX_REQUESTS} requests per batch')
+
+    keys, queries = [], []
+    for index, spec in enumerate(specs):
+        try:
+            queries.append(compile_batch_query(spec))
+        except ApiError as err:
+            raise ApiError(err.message, index=index)
+        key = str(spec.get('key') or spec['entity'])
+        if key in keys:
+            raise ApiError(f'duplicate key: {key}', index=index)
+        keys.append(key)
+    # The watermark lookups in tiered_select are done; hand the request's
+    # connection back before the workers check out theirs.
+    db.session.close()
+
+    if len(queries) == 1 or BATCH_MAX_WORKERS == 1:
+        results = [run_batch_query(stmt, params, g.get('read_bind')) for _, stmt, params in queries]
+    else:
+        futures = [batch_pool.submit(run_batch_query, stmt, params, g.get('read_bind')) for _, stmt, params in queries]
+        results = [future.result() for future in futures]
+
+    if 'sql_statements' in g:
+        g.sql_count += len(results)
+        g.sql_seconds += sum(elapsed for _, elapsed in results)
+    serializer = negotiate_serializer()
+    response = app.response_class(serializer.document({
+        key: serializer.body(columns, native_rows(rows))
+        for key, (columns, _, _), (rows, _) in zip(keys, queries, results)
+    }), mimetype=serializer.mimetype)
+    response.vary.add('Accept')
+    return response
+
+### Export
+#
+# /api/export/<table> and `flask export` stream a table as gzip CSV or
+# Parquet for the warehouse. Rows come off a server-side cursor
+# EXPORT_BATCH_ROWS at a time and each batch is compressed (CSV) or written
+# as one row group (Parquet) and handed on before the next is fetched, so
+# memory stays bounded by the batch size whatever the table size.
+# Incremental exports pass the previous run's watermark as ``since``: the
+# export covers rows with ``since < <watermark column> <= upto``, where
+# ``upto`` is the column's maximum when the export starts and is returned as
+# the next watermark.
+
+EXPORT_MODELS = {'rides': Ride, 'orders': Order, 'order_items': OrderItem, 'payments': Payment, 'ratings': Rating}
+EXPORT_BATCH_ROWS = 10000
+EXPORT_FORMATS = {
+    'csv': ('application/gzip', 'csv.gz'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def parquet_type(column):
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return pa.timestamp('us')
+    if python_type is date:
+        return pa.date32()
+    return {int: pa.int64(), bool: pa.bool_(), Decimal: pa.float64(), float: pa.float64()}.get(python_type, pa.string())
+
+
+class ChunkSink(io.RawIOBase):
+    """Write-only file that hands its bytes back to a generator instead of storing them."""
+
+    def __init__(self):
+        self.chunks, self.position = [], 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data, self.chunks = b''.join(self.chunks), []
+        return data
+
+
+def export_query(model, by, since, upto, typed):
+    """``(statement, params)`` selecting the rows in the watermark window, ordered by it.
+
+    With ``typed`` date/time columns come back as date/datetime objects on
+    every backend (SQLite returns them as text otherwise).
+    """
+    table = model.__table__
+    pk = primary_key_of(model)
+    column = pk if by == 'pk' else by
+    conditions, params = [], {}
+    if since is not None:
+        conditions.append(f'{column} > :since')
+        params['since'] = since
+    if upto is not None:
+        conditions.append(f'{column} <= :upto')
+        params['upto'] = upto
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+    order = pk if column == pk else f'{column}, {pk}'
+    sql = f"SELECT {', '.join(table.columns.keys())} FROM {table.name}{where} ORDER BY {order}"
+    stmt = text(sql)
+    if typed:
+        stmt = stmt.columns(**{c.name: c.type for c in table.columns if c.type.python_type in (date, datetime)})
+    return stmt, params
+
+
+def export_watermark(model, by, since):
+    """Validates the watermark arguments; returns ``(since, upto)`` for ``export_query``."""
+    table = model.__table__
+    if by not in ('pk', 'timestamp'):
+        raise ApiError("by must be 'pk' or 'timestamp'")
+    if by == 'timestamp' and 'timestamp' not in table.columns:
+        raise ApiError(f'{table.name} has no timestamp column; use by=pk')
+    column = primary_key_of(model) if by == 'pk' else 'timestamp'
+    if since is not None:
+        try:
+            since = int(since) if by == 'pk' else datetime.fromisoformat(str(since)).isoformat(sep=' ')
+        except ValueError:
+            raise ApiError('since must be an integer id' if by == 'pk' else 'since must be an ISO datetime')
+    upto = db.session.execute(text(f"SELECT MAX({column}) FROM {table.name}")).scalar()
+    if isinstance(upto, datetime):
+        upto = upto.isoformat(sep=' ')
+    return since, upto
+
+
+def export_chunks(model, fmt, by='pk', since=None, batch_rows=EXPORT_BATCH_ROWS):
+    """Returns ``(watermark, chunks)``: the next ``since`` and an iterator of output bytes."""
+    if fmt not in EXPORT_FORMATS:
+        raise ApiError('format must be one of: ' + ', '.join(EXPORT_FORMATS))
+    if fmt == 'parquet' and pq is None:
+        raise ApiError('Parquet export needs pyarrow installed', status=501)
+    since, upto = export_watermark(model, by, since)
+    stmt, params = export_query(model, by, since, upto, typed=fmt == 'parquet')
+    columns = list(model.__table__.columns)
+
+    def batches():
+        if upto is None:
+            return
+        result = db.session.execute(stmt.execution_options(stream_results=True, max_row_buffer=batch_rows), params)
+        yield from result.partitions(batch_rows)
+
+    def csv_chunks():
+        gzip = zlib.compressobj(6, zlib.DEFLATED, 31)
+        text_buffer = io.StringIO()
+        writer = csv.writer(text_buffer)
+        writer.writerow([c.name for c in columns])
+        for rows in batches():
+            writer.writerows(rows)
+            chunk = gzip.compress(text_buffer.getvalue().encode())
+            text_buffer.seek(0)
+            text_buffer.truncate()
+            if chunk:
+                yield chunk
+        yield gzip.compress(text_buffer.getvalue().encode()) + gzip.flush()
+
+    def parquet_chunks():
+        schema = pa.schema([(c.name, parquet_type(c)) for c in columns])
+        sink = ChunkSink()
+        with pq.ParquetWriter(sink, schema, compression='snappy') as writer:
+            for rows in batches():
+                arrays = []
+                for i, field in enumerate(schema):
+                    values = [row[i] for row in rows]
+                    if field.type == pa.float64():
+                        # Numeric columns arrive as Decimal on PostgreSQL.
+                        values = [None if v is None else float(v) for v in values]
+                    arrays.append(pa.array(values, type=field.type))
+                writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+                yield sink.drain()
+        yield sink.drain()
+
+    return (upto if upto is not None else since), (csv_chunks() if fmt == 'csv' else parquet_chunks())
+
+
+@app.route('/api/export/<table>', methods=['GET'])
+def export_table(table):
+    """Streams ``table`` as gzip CSV (default) or Parquet.
+
+    ``format`` is ``csv`` or ``parquet``; ``by`` (``pk`` or ``timestamp``)
+    and ``since`` select an incremental export of the rows after a previous
+    watermark. The watermark to pass next time is in ``X-Export-Watermark``.
+    """
+    model = EXPORT_MODELS.get(table)
+    if model is None:
+        return jsonify({'error':'not found'}), 404
+    fmt = request.args.get('format', 'csv')
+    watermark, chunks = export_chunks(model, fmt, request.args.get('by', 'pk'), request.args.get('since'))
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename={table}.{extension}'
+    if watermark is not None:
+        response.headers['X-Export-Watermark'] = str(watermark)
+    return response
+
+### Bulk ingest endpoint
+
+@app.route('/api/<entity>/bulk', methods=['POST'])
+def bulk_create(entity):
+    """Inserts a JSON array or NDJSON stream of rows in one transaction.
+
+    Rows are validated and written in chunks of BULK_CHUNK_SIZE using
+    multi-row INSERT statements. Orders may carry an ``items`` list, written
+    with one batched INSERT per chunk. Any invalid row rejects the whole
+    request.
+    """
+    entity = entity.replace('-', '_')
+    model = BULK_MODELS.get(entity)
+    if model is None:
+        return jsonify({'error':'not found'}), 404
+
+    now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    ids, chunk, offset = [], [], 0
+
+    def flush(chunk, offset):
+        items = [row.pop('items', None) if isinstance(row, dict) else None for row in chunk] \
+            if entity == 'orders' else None
+        new_ids = insert_chunk(model, validate_chunk(model, chunk, offset, now), entity)
+        if items is not None:
+            insert_order_items(new_ids, items, offset)
+        ids.extend(new_ids)
+
+    for row in bulk_rows():
+        chunk.append(row)
+        if len(chunk) == BULK_CHUNK_SIZE:
+            flush(chunk, offset)
+            offset += len(chunk)
+            chunk = []
+    if chunk:
+        flush(chunk, offset)
+
+    db.session.commit()
+    response_cache.bump(model.__table__.name)
+    # One event for the whole request; subscribers reload rather than
+    # receive thousands of rows through the feed.
+    publish(entity, 'bulk_created', {'count': len(ids)})
+    return jsonify({'status': 'created', 'count': len(ids), 'ids': ids}), 201
+
+### Bulk update / delete endpoints
+#
+# POST /api/<entity>/bulk-update and /bulk-delete change every live row that
+# matches a filter. The rows are taken in primary key order, BULK_MUTATION_CHUNK
+# at a time; each chunk is one set-based statement (plus its cascades) and
+# its own transaction, so a large cleanup never holds its locks for long.
+# Archived rows are not touched.
+
+BULK_MUTATION_CHUNK = 5000
+
+# Per entity: the columns a filter may use, the columns an update may set
+# (with their allowed values), the child rows a delete takes along and the
+# final statuses a status update leaves alone.
+BULK_MUTATIONS = {
+    'rides': {'model': Ride, 'filters': ('status', 'user_id', 'driver_id'),
+              'set': {'status': RIDE_STATUSES}, 'cascade': {'payments': 'ride_id'},
+              'final': RIDE_FINAL_STATUSES},
+    'orders': {'model': Order, 'filters': ('status', 'user_id', 'restaurant_id', 'partner_id'),
+               'set': {'status': ORDER_STATUSES}, 'cascade': {'order_items': 'order_id', 'payments': 'order_id'},
+               'final': ORDER_FINAL_STATUSES},
+    # Settlement owns the pending -> paid move and the wallet debit, so a bulk
+    # update may only fail payments that are still pending.
+    'payments': {'model': Payment, 'filters': ('status', 'mode', 'user_id', 'ride_id', 'order_id'),
+                 'set': {'status': ('failed',)}, 'choices': {'status': PAYMENT_STATUSES}, 'cascade': {},
+                 'final': ('paid', 'failed')},
+    'menu_items': {'model': MenuItem, 'filters': ('restaurant_id', 'availability'),
+                   'set': {'availability': (True, False)}, 'cascade': None},
+}
+
+
+def bulk_filter(entity, spec):
+    """Validates a bulk filter and returns ``(conditions, params, expanding bindparams)``.
+
+    ``{"status": "requested", "driver_id": [1, 2], "ids": [...], "start": ...,
+    "end": ...}``; a list matches any of its values. At least one condition is
+    required, so a request can never match a whole table by accident.
+    """
+    config = BULK_MUTATIONS[entity]
+    model = config['model']
+    if not isinstance(spec, dict) or not spec:
+        raise ApiError('filter must be a non-empty object')
+    allowed = set(config['filters']) | {'ids', 'start', 'end'}
+    unknown = set(spec) - allowed
+    if unknown:
+        raise ApiError('unknown filter field(s): ' + ', '.join(sorted(unknown)), allowed=sorted(allowed))
+
+    conditions, params = time_range(model, spec)
+    expanding = []
+    columns = model.__table__.columns
+    for column, value in spec.items():
+        if column in ('start', 'end'):
+            continue
+        name = primary_key_of(model) if column == 'ids' else column
+        python_type = columns[name].type.python_type
+        if column == 'ids' and not isinstance(value, list):
+            raise ApiError('filter ids must be a list')
+        values = value if isinstance(value, list) else [value]
+        if not values:
+            raise ApiError(f'filter {column} needs at least one value')
+        if any(not isinstance(v, python_type) or isinstance(v, bool) and python_type is not bool for v in values):
+            raise ApiError(f'filter {column} must be of type {python_type.__name__}')
+        choices = config.get('choices', config['set']).get(column)
+        if choices and any(v not in choices for v in values):
+            raise ApiError(f'filter {column} must be one of: ' + ', '.join(map(str, choices)))
+        if isinstance(value, list):
+            conditions.append(f'{name} IN :f_{column}')
+            expanding.append(bindparam(f'f_{column}', expanding=True))
+        else:
+            conditions.append(f'{name} = :f_{column}')
+        params[f'f_{column}'] = value
+    return conditions, params, expanding
+
+
+def bulk_request(entity):
+    """Common parsing for the bulk mutation routes: ``(config, body, filter, chunk size)``."""
+    entity = entity.replace('-', '_')
+    if entity not in BULK_MUTATIONS:
+        raise ApiError('not found', status=404)
+    body = request.json or {}
+    chunk_size = body.get('chunk_size', BULK_MUTATION_CHUNK)
+    if not isinstance(chunk_size, int) or isinstance(chunk_size, bool) or not 1 <= chunk_size <= BULK_MUTATION_CHUNK:
+        raise ApiError(f'chunk_size must be an integer between 1 and {BULK_MUTATION_CHUNK}')
+    return entity, BULK_MUTATIONS[entity], body, bulk_filter(entity, body.get('filter')), chunk_size
+
+
+def bulk_chunks(model, where, chunk_size):
+    """Yields the ids of the next chunk of matching rows until none are left.
+
+    The ids are read (and on PostgreSQL locked) in the chunk's own
+    transaction; the caller commits before asking for the next chunk. Its
+    statements should still repeat the filter (see ``bulk_statement``): on
+    SQLite a row may change between this read and the first write.
+    """
+    conditions, params, expanding = where
+    pk = primary_key_of(model)
+    locking = ' FOR UPDATE' if db.engine.dialect.name == 'postgresql' else ''
+    select = text(f"""
+        SELECT {pk} FROM {model.__table__.name} WHERE {' AND '.join(conditions)} AND {pk} > :after
+        ORDER BY {pk} LIMIT :chunk_size{locking}
+    """).bindparams(*expanding)
+    after = 0
+    while True:
+        ids = db.session.execute(select, {**params, 'after': after, 'chunk_size': chunk_size}).scalars().all()
+        if not ids:
+            return
+        yield ids
+        if len(ids) < chunk_size:
+            return
+        after = ids[-1]
+
+
+def bulk_statement(sql, model, where):
+    """Compiles ``sql`` with ``{matching}`` standing for the chunk's rows that still match the filter."""
+    conditions, _, expanding = where
+    pk = primary_key_of(model)
+    matching = f"{pk} IN :ids AND {' AND '.join(conditions)}"
+    return text(sql.format(matching=matching)).bindparams(*expanding, bindparam('ids', expanding=True))
+
+
+def bulk_dry_run(entity, config, where, cascade=False):
+    """Counts the rows (and, with ``cascade``, the child rows a delete takes) a bulk request would change."""
+    conditions, params, expanding = where
+    model = config['model']
+    table, pk = model.__table__.name, primary_key_of(model)
+    matched = f"SELECT {pk} FROM {table} WHERE {' AND '.join(conditions)}"
+    counts = {'matched': db.session.execute(text(f'SELECT COUNT(*) FROM ({matched}) m').bindparams(*expanding),
+                                            params).scalar()}
+    for child, column in (config['cascade'] if cascade else {}).items():
+        counts[child] = db.session.execute(text(
+            f'SELECT COUNT(*) FROM {child} WHERE {column} IN ({matched})'
+        ).bindparams(*expanding), params).scalar()
+    db.session.rollback()
+    return jsonify({'status': 'dry_run', 'entity': entity, **counts})
+
+
+@app.route('/api/<entity>/bulk-update', methods=['POST'])
+def bulk_update(entity):
+    """Sets columns on every row matching a filter, one chunk per transaction.
+
+    Body: ``{"filter": {...}, "set": {"status": "cancelled"}, "dry_run":
+    false, "chunk_size": 5000}`` (see ``bulk_filter``). As with the
+    single-row status routes, rides and orders already in a final status are
+    skipped, and moving them to one frees their drivers or delivery partners
+    unless those have other unfinished work.
+    """
+    entity, config, body, where, chunk_size = bulk_request(entity)
+    values = body.get('set')
+    if not isinstance(values, dict) or not values:
+        raise ApiError('set must be a non-empty object', allowed=sorted(config['set']))
+    for column, value in values.items():
+        if column not in config['set']:
+            raise ApiError(f'{column} cannot be bulk updated', allowed=sorted(config['set']))
+        if value not in config['set'][column] or isinstance(value, bool) != isinstance(config['set'][column][0], bool):
+            raise ApiError(f'{column} must be one of: ' + ', '.join(map(str, config['set'][column])))
+    if 'status' in values and config.get('final'):
+        conditions, params, expanding = where
+        where = (conditions + ['status NOT IN :final'], {**params, 'final': list(config['final'])},
+                 expanding + [bindparam('final', expanding=True)])
+    if body.get('dry_run'):
+        return bulk_dry_run(entity, config, where)
+
+    model = config['model']
+    pk = primary_key_of(model)
+    assignments = ', '.join(f'{column} = :set_{column}' for column in values)
+    release = None
+    if entity == 'rides' and values.get('status') in RIDE_FINAL_STATUSES:
+        release = ('drivers', 'driver_id', driver_locations)
+    elif entity == 'orders' and values.get('status') in ORDER_FINAL_STATUSES:
+        release = ('delivery_partners', 'partner_id', partner_locations)
+    returning = f'{pk}, {release[1]}' if release else pk
+    update = bulk_statement(f'UPDATE {model.__table__.name} SET {assignments} WHERE {{matching}} RETURNING {returning}',
+                            model, where)
+    params = {**where[1], **{f'set_{column}': value for column, value in values.items()}}
+
+    updated = chunks = 0
+    for ids in bulk_chunks(model, where, chunk_size):
+        rows = db.session.execute(update, {**params, 'ids': ids}).all()
+        released = []
+        if release:
+            table, column, locations = release
+            busy = sorted({row[1] for row in rows if row[1] is not None})
+            if busy:
+                released = db.session.execute(text(f"""
+                    UPDATE {table} SET status = 'available' WHERE {column} IN :busy AND status = 'busy'
+                      AND NOT EXISTS (SELECT 1 FROM {model.__table__.name} w
+                                      WHERE w.{column} = {table}.{column} AND w.status NOT IN :final)
+                    RETURNING {column}, lat, lng
+                """).bindparams(bindparam('busy', expanding=True), bindparam('final', expanding=True)),
+                    {'busy': busy, 'final': list(config['final'])}).all()
+        db.session.commit()
+        for row in released:
+            locations.update(row[0], row.lat, row.lng, True)
+        updated += len(rows)
+        chunks += 1
+
+    if updated:
+        if entity == 'menu_items':
+            response_cache.bump('menu_items')
+        if release and release[0] == 'drivers':
+            response_cache.bump('drivers')
+        publish(entity, 'bulk_updated', {'count': updated})
+    return jsonify({'status': 'updated', 'entity': entity, 'updated': updated, 'chunks': chunks})
+
+
+@app.route('/api/<entity>/bulk-delete', methods=['POST'])
+def bulk_delete(entity):
+    """Deletes every row matching a filter, with its child rows, one chunk per transaction.
+
+    Body: ``{"filter": {...}, "dry_run": false, "chunk_size": 5000}`` (see
+    ``bulk_filter``). Ride deletes take the rides' payments along; order
+    deletes take their order items and payments. The analytics rollups are
+    adjusted in the same transaction.
+    """
+    entity, config, body, where, chunk_size = bulk_request(entity)
+    if config['cascade'] is None:
+        raise ApiError(f'{entity} cannot be bulk deleted; bulk-update them instead')
+    if body.get('dry_run'):
+        return bulk_dry_run(entity, config, where, cascade=True)
+
+    model = config['model']
+    table, pk = model.__table__.name, primary_key_of(model)
+    returning = {
+        'rides': 'driver_id, timestamp, fare',
+        'orders': 'restaurant_id, timestamp, total_amount',
+        'payments': pk,
+    }[entity]
+    delete = bulk_statement(f'DELETE FROM {table} WHERE {{matching}} RETURNING {returning}', model, where)
+    if entity != 'payments':
+        delete = delete.columns(timestamp=db.DateTime)
+    # Children go first (their foreign keys are checked per statement), and
+    # only those of rows that still match.
+    cascades = {
+        child: bulk_statement(f'DELETE FROM {child} WHERE {column} IN (SELECT {pk} FROM {table} WHERE {{matching}})',
+                              model, where)
+        for child, column in config['cascade'].items()
+    }
+    params = where[1]
+
+    deleted, chunks = 0, 0
+    children = dict.fromkeys(cascades, 0)
+    for ids in bulk_chunks(model, where, chunk_size):
+        for child, statement in cascades.items():
+            children[child] += db.session.execute(statement, {**params, 'ids': ids}).rowcount
+        rows = db.session.execute(delete, {**params, 'ids': ids}).all()
+        if entity == 'rides':
+            record_rides([(row.driver_id, row.timestamp.date(), row.fare) for row in rows], sign=-1)
+        elif entity == 'orders':
+            record_orders([(row.restaurant_id, row.timestamp.date(), row.total_amount) for row in rows], sign=-1)
+        db.session.commit()
+        deleted += len(rows)
+        chunks += 1
+
+    if deleted:
+        publish(entity, 'bulk_deleted', {'count': deleted})
+        if children.get('payments'):
+            publish('payments', 'bulk_deleted', {'count': children['payments']})
+    return jsonify({'status': 'deleted', 'entity': entity, 'deleted': deleted, 'chunks': chunks, **children})
 
 ### Delete endpoints
 
@@ -371,36 +3792,54 @@ def list_ratings():
 def delete_user(user_id):
     sql = text("DELETE FROM users WHERE user_id = :id")
     result = db.session.execute(sql, {'id': user_id})
-    db.session.commit()
     if result.rowcount == 0:
         return jsonify({'error':'not found'}), 404
+    bump_totals(users=-1)
+    db.session.commit()
+    publish('users', 'deleted', {'user_id': user_id})
     return jsonify({'status':'deleted', 'user_id': user_id})
 
 @app.route('/api/drivers/<int:driver_id>', methods=['DELETE'])
 def delete_driver(driver_id):
+    db.session.execute(text("DELETE FROM driver_stats WHERE driver_id = :id"), {'id': driver_id})
     sql = text("DELETE FROM drivers WHERE driver_id = :id")
     result = db.session.execute(sql, {'id': driver_id})
-    db.session.commit()
     if result.rowcount == 0:
         return jsonify({'error':'not found'}), 404
+    bump_totals(drivers=-1)
+    db.session.commit()
+    response_cache.bump('drivers')
+    driver_locations.discard(driver_id)
+    publish('drivers', 'deleted', {'driver_id': driver_id})
     return jsonify({'status':'deleted', 'driver_id': driver_id})
 
 @app.route('/api/restaurants/<int:restaurant_id>', methods=['DELETE'])
 def delete_restaurant(restaurant_id):
+    db.session.execute(text("DELETE FROM restaurant_stats WHERE restaurant_id = :id"), {'id': restaurant_id})
+    item_ids = db.session.execute(text("SELECT item_id FROM menu_items WHERE restaurant_id = :id"),
+                                  {'id': restaurant_id}).scalars().all()
+    remove_documents('menu_item', item_ids)
+    remove_documents('restaurant', [restaurant_id])
     sql = text("DELETE FROM restaurants WHERE restaurant_id = :id")
     result = db.session.execute(sql, {'id': restaurant_id})
-    db.session.commit()
     if result.rowcount == 0:
         return jsonify({'error':'not found'}), 404
+    bump_totals(restaurants=-1)
+    db.session.commit()
+    response_cache.bump('restaurants', 'menu_items')
+    publish('restaurants', 'deleted', {'restaurant_id': restaurant_id})
     return jsonify({'status':'deleted', 'restaurant_id': restaurant_id})
 
 @app.route('/api/menu_items/<int:item_id>', methods=['DELETE'])
 def delete_menu_item(item_id):
     sql = text("DELETE FROM menu_items WHERE item_id = :id")
     result = db.session.execute(sql, {'id': item_id})
-    db.session.commit()
     if result.rowcount == 0:
         return jsonify({'error':'not found'}), 404
+    remove_documents('menu_item', [item_id])
+    db.session.commit()
+    response_cache.bump('menu_items')
+    publish('menu_items', 'deleted', {'item_id': item_id})
     return jsonify({'status':'deleted', 'item_id': item_id})
 
 @app.route('/api/delivery_partners/<int:partner_id>', methods=['DELETE'])
@@ -410,6 +3849,8 @@ def delete_partner(partner_id):
     db.session.commit()
     if result.rowcount == 0:
         return jsonify({'error':'not found'}), 404
+    partner_locations.discard(partner_id)
+    publish('delivery_partners', 'deleted', {'partner_id': partner_id})
     return jsonify({'status':'deleted', 'partner_id': partner_id})
 
 @app.route('/api/orders/<int:order_id>', methods=['DELETE'])
@@ -419,54 +3860,377 @@ def delete_order(order_id):
     sql_items = text("DELETE FROM order_items WHERE order_id = :id")
     db.session.execute(sql_items, {'id': order_id})
     
-    sql = text("DELETE FROM orders WHERE order_id = :id")
-    result = db.session.execute(sql, {'id': order_id})
-    db.session.commit()
-    
-    if result.rowcount == 0:
+    sql = text("""
+        DELETE FROM orders WHERE order_id = :id
+        RETURNING order_id, user_id, restaurant_id, total_amount, timestamp
+    """).columns(timestamp=db.DateTime)
+    order = db.session.execute(sql, {'id': order_id}).first()
+    if order is None:
         return jsonify({'error':'not found'}), 404
+    record_orders([(order.restaurant_id, order.timestamp.date(), order.total_amount)], sign=-1)
+    db.session.commit()
+    publish('orders', 'deleted', {'order_id': order_id, 'user_id': order.user_id})
     return jsonify({'status':'deleted', 'order_id': order_id})
 
 @app.route('/api/rides/<int:ride_id>', methods=['DELETE'])
 def delete_ride(ride_id):
-    sql = text("DELETE FROM rides WHERE ride_id = :id")
-    result = db.session.execute(sql, {'id': ride_id})
-    db.session.commit()
-    if result.rowcount == 0:
+    sql = text("""
+        DELETE FROM rides WHERE ride_id = :id
+        RETURNING user_id, driver_id, fare, timestamp
+    """).columns(timestamp=db.DateTime)
+    ride = db.session.execute(sql, {'id': ride_id}).first()
+    if ride is None:
         return jsonify({'error':'not found'}), 404
+    record_rides([(ride.driver_id, ride.timestamp.date(), ride.fare)], sign=-1)
+    db.session.commit()
+    publish('rides', 'deleted', {'ride_id': ride_id, 'user_id': ride.user_id})
     return jsonify({'status':'deleted', 'ride_id': ride_id})
 
 @app.route('/api/payments/<int:payment_id>', methods=['DELETE'])
 def delete_payment(payment_id):
-    sql = text("DELETE FROM payments WHERE payment_id = :id")
-    result = db.session.execute(sql, {'id': payment_id})
+    sql = text("DELETE FROM payments WHERE payment_id = :id RETURNING user_id")
+    user_id = db.session.execute(sql, {'id': payment_id}).scalar()
     db.session.commit()
-    if result.rowcount == 0:
+    if user_id is None:
         return jsonify({'error':'not found'}), 404
+    publish('payments', 'deleted', {'payment_id': payment_id, 'user_id': user_id})
     return jsonify({'status':'deleted', 'payment_id': payment_id})
 
 @app.route('/api/ratings/<int:rating_id>', methods=['DELETE'])
 def delete_rating(rating_id):
-    sql = text("DELETE FROM ratings WHERE rating_id = :id")
-    result = db.session.execute(sql, {'id': rating_id})
-    db.session.commit()
-    if result.rowcount == 0:
+    sql = text("DELETE FROM ratings WHERE rating_id = :id RETURNING target_type, target_id, score, user_id")
+    row = db.session.execute(sql, {'id': rating_id}).first()
+    if row is None:
         return jsonify({'error':'not found'}), 404
+    record_ratings([tuple(row[:3])], sign=-1)
+    db.session.commit()
+    publish('ratings', 'deleted', {'rating_id': rating_id, 'user_id': row.user_id})
     return jsonify({'status':'deleted', 'rating_id': rating_id})
 
+@app.route('/api/search', methods=['GET'])
+def search():
+    """Ranked prefix search over restaurant names/cuisines/locations and menu item names.
+
+    ``q`` is required; ``type`` (``restaurant`` or ``menu_item``) narrows the
+    results, ``limit`` (default 20) and ``offset`` page through them.
+    """
+    terms = re.findall(r'\w+', request.args.get('q', '').lower())[:MAX_SEARCH_TERMS]
+    if not terms:
+        raise ApiError('q must contain at least one word')
+    kind = request.args.get('type')
+    if kind not in (None, 'restaurant', 'menu_item'):
+        raise ApiError("type must be 'restaurant' or 'menu_item'")
+    limit = int_arg('limit', 20, maximum=100)
+    offset = int_arg('offset', 0, minimum=0, maximum=MAX_SEARCH_OFFSET)
+    results = search_documents(terms, kind, limit, offset)
+    return jsonify({
+        'query': ' '.join(terms),
+        'results': results,
+        'next_offset': offset + limit if len(results) == limit and offset + limit <= MAX_SEARCH_OFFSET else None,
+    })
+
+@app.route('/api/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(response_cache.stats())
+
+@app.route('/api/writes/stats', methods=['GET'])
+def write_queue_stats():
+    return jsonify(write_behind.stats())
+
+@app.route('/api/writes/<tracking_id>', methods=['GET'])
+def write_status(tracking_id):
+    status = write_behind.status(tracking_id)
+    if status is None:
+        return jsonify({'error':'not found'}), 404
+    return jsonify({'tracking_id': tracking_id, **status})
+
+@app.route('/api/stream', methods=['GET'])
+def stream_events():
+    """Server-Sent Events feed of changes.
+
+    ``topics`` is a comma separated subset of EVENT_TOPICS (all by default)
+    and ``user_id`` keeps only that user's rides, orders, payments and
+    ratings. Resumes after the ``Last-Event-ID`` header, or the
+    ``last_event_id`` parameter for the first connection.
+    """
+    topics = request.args.get('topics')
+    topics = set(EVENT_TOPICS) if not topics else {t.strip() for t in topics.split(',') if t.strip()}
+    unknown = topics - set(EVENT_TOPICS)
+    if unknown:
+        raise ApiError('unknown topic(s): ' + ', '.join(sorted(unknown)))
+    user_id = int_arg('user_id')
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    after = events.position(last_event_id)
+    # Nothing below touches the database; release the connection before the
+    # response starts streaming for as long as the client stays connected.
+    db.session.close()
+    response = Response(event_stream(after, topics, user_id), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/api/stream/stats', methods=['GET'])
+def stream_stats():
+    return jsonify(events.stats())
+
+@app.route('/api/replicas/stats', methods=['GET'])
+def replica_stats():
+    return jsonify(replicas.stats())
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+### Analytics endpoints (answered from the rollup tables)
+
+@app.route('/api/analytics/totals', methods=['GET'])
+def analytics_totals():
+    rows = db.session.execute(text("SELECT metric, value FROM platform_totals"))
+    totals = dict.fromkeys(TOTAL_METRICS, 0)
+    totals.update({row.metric: row.value for row in rows})
+    for metric in ('users', 'drivers', 'restaurants', 'rides', 'orders'):
+        totals[metric] = int(totals[metric])
+    totals['total_revenue'] = round(totals['ride_revenue'] + totals['order_revenue'], 2)
+    return jsonify(totals)
+
+@app.route('/api/analytics/top-drivers', methods=['GET'])
+def analytics_top_drivers():
+    sql = text("""
+        SELECT s.driver_id, d.name, d.rating, s.ride_count AS rides, s.revenue
+        FROM driver_stats s JOIN drivers d ON d.driver_id = s.driver_id
+        WHERE s.ride_count > 0
+        ORDER BY s.ride_count DESC
+        LIMIT :limit
+    """)
+    result = db.session.execute(sql, {'limit': int_arg('limit', 5, maximum=100)})
+    return jsonify(result_to_dict(result))
+
+@app.route('/api/analytics/top-restaurants', methods=['GET'])
+def analytics_top_restaurants():
+    sql = text("""
+        SELECT s.restaurant_id, r.name, r.rating, s.order_count AS orders, s.revenue
+        FROM restaurant_stats s JOIN restaurants r ON r.restaurant_id = s.restaurant_id
+        WHERE s.order_count > 0
+        ORDER BY s.order_count DESC
+        LIMIT :limit
+    """)
+    result = db.session.execute(sql, {'limit': int_arg('limit', 5, maximum=100)})
+    return jsonify(result_to_dict(result))
+
+@app.route('/api/analytics/revenue', methods=['GET'])
+def analytics_revenue():
+    """Daily or monthly revenue series between ``start`` and ``end`` (inclusive)."""
+    period = request.args.get('period', 'daily')
+    if period not in ('daily', 'monthly'):
+        raise ApiError("period must be 'daily' or 'monthly'")
+    end = date_arg('end', date.today())
+    start = date_arg('start', end - timedelta(days=29 if period == 'daily' else 365))
+    sql = text("""
+        SELECT revenue_date, ride_count, ride_revenue, order_count, order_revenue
+        FROM daily_revenue
+        WHERE revenue_date BETWEEN :start AND :end
+        ORDER BY revenue_date
+    """).bindparams(
+        bindparam('start', type_=db.Date), bindparam('end', type_=db.Date)
+    ).columns(revenue_date=db.Date)
+
+    series = {}
+    for row in db.session.execute(sql, {'start': start, 'end': end}):
+        key = row.revenue_date.isoformat()[:10 if period == 'daily' else 7]
+        point = series.setdefault(key, {'period': key, 'ride_count': 0, 'rides': 0, 'order_count': 0, 'orders': 0})
+        point['ride_count'] += row.ride_count
+        point['rides'] += row.ride_revenue
+        point['order_count'] += row.order_count
+        point['orders'] += row.order_revenue
+    for point in series.values():
+        point['rides'], point['orders'] = round(point['rides'], 2), round(point['orders'], 2)
+    return jsonify(list(series.values()))
+
 ### CLI helper
 @app.cli.command('db_create')
 def db_create():
     db.create_all()
+    ensure_search_index()
+    ensure_archive_tables()
     print('Database created.')
 
 
 @app.cli.command('db_reset')
 def db_reset():
+    db.session.execute(text("DROP TABLE IF EXISTS search_documents"))
+    for model in ARCHIVED_MODELS:
+        db.session.execute(text(f"DROP TABLE IF EXISTS {archive_of(model.__tablename__)}"
+                                + (" CASCADE" if db.engine.dialect.name == 'postgresql' else "")))
+    db.session.commit()
     db.drop_all()
     db.create_all()
+    ensure_search_index()
+    ensure_archive_tables()
     print('Database reset (dropped and recreated all tables).')
 
+@app.cli.command('sync_indexes')
+def sync_indexes():
+    """Creates any index declared on the models that the database is missing."""
+    created = 0
+    for table in db.metadata.sorted_tables:
+        existing = {ix['name'] for ix in db.inspect(db.engine).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                created += 1
+                print(f'Created {index.name}')
+    print(f'{created} index(es) created.')
+
+@app.cli.command('rebuild_search')
+def rebuild_search_command():
+    rebuild_search_index()
+    print('Search index rebuilt.')
+
+@app.cli.command('rebuild_rollups')
+def rebuild_rollups_command():
+    rebuild_rollups()
+    print('Analytics rollup tables rebuilt.')
+
+@app.cli.command('rebuild_ratings')
+def rebuild_ratings_command():
+    rebuild_ratings()
+    print('Rating aggregates rebuilt.')
+
+@app.cli.command('archive_before')
+@click.argument('cutoff', type=click.DateTime(formats=['%Y-%m-%d', '%Y-%m-%dT%H:%M:%S']))
+@click.option('--batch-size', default=ARCHIVE_BATCH_SIZE, show_default=True, help='Rows moved per transaction.')
+def archive_before_command(cutoff, batch_size):
+    """Moves finished rides and orders older than CUTOFF (and their items and payments) to the archive."""
+    ensure_archive_tables()
+    started = time.perf_counter()
+    moved = Counter()
+    moved.update(archive_before(Ride, cutoff, RIDE_FINAL_STATUSES, [(Payment, 'ride_id')], batch_size))
+    moved.update(archive_before(Order, cutoff, ORDER_FINAL_STATUSES,
+                                [(OrderItem, 'order_id'), (Payment, 'order_id')], batch_size))
+    elapsed = time.perf_counter() - started
+    print(', '.join(f'{count} {table}' for table, count in moved.items()) + f' archived in {elapsed:.2f}s.')
+
+@app.cli.command('export')
+@click.argument('table', type=click.Choice(list(EXPORT_MODELS)))
+@click.option('--format', 'fmt', type=click.Choice(list(EXPORT_FORMATS)), default='csv', show_default=True)
+@click.option('--by', type=click.Choice(['pk', 'timestamp']), default='pk', show_default=True,
+              help='Watermark column.')
+@click.option('--since', default=None, help='Export only rows after this watermark.')
+@click.option('--state', type=click.Path(dir_okay=False), default=None,
+              help='JSON file remembering the watermark per table between runs.')
+@click.option('--batch-rows', default=EXPORT_BATCH_ROWS, show_default=True,
+              help='Rows per cursor fetch and per Parquet row group.')
+@click.option('--output', '-o', type=click.Path(dir_okay=False), default=None,
+              help='Output file (default <table>.csv.gz / <table>.parquet).')
+def export_command(table, fmt, by, since, state, batch_rows, output):
+    """Writes TABLE to a gzip CSV or Parquet file, optionally incrementally."""
+    saved = {}
+    if state and os.path.exists(state):
+        with open(state) as f:
+            saved = json.load(f)
+    key = f'{table}:{by}'
+    if since is None:
+        since = saved.get(key)
+    try:
+        watermark, chunks = export_chunks(EXPORT_MODELS[table], fmt, by, since, batch_rows)
+    except ApiError as err:
+        raise click.ClickException(err.message)
+    output = output or f'{table}.{EXPORT_FORMATS[fmt][1]}'
+    started = time.perf_counter()
+    written = 0
+    with open(output, 'wb') as f:
+        for chunk in chunks:
+            f.write(chunk)
+            written += len(chunk)
+    elapsed = time.perf_counter() - started
+    if state and watermark is not None:
+        saved[key] = watermark
+        with open(state, 'w') as f:
+            json.dump(saved, f, indent=2)
+    print(f'Wrote {output} ({written / 1e6:.1f} MB) in {elapsed:.2f}s; next --since {watermark}.')
+
+@app.cli.command('assign_orders')
+@click.option('--interval', default=ASSIGN_INTERVAL_SECONDS, show_default=True, help='Seconds between ticks.')
+@click.option('--once', is_flag=True, help='Run a single tick and exit.')
+def assign_orders_command(interval, once):
+    """Assigns placed orders to the nearest available delivery partners, every INTERVAL seconds."""
+    while True:
+        started = time.perf_counter()
+        stats = assign_orders()
+        elapsed = time.perf_counter() - started
+        if stats['pending'] or once:
+            print(f"{datetime.now():%H:%M:%S} assigned {stats['assigned']}/{stats['pending']} orders "
+                  f"({stats['partners']} partners available, {stats['unlocated']} unlocated) in {elapsed * 1000:.0f} ms")
+        if once:
+            break
+        db.session.remove()
+        time.sleep(max(interval - elapsed, 0))
+
+@app.cli.command('settle_payments')
+@click.option('--interval', default=SETTLE_INTERVAL_SECONDS, show_default=True, help='Seconds between runs.')
+@click.option('--batch-size', default=SETTLE_BATCH_SIZE, show_default=True, help='Payments per transaction.')
+@click.option('--once', is_flag=True, help='Settle what is pending now and exit.')
+def settle_payments_command(interval, batch_size, once):
+    """Settles pending wallet payments against the users' balances, every INTERVAL seconds."""
+    while True:
+        started = time.perf_counter()
+        totals = Counter()
+        chunks = 0
+        while True:
+            stats = settle_payments(batch_size)
+            if not stats['claimed']:
+                break
+            chunks += 1
+            totals.update(stats)
+            if stats['claimed'] < batch_size:
+                break
+        elapsed = time.perf_counter() - started
+        settled = totals['paid'] + totals['failed']
+        if settled or once:
+            print(f"{datetime.now():%H:%M:%S} settled {settled} payments in {chunks} chunks "
+                  f"({totals['paid']} paid, {totals['failed']} failed, {totals['debited']:.2f} debited, "
+                  f"{totals['conflicts']} chunks retried) "
+                  f"in {elapsed:.2f}s, {settled / elapsed if elapsed else 0:.0f} payments/s")
+        if once:
+            break
+        db.session.remove()
+        time.sleep(max(interval - elapsed, 0))
+
+@app.cli.command('replica_snapshot')
+@click.argument('path')
+@click.option('--interval', default=5.0, show_default=True, help='Seconds between refreshes.')
+@click.option('--once', is_flag=True, help='Take a single snapshot and exit.')
+def replica_snapshot(path, interval, once):
+    """Keeps a copy of the SQLite database at PATH to serve as a local read replica.
+
+    Point DATABASE_READ_URL at it read-only, e.g.
+    sqlite:///file:/tmp/replica.db?mode=ro&uri=true. Each refresh is written
+    next to PATH and swapped in, so readers never see a partial copy.
+    """
+    if DB_BACKEND != 'sqlite':
+        raise click.ClickException('snapshots copy a SQLite database; use a PostgreSQL standby as the replica')
+    source = make_url(DB_URL).database
+    while True:
+        started = time.perf_counter()
+        staging = f'{path}.tmp'
+        src, dst = sqlite3.connect(source), sqlite3.connect(staging)
+        try:
+            src.backup(dst)
+            dst.execute('PRAGMA journal_mode = DELETE')
+            dst.execute('CREATE TABLE IF NOT EXISTS replica_snapshot (taken_at TIMESTAMP)')
+            dst.execute('DELETE FROM replica_snapshot')
+            dst.execute('INSERT INTO replica_snapshot VALUES (CURRENT_TIMESTAMP)')
+            dst.commit()
+        finally:
+            src.close()
+            dst.close()
+        os.replace(staging, path)
+        elapsed = time.perf_counter() - started
+        print(f'{datetime.now():%H:%M:%S} snapshot of {source} written to {path} in {elapsed:.2f}s')
+        if once:
+            break
+        time.sleep(max(interval - elapsed, 0))
+
 @app.cli.command('seed_db')
 def seed_db():
     print('Seeding database with comprehensive Bangalore-based data...')
@@ -490,11 +4254,11 @@ def seed_db():
 
     # 2. Create Drivers (Active in Bangalore)
     drivers_data = [
-        {'name': 'Manjunath Swamy', 'phone': '9123456701', 'license_no': 'KA01-2018-001122', 'vehicle_no': 'KA-01-AA-1234', 'rating': 4.8, 'status': 'available'}, # Auto
-        {'name': 'Shivakumar M', 'phone': '9123456702', 'license_no': 'KA03-2019-002233', 'vehicle_no': 'KA-03-BB-5678', 'rating': 4.5, 'status': 'available'}, # Sedan
-        {'name': 'Abdul Razak', 'phone': '9123456703', 'license_no': 'KA05-2020-003344', 'vehicle_no': 'KA-05-CC-9012', 'rating': 4.9, 'status': 'busy'}, # Prime SUV
-        {'name': 'Ravi Kumar', 'phone': '9123456704', 'license_no': 'KA51-2021-004455', 'vehicle_no': 'KA-51-DD-3456', 'rating': 4.2, 'status': 'available'}, # Mini
-        {'name': 'Gowtham N', 'phone': '9123456705', 'license_no': 'KA53-2022-005566', 'vehicle_no': 'KA-53-EE-7890', 'rating': 4.6, 'status': 'available'}, # Bike Taxi
+        {'name': 'Manjunath Swamy', 'phone': '9123456701', 'license_no': 'KA01-2018-001122', 'vehicle_no': 'KA-01-AA-1234', 'rating': 4.8, 'status': 'available', 'lat': 12.9352, 'lng': 77.6245}, # Auto
+        {'name': 'Shivakumar M', 'phone': '9123456702', 'license_no': 'KA03-2019-002233', 'vehicle_no': 'KA-03-BB-5678', 'rating': 4.5, 'status': 'available', 'lat': 12.9716, 'lng': 77.6412}, # Sedan
+        {'name': 'Abdul Razak', 'phone': '9123456703', 'license_no': 'KA05-2020-003344', 'vehicle_no': 'KA-05-CC-9012', 'rating': 4.9, 'status': 'busy', 'lat': 12.9750, 'lng': 77.6060}, # Prime SUV
+        {'name': 'Ravi Kumar', 'phone': '9123456704', 'license_no': 'KA51-2021-004455', 'vehicle_no': 'KA-51-DD-3456', 'rating': 4.2, 'status': 'available', 'lat': 12.9250, 'lng': 77.5838}, # Mini
+        {'name': 'Gowtham N', 'phone': '9123456705', 'license_no': 'KA53-2022-005566', 'vehicle_no': 'KA-53-EE-7890', 'rating': 4.6, 'status': 'available', 'lat': 12.9121, 'lng': 77.6446}, # Bike Taxi
     ]
 
     drivers = []
@@ -566,9 +4330,9 @@ def seed_db():
 
     # 5. Create Delivery Partners
     partners_data = [
-        {'name': 'Dunzo Partner', 'phone': '9900112233', 'vehicle_no': 'KA-01-DZ-1111', 'status': 'available'},
-        {'name': 'Swiggy Genie', 'phone': '9900112234', 'vehicle_no': 'KA-02-SW-2222', 'status': 'busy'},
-        {'name': 'Zomato Valet', 'phone': '9900112235', 'vehicle_no': 'KA-03-ZO-3333', 'status': 'available'},
+        {'name': 'Dunzo Partner', 'phone': '9900112233', 'vehicle_no': 'KA-01-DZ-1111', 'status': 'available', 'lat': 12.9340, 'lng': 77.6220},
+        {'name': 'Swiggy Genie', 'phone': '9900112234', 'vehicle_no': 'KA-02-SW-2222', 'status': 'busy', 'lat': 12.9700, 'lng': 77.6400},
+        {'name': 'Zomato Valet', 'phone': '9900112235', 'vehicle_no': 'KA-03-ZO-3333', 'status': 'available', 'lat': 12.9690, 'lng': 77.7480},
     ]
     
     partners = []
@@ -632,9 +4396,630 @@ def seed_db():
     for rate_data in ratings_data:
         db.session.add(Rating(**rate_data))
     db.session.commit()
-    
+
+    rebuild_rollups()
+    rebuild_ratings()
+    rebuild_search_index()
     print('Seed data generation completed successfully!')
 
 
+### Synthetic data
+#
+# `flask seed_synthetic` generates a referentially consistent dataset of any
+# size. Every table draws from its own NumPy generator seeded from --seed, so
+# the output is deterministic and resizing one table leaves the others alone.
+# Rows are produced and written one chunk at a time (COPY on PostgreSQL,
+# executemany INSERTs elsewhere), so memory stays flat however many rides are
+# requested.
+
+SYNTHETIC_CHUNK_SIZE = 20000
+SYNTHETIC_CENTER = (12.9716, 77.5946)
+SYNTHETIC_CUISINES = ['North Indian', 'South Indian', 'Chinese', 'Biryani', 'Pizza', 'Burgers',
+                      'Cafe', 'Desserts', 'Kerala', 'Andhra', 'Street Food', 'Healthy']
+SYNTHETIC_DISHES = ['Masala Dosa', 'Idli', 'Vada', 'Biryani', 'Paneer Tikka', 'Butter Chicken', 'Naan',
+                    'Fried Rice', 'Noodles', 'Pizza', 'Burger', 'Fries', 'Coffee', 'Gulab Jamun',
+                    'Thali', 'Parotta', 'Salad', 'Momos', 'Rolls', 'Lassi']
+PAYMENT_MODES = ['upi', 'card', 'wallet', 'cash']
+PAYMENT_MODE_WEIGHTS = [0.45, 0.2, 0.2, 0.15]
+RATING_SCORE_WEIGHTS = [0.03, 0.05, 0.12, 0.35, 0.45]
+# Relative demand per hour of day: commute peaks for rides, meal peaks for orders.
+RIDE_HOUR_WEIGHTS = [1, 0.5, 0.3, 0.3, 0.5, 1, 3, 6, 9, 8, 5, 4, 4, 4, 4, 5, 6, 8, 9, 8, 6, 4, 3, 2]
+ORDER_HOUR_WEIGHTS = [1, 0.5, 0.2, 0.1, 0.1, 0.2, 0.5, 1, 2, 2, 2, 4, 8, 9, 6, 3, 2, 3, 5, 9, 10, 8, 5, 2]
+SYNTHETIC_TABLES = ('users', 'drivers', 'delivery_partners', 'restaurants', 'menu_items', 'rides',
+                    'orders', 'order_items', 'payments', 'ratings')
+
+
+def load_rows(table, columns, rows):
+    """Writes a list of row tuples: COPY on PostgreSQL, one driver-level executemany elsewhere."""
+    if not rows:
+        return
+    connection = db.session.connection()
+    if db.engine.dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+    else:
+        placeholder = '?' if db.engine.dialect.paramstyle == 'qmark' else '%s'
+        connection.exec_driver_sql(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join([placeholder] * len(columns))})", rows
+        )
+
+
+def synthetic_rng(seed, table):
+    return np.random.default_rng([seed, zlib.crc32(table.encode())])
+
+
+def popularity(rng, count):
+    """Heavy-tailed selection probabilities: a few users/restaurants dominate, as in real traffic."""
+    weights = rng.pareto(1.5, count) + 1
+    return weights / weights.sum()
+
+
+def synthetic_times(rng, size, start, days, hour_weights):
+    """Timestamps with growing daily volume, busier weekends and the given hourly profile."""
+    day_index = np.arange(days)
+    weekday = (np.datetime64(start, 'D') + day_index).view('int64') % 7  # 0 is a Thursday (1970-01-01)
+    day_weights = (1 + day_index / days) * np.where((weekday == 2) | (weekday == 3), 1.25, 1.0)
+    hours = np.asarray(hour_weights, dtype=float)
+    seconds = (rng.choice(days, size, p=day_weights / day_weights.sum()) * 86400
+               + rng.choice(24, size, p=hours / hours.sum()) * 3600
+               + rng.integers(0, 3600, size))
+    return np.datetime64(start, 's') + seconds
+
+
+def timestamp_strings(values):
+    """``YYYY-MM-DD HH:MM:SS`` strings, the format CURRENT_TIMESTAMP produces."""
+    return np.char.replace(np.datetime_as_string(values, unit='s'), 'T', ' ').tolist()
+
+
+def nearby_coords(rng, size, spread=0.12):
+    lat = np.round(SYNTHETIC_CENTER[0] + rng.normal(0, spread, size), 6)
+    lng = np.round(SYNTHETIC_CENTER[1] + rng.normal(0, spread, size), 6)
+    return lat.tolist(), lng.tolist()
+
+
+def chunk_bounds(total):
+    for first in range(0, total, SYNTHETIC_CHUNK_SIZE):
+        yield first, min(first + SYNTHETIC_CHUNK_SIZE, total)
+
+
+def seed_people(table, pk, label, count, seed, now):
+    """Users, drivers and delivery partners: names, phones, and per-table extras."""
+    rng = synthetic_rng(seed, table)
+    for first, last in chunk_bounds(count):
+        ids = range(first + 1, last + 1)
+        size = last - first
+        columns = [pk, 'name', 'phone']
+        values = [ids, [f'{label} {i}' for i in ids], [f'9{i:09d}' for i in ids]]
+        if table == 'users':
+            places = list(KNOWN_PLACES)
+            columns += ['email', 'address', 'wallet_balance']
+            values += [[f'user{i}@example.com' for i in ids],
+                       [places[p].title() for p in rng.integers(0, len(places), size)],
+                       np.round(rng.gamma(2.0, 600.0, size), 2).tolist()]
+        else:
+            statuses = rng.choice(['available', 'busy', 'offline'], size, p=[0.5, 0.3, 0.2]).tolist()
+            lat, lng = nearby_coords(rng, size)
+            seen = timestamp_strings(np.datetime64(now, 's') - rng.integers(0, 3600, size))
+            columns += ['vehicle_no', 'status', 'lat', 'lng', 'location_updated_at']
+            values += [[f'KA-{i % 60 + 1:02d}-{i % 9000 + 1000}' for i in ids], statuses, lat, lng, seen]
+            if table == 'drivers':
+                columns += ['license_no', 'rating']
+                values += [[f'KA{i:011d}' for i in ids], [0] * size]
+        load_rows(table, columns, list(zip(*values)))
+    db.session.commit()
+
+
+def seed_restaurants(count, items_per_restaurant, seed):
+    """Restaurants and their menus; returns the menu price of every item_id (index item_id - 1)."""
+    rng = synthetic_rng(seed, 'restaurants')
+    places = list(KNOWN_PLACES)
+    for first, last in chunk_bounds(count):
+        ids = range(first + 1, last + 1)
+        size = last - first
+        load_rows('restaurants', ['restaurant_id', 'name', 'location', 'cuisine', 'rating'], list(zip(
+            ids, [f'Restaurant {i}' for i in ids],
+            [places[p].title() for p in rng.integers(0, len(places), size)],
+            [SYNTHETIC_CUISINES[c] for c in rng.integers(0, len(SYNTHETIC_CUISINES), size)],
+            [0] * size)))
+
+    rng = synthetic_rng(seed, 'menu_items')
+    prices = np.round(rng.lognormal(5.4, 0.5, count * items_per_restaurant)).clip(30, 2000)
+    for first, last in chunk_bounds(count * items_per_restaurant):
+        ids = range(first + 1, last + 1)
+        size = last - first
+        dishes = rng.integers(0, len(SYNTHETIC_DISHES), size)
+        load_rows('menu_items', ['item_id', 'restaurant_id', 'name', 'price', 'availability'], list(zip(
+            ids, [(i - 1) // items_per_restaurant + 1 for i in ids],
+            [f'{SYNTHETIC_DISHES[d]} #{i}' for d, i in zip(dishes, ids)],
+            prices[first:last].tolist(), (rng.random(size) < 0.95).tolist())))
+    db.session.commit()
+    return prices
+
+
+def seed_payments_and_ratings(rng, kind, ids, user_ids, target_ids, amounts, timestamps, rating_rate):
+    """Payments for completed rides/orders (NumPy arrays), and ratings for a share of them."""
+    size = len(ids)
+    ref_column = 'ride_id' if kind == 'driver' else 'order_id'
+    user_list = user_ids.tolist()
+    load_rows('payments', ['user_id', ref_column, 'amount', 'mode', 'status', 'timestamp'], list(zip(
+        user_list, ids.tolist(), amounts.tolist(),
+        rng.choice(PAYMENT_MODES, size, p=PAYMENT_MODE_WEIGHTS).tolist(),
+        np.where(rng.random(size) < 0.97, 'paid', 'failed').tolist(),
+        timestamp_strings(timestamps + rng.integers(60, 1800, size)))))
+    rated = rng.random(size) < rating_rate
+    count = int(rated.sum())
+    load_rows('ratings', ['user_id', 'target_id', 'target_type', 'score', 'timestamp'], list(zip(
+        user_ids[rated].tolist(), target_ids[rated].tolist(), [kind] * count,
+        rng.choice(np.arange(1, 6), count, p=RATING_SCORE_WEIGHTS).tolist(),
+        timestamp_strings(timestamps[rated] + rng.integers(300, 86400, count)))))
+
+
+def seed_rides(count, users, drivers, start, days, rating_rate, seed):
+    rng = synthetic_rng(seed, 'rides')
+    user_p = popularity(rng, users)
+    places = list(KNOWN_PLACES)
+    names = np.array([place.title() for place in places])
+    distance = np.array(route_distances_km([(KNOWN_PLACES[a], KNOWN_PLACES[b]) for a in places for b in places]))
+    cards = [RATE_CARDS[c] for c in RATE_CARDS]
+    base, per_km, minimum = (np.array([card[key] for card in cards], dtype=float) for key in ('base', 'per_km', 'minimum'))
+    class_p = [0.15, 0.3, 0.35, 0.15, 0.05]  # bike, auto, mini, sedan, suv
+    for first, last in chunk_bounds(count):
+        size = last - first
+        ids = np.arange(first + 1, last + 1)
+        user_ids = rng.choice(users, size, p=user_p) + 1
+        driver_ids = rng.integers(1, drivers + 1, size)
+        source = rng.integers(0, len(places), size)
+        destination = (source + rng.integers(1, len(places), size)) % len(places)
+        vehicle = rng.choice(len(cards), size, p=class_p)
+        km = distance[source * len(places) + destination]
+        fares = np.round(np.maximum(minimum[vehicle], base[vehicle] + per_km[vehicle] * km), 2)
+        completed = rng.random(size) < 0.94
+        timestamps = synthetic_times(rng, size, start, days, RIDE_HOUR_WEIGHTS)
+        load_rows('rides', ['ride_id', 'user_id', 'driver_id', 'source', 'destination', 'fare', 'status', 'timestamp'],
+                  list(zip(ids.tolist(), user_ids.tolist(), driver_ids.tolist(), names[source].tolist(),
+                           names[destination].tolist(), fares.tolist(),
+                           np.where(completed, 'completed', 'cancelled').tolist(), timestamp_strings(timestamps))))
+        seed_payments_and_ratings(rng, 'driver', ids[completed], user_ids[completed], driver_ids[completed],
+                                  fares[completed], timestamps[completed], rating_rate)
+    db.session.commit()
+
+
+def seed_orders(count, users, restaurants, partners, prices, items_per_restaurant, start, days, rating_rate, seed):
+    rng = synthetic_rng(seed, 'orders')
+    user_p = popularity(rng, users)
+    restaurant_p = popularity(rng, restaurants)
+    for first, last in chunk_bounds(count):
+        size = last - first
+        ids = np.arange(first + 1, last + 1)
+        restaurant_ids = rng.choice(restaurants, size, p=restaurant_p) + 1
+        # 1-4 lines per order, each an item from the order's own restaurant.
+        lines = rng.integers(1, 5, size)
+        line_order = np.repeat(np.arange(size), lines)
+        line_items = ((restaurant_ids[line_order] - 1) * items_per_restaurant
+                      + rng.integers(0, items_per_restaurant, len(line_order)) + 1)
+        line_qty = rng.integers(1, 4, len(line_order))
+        totals = np.round(np.bincount(line_order, weights=prices[line_items - 1] * line_qty, minlength=size), 2)
+
+        user_ids = rng.choice(users, size, p=user_p) + 1
+        delivered = rng.random(size) < 0.95
+        timestamps = synthetic_times(rng, size, start, days, ORDER_HOUR_WEIGHTS)
+        load_rows('orders', ['order_id', 'user_id', 'restaurant_id', 'partner_id', 'total_amount', 'status', 'timestamp'],
+                  list(zip(ids.tolist(), user_ids.tolist(), restaurant_ids.tolist(),
+                           rng.integers(1, partners + 1, size).tolist(), totals.tolist(),
+                           np.where(delivered, 'delivered', 'cancelled').tolist(), timestamp_strings(timestamps))))
+        load_rows('order_items', ['order_id', 'item_id', 'quantity'],
+                  list(zip(ids[line_order].tolist(), line_items.tolist(), line_qty.tolist())))
+        seed_payments_and_ratings(rng, 'restaurant', ids[delivered], user_ids[delivered], restaurant_ids[delivered],
+                                  totals[delivered], timestamps[delivered], rating_rate)
+    db.session.commit()
+
+
+def reset_sequences():
+    """Moves PostgreSQL id sequences past the explicitly inserted ids."""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for model in (User, Driver, Restaurant, MenuItem, DeliveryPartner, Ride, Order):
+        table, pk = model.__table__.name, primary_key_of(model)
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{table}', '{pk}'), COALESCE(MAX({pk}), 1)) FROM {table}"
+        ))
+    db.session.commit()
+
+
+def seed_synthetic_data(users, rides, orders=None, drivers=None, restaurants=None, partners=None,
+                        items_per_restaurant=12, start=date(2024, 1, 1), days=365, rating_rate=0.4, seed=42):
+    """Loads a synthetic dataset into an empty database and rebuilds every derived table."""
+    orders = rides if orders is None else orders
+    drivers = drivers or max(users // 10, 1)
+    restaurants = restaurants or max(users // 50, 1)
+    partners = partners or max(users // 20, 1)
+    now = datetime.combine(start + timedelta(days=days), datetime.min.time())
+    seed_people('users', 'user_id', 'User', users, seed, now)
+    seed_people('drivers', 'driver_id', 'Driver', drivers, seed, now)
+    seed_people('delivery_partners', 'partner_id', 'Partner', partners, seed, now)
+    prices = seed_restaurants(restaurants, items_per_restaurant, seed)
+    seed_rides(rides, users, drivers, start, days, rating_rate, seed)
+    seed_orders(orders, users, restaurants, partners, prices, items_per_restaurant, start, days, rating_rate, seed)
+    reset_sequences()
+    rebuild_rollups()
+    rebuild_ratings()
+    rebuild_search_index()
+
+
+def database_is_empty():
+    return not db.session.execute(text(
+        "SELECT (SELECT COUNT(*) FROM users) + (SELECT COUNT(*) FROM drivers) + (SELECT COUNT(*) FROM rides)"
+    )).scalar()
+
+
+@app.cli.command('seed_synthetic')
+@click.option('--users', default=10000, show_default=True)
+@click.option('--rides', default=100000, show_default=True)
+@click.option('--orders', type=int, help='Orders to generate  [default: same as --rides]')
+@click.option('--drivers', type=int, help='[default: users / 10]')
+@click.option('--restaurants', type=int, help='[default: users / 50]')
+@click.option('--partners', type=int, help='Delivery partners  [default: users / 20]')
+@click.option('--items-per-restaurant', default=12, show_default=True)
+@click.option('--start', type=click.DateTime(['%Y-%m-%d']), default='2024-01-01', show_default=True,
+              help='First day of ride/order history.')
+@click.option('--days', default=365, show_default=True, help='Days of ride/order history.')
+@click.option('--rating-rate', default=0.4, show_default=True, help='Share of completed rides/orders that get rated.')
+@click.option('--seed', default=42, show_default=True)
+def seed_synthetic(users, rides, orders, drivers, restaurants, partners, items_per_restaurant, start, days,
+                   rating_rate, seed):
+    """Generates a large, referentially consistent dataset into an empty database."""
+    ensure_search_index()
+    if not database_is_empty():
+        raise click.ClickException('Database is not empty; run `flask db_reset` first.')
+    began = time.perf_counter()
+    seed_synthetic_data(users, rides, orders, drivers, restaurants, partners, items_per_restaurant,
+                        start.date(), days, rating_rate, seed)
+    elapsed = time.perf_counter() - began
+    counts = db.session.execute(text(
+        "SELECT " + ', '.join(f"(SELECT COUNT(*) FROM {t})" for t in SYNTHETIC_TABLES)
+    )).one()
+    for table, count in zip(SYNTHETIC_TABLES, counts):
+        print(f'{table:<20}{count:>12}')
+    print(f'Loaded {sum(counts)} rows in {elapsed:.1f}s ({sum(counts) / elapsed:,.0f} rows/s)')
+
+
+### Query benchmark
+
+# (name, SQL) for the statements behind the hot routes. Each ``:<table>_id``
+# parameter is drawn at random from the ids present in the database.
+BENCH_QUERIES = [
+    ('users page', "SELECT * FROM users WHERE user_id > :user_id ORDER BY user_id LIMIT 100"),
+    ('rides page desc', "SELECT * FROM rides WHERE ride_id < :ride_id ORDER BY ride_id DESC LIMIT 100"),
+    ('user ride history', """
+        SELECT * FROM rides WHERE user_id = :user_id
+        ORDER BY timestamp DESC, ride_id DESC LIMIT 20"""),
+    ('user order history', """
+        SELECT * FROM orders WHERE user_id = :user_id
+        ORDER BY timestamp DESC, order_id DESC LIMIT 20"""),
+    ('user summary', """
+        SELECT
+            (SELECT COUNT(*) FROM rides WHERE user_id = :user_id),
+            (SELECT COALESCE(SUM(fare), 0) FROM rides WHERE user_id = :user_id),
+            (SELECT COUNT(*) FROM orders WHERE user_id = :user_id),
+            (SELECT COALESCE(SUM(total_amount), 0) FROM orders WHERE user_id = :user_id)"""),
+    ('rides by driver', "SELECT * FROM rides WHERE driver_id = :driver_id"),
+    ('orders by restaurant', "SELECT * FROM orders WHERE restaurant_id = :restaurant_id"),
+    ('order items by order', "SELECT * FROM order_items WHERE order_id = :order_id"),
+    ('payments by order', "SELECT * FROM payments WHERE order_id = :order_id"),
+    ('menu by restaurant', "SELECT * FROM menu_items WHERE restaurant_id = :restaurant_id"),
+    ('available drivers', "SELECT * FROM drivers WHERE status = 'available' LIMIT 50"),
+    ('available partners', "SELECT * FROM delivery_partners WHERE status = 'available' LIMIT 50"),
+    ('ratings for driver', """
+        SELECT * FROM ratings WHERE target_type = 'driver' AND target_id = :driver_id"""),
+    ('top drivers', """
+        SELECT s.driver_id, d.name, s.ride_count FROM driver_stats s
+        JOIN drivers d ON d.driver_id = s.driver_id
+        ORDER BY s.ride_count DESC LIMIT 5"""),
+    ('analytics totals', "SELECT metric, value FROM platform_totals"),
+]
+
+
+def explain(sql, params):
+    prefix = 'EXPLAIN QUERY PLAN ' if db.engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    rows = db.session.execute(text(prefix + sql), params).all()
+    # SQLite returns (id, parent, notused, detail); PostgreSQL one text column.
+    return [row[-1] for row in rows]
+
+
+@app.cli.command('bench_queries')
+@click.option('--users', default=20000, show_default=True, help='Users to seed (other tables scale from it).')
+@click.option('--rides', default=200000, show_default=True, help='Rides (and orders) to seed.')
+@click.option('--repeat', default=20, show_default=True, help='Timed executions per query.')
+@click.option('--no-seed', is_flag=True, help='Benchmark the data already in the database.')
+@click.option('--seed', default=42, show_default=True, help='Random seed for data and parameters.')
+def bench_queries(users, rides, repeat, no_seed, seed):
+    """Times the SQL behind each route and prints its query plan.
+
+    Run it against SQLite and PostgreSQL (via DATABASE_URL) on an empty
+    database; a sequential scan in a plan points at a missing index.
+    """
+    rng = random.Random(seed)
+    if not no_seed:
+        if not database_is_empty():
+            raise click.ClickException('Database is not empty; use --no-seed or run `flask db_reset` first.')
+        began = time.perf_counter()
+        seed_synthetic_data(users, rides, seed=seed)
+        print(f'Seeded {users} users / {rides} rides in {time.perf_counter() - began:.1f}s')
+    db.session.execute(text('ANALYZE'))
+    db.session.commit()
+
+    def max_id(table, pk):
+        return db.session.execute(text(f"SELECT MAX({pk}) FROM {table}")).scalar() or 1
+
+    bounds = {
+        'user_id': max_id('users', 'user_id'), 'driver_id': max_id('drivers', 'driver_id'),
+        'restaurant_id': max_id('restaurants', 'restaurant_id'), 'order_id': max_id('orders', 'order_id'),
+        'ride_id': max_id('rides', 'ride_id'),
+    }
+    print(f'Dialect: {db.engine.dialect.name}\n')
+    print(f"{'query':<24}{'median ms':>12}{'p95 ms':>10}{'rows':>8}")
+    plans = []
+    for name, sql in BENCH_QUERIES:
+        timings, row_count = [], 0
+        for _ in range(repeat):
+            params = {key: rng.randrange(1, bound + 1) for key, bound in bounds.items() if f':{key}' in sql}
+            began = time.perf_counter()
+            row_count = len(db.session.execute(text(sql), params).all())
+            timings.append((time.perf_counter() - began) * 1000)
+        timings.sort()
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        print(f'{name:<24}{statistics.median(timings):>12.3f}{p95:>10.3f}{row_count:>8}')
+        plans.append((name, explain(sql, params)))
+
+    print('\nQuery plans:')
+    for name, plan in plans:
+        print(f'\n-- {name}')
+        for line in plan:
+            print(f'   {line}')
+
+
+@app.cli.command('bench_assignment')
+@click.option('--orders', 'order_count', default=10000, show_default=True, help='Placed orders to create.')
+@click.option('--partners', 'partner_count', default=5000, show_default=True, help='Available partners to create.')
+@click.option('--restaurants', 'restaurant_count', default=1000, show_default=True,
+              help='Restaurants (at random positions) the orders come from.')
+@click.option('--seed', default=42, show_default=True)
+def bench_assignment(order_count, partner_count, restaurant_count, seed):
+    """Times one assignment tick over a fresh batch of orders and partners.
+
+    Other waiting orders and available partners are parked for the run and
+    the bench rows are removed afterwards.
+    """
+    user_id = db.session.execute(text("SELECT MIN(user_id) FROM users")).scalar()
+    if user_id is None:
+        raise click.ClickException('Need at least one user; run `flask seed_db` first.')
+    rng = synthetic_rng(seed, 'bench_assignment')
+    in_ids = bindparam('ids', expanding=True)
+    parked_orders = db.session.execute(text(
+        "UPDATE orders SET status = 'bench_parked' WHERE status = 'placed' AND partner_id IS NULL RETURNING order_id"
+    )).scalars().all()
+    parked_partners = db.session.execute(text(
+        "UPDATE delivery_partners SET status = 'bench_parked' WHERE status = 'available' RETURNING partner_id"
+    )).scalars().all()
+
+    lat, lng = nearby_coords(rng, restaurant_count)
+    restaurants = list(db.session.execute(
+        insert(Restaurant.__table__).returning(Restaurant.__table__.c.restaurant_id, sort_by_parameter_order=True),
+        [{'name': f'Bench restaurant {i}', 'location': f'{a},{b}'} for i, (a, b) in enumerate(zip(lat, lng))],
+    ).scalars())
+    lat, lng = nearby_coords(rng, partner_count)
+    partners = list(db.session.execute(
+        insert(DeliveryPartner.__table__).returning(DeliveryPartner.__table__.c.partner_id,
+                                                    sort_by_parameter_order=True),
+        [{'name': f'Bench partner {i}', 'status': 'available', 'lat': a, 'lng': b}
+         for i, (a, b) in enumerate(zip(lat, lng))],
+    ).scalars())
+    picks = rng.choice(restaurants, order_count, p=popularity(rng, len(restaurants))).tolist()
+    orders = list(db.session.execute(
+        insert(Order.__table__).returning(Order.__table__.c.order_id, sort_by_parameter_order=True),
+        [{'user_id': user_id, 'restaurant_id': r, 'total_amount': 0, 'status': 'placed'} for r in picks],
+    ).scalars())
+    db.session.commit()
+
+    try:
+        began = time.perf_counter()
+        stats = assign_orders(limit=order_count)
+        elapsed = time.perf_counter() - began
+        doubled = db.session.execute(text("""
+            SELECT COUNT(*) FROM (SELECT partner_id FROM orders WHERE order_id IN :ids AND partner_id IS NOT NULL
+                                  GROUP BY partner_id HAVING COUNT(*) > 1) d
+        """).bindparams(in_ids), {'ids': orders}).scalar()
+        print(f'Dialect: {db.engine.dialect.name}')
+        print(f"{order_count} orders from {restaurant_count} restaurants, {partner_count} partners: "
+              f"one tick in {elapsed * 1000:.0f} ms")
+        print(f"assigned={stats['assigned']} mean distance={stats.get('mean_km', 0)} km "
+              f"partners double-booked={doubled}")
+    finally:
+        db.session.rollback()
+        db.session.execute(text("DELETE FROM orders WHERE order_id IN :ids").bindparams(in_ids), {'ids': orders})
+        db.session.execute(text("DELETE FROM delivery_partners WHERE partner_id IN :ids").bindparams(in_ids),
+                           {'ids': partners})
+        db.session.execute(text("DELETE FROM restaurants WHERE restaurant_id IN :ids").bindparams(in_ids),
+                           {'ids': restaurants})
+        for table, pk, status, ids in (('orders', 'order_id', 'placed', parked_orders),
+                                       ('delivery_partners', 'partner_id', 'available', parked_partners)):
+            if ids:
+                db.session.execute(text(f"UPDATE {table} SET status = '{status}' WHERE {pk} IN :ids").bindparams(
+                    in_ids), {'ids': ids})
+        db.session.commit()
+
+
+@app.cli.command('bench_settlement')
+@click.option('--users', 'user_count', default=2000, show_default=True, help='Wallet owners to create.')
+@click.option('--payments', 'payment_count', default=20000, show_default=True, help='Pending wallet payments.')
+@click.option('--batch-size', default=SETTLE_BATCH_SIZE, show_default=True, help='Payments per transaction.')
+@click.option('--seed', default=42, show_default=True)
+def bench_settlement(user_count, payment_count, batch_size, seed):
+    """Times settling a fresh batch of pending wallet payments and checks the result.
+
+    Balances are drawn so that many users can afford only some of their
+    payments. One extra user has 800 in the wallet and pays 900, 100 and 50
+    in that order: the 900 must fail and the other two be paid. Other
+    pending wallet payments are parked for the run and the bench rows are
+    removed afterwards.
+    """
+    rng = synthetic_rng(seed, 'bench_settlement')
+    in_ids = bindparam('ids', expanding=True)
+    parked = db.session.execute(text(
+        "UPDATE payments SET status = 'bench_parked' WHERE status = 'pending' AND mode = 'wallet' RETURNING payment_id"
+    )).scalars().all()
+    balances = np.round(rng.uniform(0, 2000, user_count), 2).tolist() + [800]
+    users = list(db.session.execute(
+        insert(User.__table__).returning(User.__table__.c.user_id, sort_by_parameter_order=True),
+        [{'name': f'Bench wallet {i}', 'wallet_balance': balance} for i, balance in enumerate(balances)],
+    ).scalars())
+    owners = rng.choice(users[:-1], payment_count).tolist() + [users[-1]] * 3
+    amounts = np.round(rng.uniform(10, 600, payment_count), 2).tolist() + [900, 100, 50]
+    payments = list(db.session.execute(
+        insert(Payment.__table__).returning(Payment.__table__.c.payment_id, sort_by_parameter_order=True),
+        [{'user_id': u, 'amount': a, 'mode': 'wallet', 'status': 'pending'} for u, a in zip(owners, amounts)],
+    ).scalars())
+    db.session.commit()
+
+    try:
+        totals = Counter()
+        began = time.perf_counter()
+        while True:
+            stats = settle_payments(batch_size)
+            totals.update(stats)
+            if stats['claimed'] < batch_size:
+                break
+        elapsed = time.perf_counter() - began
+        overdrawn, left, paid = db.session.execute(text("""
+            SELECT (SELECT COUNT(*) FROM users WHERE user_id IN :ids AND wallet_balance < 0),
+                   (SELECT SUM(wallet_balance) FROM users WHERE user_id IN :ids),
+                   (SELECT SUM(amount) FROM payments WHERE user_id IN :ids AND status = 'paid')
+        """).bindparams(in_ids), {'ids': users}).one()
+        mixed = db.session.execute(text("SELECT status FROM payments WHERE payment_id IN :ids ORDER BY payment_id")
+                                   .bindparams(in_ids), {'ids': payments[-3:]}).scalars().all()
+        print(f'Dialect: {db.engine.dialect.name}')
+        print(f"{payment_count} payments of {user_count} users in {elapsed * 1000:.0f} ms "
+              f"({payment_count / elapsed:.0f} payments/s): paid={totals['paid']} failed={totals['failed']}")
+        print(f"wallets overdrawn={overdrawn} debits match paid payments="
+              f"{abs(sum(balances) - float(left) - float(paid or 0)) < 0.01}")
+        print(f"800 wallet paying 900, 100, 50: {', '.join(mixed)} "
+              f"({'ok' if mixed == ['failed', 'paid', 'paid'] else 'WRONG'})")
+    finally:
+        db.session.rollback()
+        db.session.execute(text("DELETE FROM payments WHERE payment_id IN :ids").bindparams(in_ids), {'ids': payments})
+        db.session.execute(text("DELETE FROM users WHERE user_id IN :ids").bindparams(in_ids), {'ids': users})
+        if parked:
+            db.session.execute(text("UPDATE payments SET status = 'pending' WHERE payment_id IN :ids").bindparams(
+                in_ids), {'ids': parked})
+        db.session.commit()
+
+
+@app.cli.command('bench_dispatch')
+@click.option('--drivers', default=100, show_default=True, help='Available drivers to create for the run.')
+@click.option('--requests', 'total', default=500, show_default=True, help='Bookings to fire.')
+@click.option('--concurrency', default=50, show_default=True, help='Simultaneous bookings in flight.')
+def bench_dispatch(drivers, total, concurrency):
+    """Fires concurrent /api/rides/dispatch calls and checks for double assignment.
+
+    Creates a fresh batch of available drivers, lets ``concurrency`` threads
+    book rides against them, then verifies that no driver got more than one
+    ride and that exactly ``min(drivers, requests)`` bookings succeeded.
+    """
+    user_id = db.session.execute(text("SELECT MIN(user_id) FROM users")).scalar()
+    if user_id is None:
+        raise click.ClickException('Need at least one user; run `flask seed_db` first.')
+    # Park every other driver so only this run's batch can be claimed.
+    parked = [row[0] for row in db.session.execute(text(
+        "UPDATE drivers SET status = 'offline' WHERE status = 'available' RETURNING driver_id"))]
+    batch = list(db.session.execute(
+        insert(Driver.__table__).returning(Driver.__table__.c.driver_id, sort_by_parameter_order=True),
+        [{'name': f'Bench driver {i}', 'status': 'available'} for i in range(drivers)],
+    ).scalars())
+    db.session.commit()
+
+    client = app.test_client()
+    payload = {'user_id': user_id, 'source': 'Koramangala', 'destination': 'Indiranagar'}
+
+    def book(_):
+        response = client.post('/api/rides/dispatch', json=payload)
+        return response.status_code, response.get_json()
+
+    began = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(book, range(total)))
+    elapsed = time.perf_counter() - began
+
+    created = [body for status, body in results if status == 201]
+    conflicts = sum(1 for status, _ in results if status == 409)
+    errors = len(results) - len(created) - conflicts
+    per_driver = {}
+    for body in created:
+        per_driver[body['driver_id']] = per_driver.get(body['driver_id'], 0) + 1
+    doubled = {driver: count for driver, count in per_driver.items() if count > 1}
+
+    print(f'Dialect: {db.engine.dialect.name}')
+    print(f'{total} bookings, {concurrency} concurrent, {drivers} drivers: {elapsed:.2f}s '
+          f'({total / elapsed:.0f} req/s)')
+    print(f'created={len(created)} no_driver={conflicts} errors={errors}')
+    print('double assignments: ' + (str(doubled) if doubled else 'none'))
+
+    # Put the database back the way it was, apart from the bench rides.
+    db.session.execute(text("UPDATE drivers SET status = 'offline' WHERE driver_id IN :ids").bindparams(
+        bindparam('ids', expanding=True)), {'ids': batch})
+    if parked:
+        db.session.execute(text("UPDATE drivers SET status = 'available' WHERE driver_id IN :ids").bindparams(
+            bindparam('ids', expanding=True)), {'ids': parked})
+    db.session.commit()
+    if doubled or len(created) != min(drivers, total):
+        raise click.ClickException('dispatch invariant violated')
+
+
+
+@app.cli.command('bench_writes')
+@click.option('--kind', type=click.Choice(['rating', 'location']), default='rating', show_default=True)
+@click.option('--requests', 'total', default=2000, show_default=True, help='Writes to fire per mode.')
+@click.option('--concurrency', default=16, show_default=True, help='Simultaneous writes in flight.')
+def bench_writes(kind, total, concurrency):
+    """Compares per-request commits with the write-behind queue.
+
+    Fires the same writes twice, synchronously and with
+    ``Prefer: respond-async``; the async timing includes waiting for the
+    queue to drain, so both numbers are committed writes per second.
+    """
+    user_id = db.session.execute(text("SELECT MIN(user_id) FROM users")).scalar()
+    driver_ids = db.session.execute(text("SELECT driver_id FROM drivers ORDER BY driver_id LIMIT 1000")).scalars().all()
+    if user_id is None or not driver_ids:
+        raise click.ClickException('Need users and drivers; run `flask seed_db` first.')
+    client = app.test_client()
+
+    def send(index, headers):
+        driver_id = driver_ids[index % len(driver_ids)]
+        if kind == 'rating':
+            payload = {'user_id': user_id, 'target_id': driver_id, 'target_type': 'driver',
+                       'score': index % 5 + 1, 'comment': 'bench_writes'}
+            return client.post('/api/ratings/create', json=payload, headers=headers).status_code
+        payload = {'lat': 12.9 + (index % 100) / 1000, 'lng': 77.6 + (index % 70) / 1000}
+        return client.post(f'/api/drivers/{driver_id}/location', json=payload, headers=headers).status_code
+
+    print(f'Dialect: {db.engine.dialect.name}, profile: {DB_PROFILE}')
+    print(f"{'mode':<22}{'writes/s':>10}{'transactions':>14}  statuses")
+    for label, headers in (('per-request commit', {}), ('write-behind', {'Prefer': 'respond-async'})):
+        flushes = write_behind.stats()['flushes']
+        began = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            statuses = Counter(pool.map(lambda i: send(i, headers), range(total)))
+        write_behind.wait_idle()
+        elapsed = time.perf_counter() - began
+        transactions = total if not headers else write_behind.stats()['flushes'] - flushes
+        print(f'{label:<22}{total / elapsed:>10.0f}{transactions:>14}  {dict(statuses)}')
+
+    if kind == 'rating':
+        db.session.execute(text("DELETE FROM ratings WHERE comment = 'bench_writes'"))
+        db.session.commit()
+        rebuild_ratings()
+
 if __name__ == '__main__':
     app.run(debug=True, port=5001)
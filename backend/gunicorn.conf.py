@@ -0,0 +1,37 @@
+# gunicorn settings for `gunicorn -c gunicorn.conf.py wsgi:app`.
+# Every worker process opens its own connection pool, so the database sees up
+# to workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections on PostgreSQL.
+import multiprocessing
+import os
+import sys
+
+bind = os.environ.get('BIND', '0.0.0.0:5001')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# Every open /api/stream (Server-Sent Events) connection holds one of a
+# worker's threads. The app serves at most EVENT_MAX_STREAMS streams per
+# worker (default: half of GUNICORN_THREADS) and ends each after
+# EVENT_STREAM_SECONDS (300); browsers then reconnect and resume. Raise
+# GUNICORN_THREADS along with EVENT_MAX_STREAMS for more subscribers.
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+timeout = 60
+keepalive = 5
+# Recycle workers now and then so per-process caches and pools start fresh.
+max_requests = 10000
+max_requests_jitter = 1000
+
+
+def post_fork(server, worker):
+    # With --preload the engine is created in the master; never share its
+    # pooled connections with the forked workers.
+    backend = sys.modules.get('app')
+    if backend is not None:
+        with backend.app.app_context():
+            backend.db.engine.dispose(close=False)
+
+
+def worker_exit(server, worker):
+    # Commit whatever the write-behind queue still holds before the worker goes.
+    backend = sys.modules.get('app')
+    if backend is not None:
+        backend.write_behind.close()
@@ -0,0 +1,182 @@
+"""HTTP load test comparing the engine profiles (see ENGINE_PROFILES in app.py).
+
+    python loadtest.py --profiles default,production --duration 15 --concurrency 32
+
+For each profile the script starts the app in a child process (gunicorn with
+wsgi:app when it is installed, otherwise werkzeug's threaded server), drives
+a mixed read/write workload against it and reports throughput and latency.
+On SQLite every profile gets its own copy of one freshly seeded database so
+the runs start from identical data; with DATABASE_URL pointing at PostgreSQL
+the runs share that (already seeded) database.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def seed_template(path, users, rides, seed):
+    env = dict(os.environ, DATABASE_URL=f'sqlite:///{path}', DB_PROFILE='default')
+    for args in (['db_create'], ['seed_synthetic', '--users', str(users), '--rides', str(rides), '--seed', str(seed)]):
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', *args],
+                       cwd=HERE, env=env, check=True, stdout=subprocess.DEVNULL)
+
+
+def server_command(port, workers):
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        print('gunicorn is not installed; using the werkzeug threaded server (one process).')
+        return [sys.executable, '-c',
+                f'import logging; logging.getLogger("werkzeug").setLevel(logging.WARNING); '
+                f'from werkzeug.serving import run_simple; from wsgi import app; '
+                f'run_simple("127.0.0.1", {port}, app, threaded=True)']
+    return [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py',
+            '--bind', f'127.0.0.1:{port}', '--workers', str(workers), 'wsgi:app']
+
+
+def wait_until_ready(base_url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f'server exited with code {process.returncode}')
+        try:
+            urllib.request.urlopen(f'{base_url}/api/cache/stats', timeout=1).read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit('server did not start in time')
+
+
+def request(base_url, method, path, body=None):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(base_url + path, data=data, method=method,
+                                 headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=30) as resp:
+            resp.read()
+            return resp.status
+    except urllib.error.HTTPError as exc:
+        return exc.code
+
+
+def workload(users, drivers, write_ratio, rng):
+    """Returns one (method, path, body) request drawn from the read/write mix."""
+    if rng.random() < write_ratio:
+        kind = rng.randrange(3)
+        if kind == 0:
+            return 'POST', f'/api/drivers/{rng.randrange(drivers) + 1}/location', {
+                'lat': 12.9 + rng.random() / 10, 'lng': 77.55 + rng.random() / 10}
+        if kind == 1:
+            return 'POST', '/api/ratings/create', {
+                'user_id': rng.randrange(users) + 1, 'target_id': rng.randrange(drivers) + 1,
+                'target_type': 'driver', 'score': rng.randrange(1, 6)}
+        return 'POST', '/api/rides/create', {
+            'user_id': rng.randrange(users) + 1, 'driver_id': rng.randrange(drivers) + 1,
+            'source': 'Koramangala', 'destination': 'Indiranagar', 'status': 'completed'}
+    kind = rng.randrange(3)
+    if kind == 0:
+        return 'GET', f'/api/users/{rng.randrange(users) + 1}/rides?limit=20', None
+    if kind == 1:
+        return 'GET', '/api/rides/list?limit=50', None
+    return 'GET', '/api/analytics/top-drivers', None
+
+
+def run_load(base_url, args):
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+
+    def client(index):
+        nonlocal errors
+        rng = random.Random(args.seed + index)
+        mine, failed = [], 0
+        while time.monotonic() < deadline:
+            method, path, body = workload(args.users, max(args.users // 10, 1), args.write_ratio, rng)
+            started = time.perf_counter()
+            try:
+                status = request(base_url, method, path, body)
+            except OSError:
+                status = None
+            mine.append(time.perf_counter() - started)
+            if status is None or status >= 400:
+                failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors += failed
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(client, range(args.concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'rps': len(latencies) / elapsed,
+        'p50_ms': statistics.median(latencies) * 1000 if latencies else 0,
+        'p95_ms': latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0,
+        'errors': errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profiles', default='default,production')
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn worker processes')
+    parser.add_argument('--write-ratio', type=float, default=0.3)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--rides', type=int, default=50000)
+    parser.add_argument('--port', type=int, default=5101)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    database_url = os.environ.get('DATABASE_URL')
+    workdir = tempfile.mkdtemp(prefix='loadtest-')
+    template = os.path.join(workdir, 'template.db')
+    if not database_url:
+        print(f'Seeding {args.users} users / {args.rides} rides ...')
+        seed_template(template, args.users, args.rides, args.seed)
+
+    results = {}
+    try:
+        for profile in args.profiles.split(','):
+            env = dict(os.environ, DB_PROFILE=profile)
+            if not database_url:
+                path = os.path.join(workdir, f'{profile}.db')
+                shutil.copyfile(template, path)
+                env['DATABASE_URL'] = f'sqlite:///{path}'
+            base_url = f'http://127.0.0.1:{args.port}'
+            process = subprocess.Popen(server_command(args.port, args.workers), cwd=HERE, env=env)
+            try:
+                wait_until_ready(base_url, process)
+                print(f'Profile {profile}: {args.concurrency} clients for {args.duration:.0f}s ...')
+                results[profile] = run_load(base_url, args)
+            finally:
+                process.terminate()
+                process.wait()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    baseline = results.get('default')
+    print(f"\n{'profile':<12} {'requests':>9} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'errors':>7} {'vs default':>11}")
+    for profile, r in results.items():
+        gain = f"{r['rps'] / baseline['rps']:.2f}x" if baseline and baseline['rps'] else '-'
+        print(f"{profile:<12} {r['requests']:>9} {r['rps']:>9.1f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f} "
+              f"{r['errors']:>7} {gain:>11}")
+
+
+if __name__ == '__main__':
+    main()
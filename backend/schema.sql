@@ -15,7 +15,10 @@ CREATE TABLE drivers (
   license_no TEXT,
   vehicle_no TEXT,
   rating NUMERIC DEFAULT 0,
-  status TEXT DEFAULT 'available'
+  status TEXT DEFAULT 'available',
+  lat DOUBLE PRECISION,
+  lng DOUBLE PRECISION,
+  location_updated_at TIMESTAMP
 );
 
 CREATE TABLE restaurants (
@@ -39,7 +42,10 @@ CREATE TABLE delivery_partners (
   name TEXT NOT NULL,
   phone TEXT,
   vehicle_no TEXT,
-  status TEXT DEFAULT 'available'
+  status TEXT DEFAULT 'available',
+  lat DOUBLE PRECISION,
+  lng DOUBLE PRECISION,
+  location_updated_at TIMESTAMP
 );
 
 CREATE TABLE rides (
@@ -77,7 +83,8 @@ CREATE TABLE payments (
   order_id INTEGER REFERENCES orders(order_id),
   amount NUMERIC NOT NULL,
   mode TEXT NOT NULL,
-  status TEXT DEFAULT 'pending'
+  status TEXT DEFAULT 'pending',
+  timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
 CREATE TABLE ratings (
@@ -89,3 +96,156 @@ CREATE TABLE ratings (
   comment TEXT,
   timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+
+-- Per-user history (/api/users/<id>/rides|orders|payments|summary)
+CREATE INDEX ix_rides_user_id_timestamp ON rides (user_id, timestamp);
+CREATE INDEX ix_orders_user_id_timestamp ON orders (user_id, timestamp);
+CREATE INDEX ix_payments_user_id_timestamp ON payments (user_id, timestamp);
+
+-- Foreign key and filter indexes (checked by `flask bench_queries`)
+CREATE INDEX ix_drivers_status ON drivers (status);
+CREATE INDEX ix_delivery_partners_status ON delivery_partners (status);
+CREATE INDEX ix_menu_items_restaurant_id ON menu_items (restaurant_id);
+CREATE INDEX ix_rides_driver_id ON rides (driver_id);
+CREATE INDEX ix_orders_restaurant_id ON orders (restaurant_id);
+CREATE INDEX ix_orders_partner_id ON orders (partner_id);
+CREATE INDEX ix_order_items_order_id ON order_items (order_id);
+CREATE INDEX ix_payments_ride_id ON payments (ride_id);
+CREATE INDEX ix_payments_order_id ON payments (order_id);
+CREATE INDEX ix_rides_timestamp ON rides (timestamp);
+CREATE INDEX ix_orders_timestamp ON orders (timestamp);
+CREATE INDEX ix_ratings_target_type_target_id ON ratings (target_type, target_id);
+
+-- Pending wallet payments, the settlement queue (`flask settle_payments`)
+CREATE INDEX ix_payments_pending_wallet ON payments (payment_id)
+  WHERE status = 'pending' AND mode = 'wallet';
+
+-- Analytics rollups, kept current by the create/delete routes
+-- (recompute with `flask rebuild_rollups`).
+
+CREATE TABLE platform_totals (
+  metric TEXT PRIMARY KEY,
+  value NUMERIC NOT NULL DEFAULT 0
+);
+
+CREATE TABLE daily_revenue (
+  revenue_date DATE PRIMARY KEY,
+  ride_count INTEGER NOT NULL DEFAULT 0,
+  ride_revenue NUMERIC NOT NULL DEFAULT 0,
+  order_count INTEGER NOT NULL DEFAULT 0,
+  order_revenue NUMERIC NOT NULL DEFAULT 0
+);
+
+CREATE TABLE driver_stats (
+  driver_id INTEGER PRIMARY KEY REFERENCES drivers(driver_id),
+  ride_count INTEGER NOT NULL DEFAULT 0,
+  revenue NUMERIC NOT NULL DEFAULT 0
+);
+CREATE INDEX ix_driver_stats_ride_count ON driver_stats (ride_count);
+
+CREATE TABLE restaurant_stats (
+  restaurant_id INTEGER PRIMARY KEY REFERENCES restaurants(restaurant_id),
+  order_count INTEGER NOT NULL DEFAULT 0,
+  revenue NUMERIC NOT NULL DEFAULT 0
+);
+CREATE INDEX ix_restaurant_stats_order_count ON restaurant_stats (order_count);
+
+-- Running rating aggregates per rated driver/restaurant; the write routes keep
+-- them (and drivers.rating / restaurants.rating) current. Recompute with
+-- `flask rebuild_ratings`.
+CREATE TABLE rating_aggregates (
+  target_type TEXT NOT NULL,
+  target_id INTEGER NOT NULL,
+  rating_count INTEGER NOT NULL DEFAULT 0,
+  score_sum INTEGER NOT NULL DEFAULT 0,
+  score_1 INTEGER NOT NULL DEFAULT 0,
+  score_2 INTEGER NOT NULL DEFAULT 0,
+  score_3 INTEGER NOT NULL DEFAULT 0,
+  score_4 INTEGER NOT NULL DEFAULT 0,
+  score_5 INTEGER NOT NULL DEFAULT 0,
+  PRIMARY KEY (target_type, target_id)
+);
+
+-- Full-text search over restaurants and menu items (PostgreSQL variant; on
+-- SQLite the app creates an FTS5 virtual table instead). doc_id is
+-- restaurant_id * 2 for restaurants and item_id * 2 + 1 for menu items.
+-- Repopulate with `flask rebuild_search`.
+CREATE TABLE search_documents (
+  doc_id BIGINT PRIMARY KEY,
+  kind TEXT NOT NULL,
+  ref_id INTEGER NOT NULL,
+  restaurant_id INTEGER NOT NULL,
+  name TEXT,
+  cuisine TEXT,
+  location TEXT,
+  document tsvector GENERATED ALWAYS AS (
+    setweight(to_tsvector('simple', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('simple', coalesce(cuisine, '')), 'B') ||
+    setweight(to_tsvector('simple', coalesce(location, '')), 'C')
+  ) STORED
+);
+CREATE INDEX ix_search_documents_document ON search_documents USING GIN (document);
+
+-- Cold archive (`flask archive_before <date>`). Finished rides and orders
+-- older than the cutoff move here with their order items and payments; the
+-- rides and orders archives are partitioned by month (the app creates the
+-- monthly partitions as it archives). archive_watermarks holds the cutoff per
+-- table so time-ranged reads skip the archive when they start after it.
+CREATE TABLE archive_watermarks (
+  table_name TEXT PRIMARY KEY,
+  archived_before TIMESTAMP NOT NULL
+);
+
+CREATE TABLE rides_archive (
+  ride_id INTEGER NOT NULL,
+  user_id INTEGER NOT NULL,
+  driver_id INTEGER NOT NULL,
+  source TEXT NOT NULL,
+  destination TEXT NOT NULL,
+  fare NUMERIC NOT NULL,
+  status TEXT,
+  timestamp TIMESTAMP
+) PARTITION BY RANGE (timestamp);
+CREATE TABLE rides_archive_default PARTITION OF rides_archive DEFAULT;
+CREATE INDEX ix_rides_archive_ride_id ON rides_archive (ride_id);
+CREATE INDEX ix_rides_archive_user_id_timestamp ON rides_archive (user_id, timestamp);
+CREATE INDEX ix_rides_archive_driver_id ON rides_archive (driver_id);
+CREATE INDEX ix_rides_archive_timestamp ON rides_archive (timestamp);
+
+CREATE TABLE orders_archive (
+  order_id INTEGER NOT NULL,
+  user_id INTEGER NOT NULL,
+  restaurant_id INTEGER NOT NULL,
+  partner_id INTEGER,
+  total_amount NUMERIC NOT NULL,
+  status TEXT,
+  timestamp TIMESTAMP
+) PARTITION BY RANGE (timestamp);
+CREATE TABLE orders_archive_default PARTITION OF orders_archive DEFAULT;
+CREATE INDEX ix_orders_archive_order_id ON orders_archive (order_id);
+CREATE INDEX ix_orders_archive_user_id_timestamp ON orders_archive (user_id, timestamp);
+CREATE INDEX ix_orders_archive_restaurant_id ON orders_archive (restaurant_id);
+CREATE INDEX ix_orders_archive_partner_id ON orders_archive (partner_id);
+CREATE INDEX ix_orders_archive_timestamp ON orders_archive (timestamp);
+
+CREATE TABLE order_items_archive (
+  id INTEGER PRIMARY KEY,
+  order_id INTEGER NOT NULL,
+  item_id INTEGER NOT NULL,
+  quantity INTEGER NOT NULL
+);
+CREATE INDEX ix_order_items_archive_order_id ON order_items_archive (order_id);
+
+CREATE TABLE payments_archive (
+  payment_id INTEGER PRIMARY KEY,
+  user_id INTEGER NOT NULL,
+  ride_id INTEGER,
+  order_id INTEGER,
+  amount NUMERIC NOT NULL,
+  mode TEXT NOT NULL,
+  status TEXT,
+  timestamp TIMESTAMP
+);
+CREATE INDEX ix_payments_archive_user_id_timestamp ON payments_archive (user_id, timestamp);
+CREATE INDEX ix_payments_archive_ride_id ON payments_archive (ride_id);
+CREATE INDEX ix_payments_archive_order_id ON payments_archive (order_id);
@@ -0,0 +1,11 @@
+"""Production entry point for a multi-process WSGI server.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Uses the "production" engine profile unless DB_PROFILE is set.
+"""
+import os
+
+os.environ.setdefault('DB_PROFILE', 'production')
+
+from app import app  # noqa: E402
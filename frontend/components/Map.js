@@ -1,6 +1,7 @@
 import { MapContainer, TileLayer, Marker, Popup, Polyline } from 'react-leaflet'
 import 'leaflet/dist/leaflet.css'
 import L from 'leaflet'
+import { parseCoords } from '../lib/geo'
 
 // Fix for default marker icon
 delete L.Icon.Default.prototype._getIconUrl
@@ -60,7 +61,7 @@ export default function Map({ source, destination, drivers = [] }) {
         
         {/* Driver markers */}
         {drivers.map((driver, idx) => {
-          const driverCoords = parseCoords(driver.location)
+          const driverCoords = driver.lat != null ? [driver.lat, driver.lng] : parseCoords(driver.location)
           if (!driverCoords) return null
           return (
             <Marker key={idx} position={driverCoords}>
@@ -75,31 +76,3 @@ export default function Map({ source, destination, drivers = [] }) {
     </div>
   )
 }
-
-// Helper function to parse location string to coordinates
-// Format: "lat,lng" or just a location name (returns default coords)
-function parseCoords(location) {
-  if (!location) return null
-  
-  // If it's already in "lat,lng" format
-  if (location.includes(',')) {
-    const parts = location.split(',').map(p => parseFloat(p.trim()))
-    if (parts.length === 2 && !isNaN(parts[0]) && !isNaN(parts[1])) {
-      return parts
-    }
-  }
-  
-  // Mock coordinates for common location names
-  const mockLocations = {
-    'koramangala': [12.9352, 77.6245],
-    'indiranagar': [12.9716, 77.6412],
-    'whitefield': [12.9698, 77.7500],
-    'jayanagar': [12.9250, 77.5838],
-    'mg road': [12.9750, 77.6060],
-    'banashankari': [12.9250, 77.5480],
-    'airport': [13.1986, 77.7066],
-  }
-  
-  const normalized = location.toLowerCase().trim()
-  return mockLocations[normalized] || [12.9716, 77.5946] // Default to Bangalore center
-}
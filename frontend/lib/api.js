@@ -10,10 +10,21 @@ async function handleResponse(res){
   }
 }
 
+// Reads go to a read replica when the backend has one; for a few seconds
+// after a write they ask for the primary so the page sees its own changes.
+const READ_PRIMARY_MS = 5000
+let lastWrite = 0
+
+function readHeaders(){
+  return Date.now() - lastWrite < READ_PRIMARY_MS ? {'X-Read-Primary': '1'} : {}
+}
+
 export async function apiPost(path, body){
   try{
-    const res = await fetch(BASE + path, {method: 'POST', headers: {'Content-Type':'application/json'}, body: JSON.stringify(body)})
-    return await handleResponse(res)
+    const res = await fetch(BASE + path, {method: 'POST', headers: {'Content-Type':'application/json', ...readHeaders()}, body: JSON.stringify(body)})
+    const data = await handleResponse(res)
+    if (path !== '/api/batch') lastWrite = Date.now()
+    return data
   }catch(err){
     console.error('apiPost error', path, err)
     throw err
@@ -22,7 +33,7 @@ export async function apiPost(path, body){
 
 export async function apiGet(path){
   try{
-    const res = await fetch(BASE + path)
+    const res = await fetch(BASE + path, {headers: readHeaders()})
     return await handleResponse(res)
   }catch(err){
     console.error('apiGet error', path, err)
@@ -30,12 +41,40 @@ export async function apiGet(path){
   }
 }
 
+// One round trip for several list queries; resolves to {key: rows} (see /api/batch)
+export async function apiBatch(requests){
+  return apiPost('/api/batch', { requests })
+}
+
 export async function apiDelete(path){
   try{
     const res = await fetch(BASE + path, {method: 'DELETE'})
-    return await handleResponse(res)
+    const data = await handleResponse(res)
+    lastWrite = Date.now()
+    return data
   }catch(err){
     console.error('apiDelete error', path, err)
     throw err
   }
 }
+
+// Live change feed (/api/stream). onEvent(topic, event) receives each change;
+// onReset() means changes were missed and the page should reload its lists.
+// Returns a function that closes the connection.
+export function subscribe(topics, { onEvent, onReset, userId } = {}){
+  const params = new URLSearchParams({ topics: topics.join(',') })
+  if (userId) params.set('user_id', userId)
+  const source = new EventSource(`${BASE}/api/stream?${params}`)
+  topics.forEach(topic => source.addEventListener(topic, e => onEvent && onEvent(topic, JSON.parse(e.data))))
+  source.addEventListener('reset', () => onReset && onReset())
+  return () => source.close()
+}
+
+// Applies a created/updated/deleted event to rows identified by `key`
+export function applyEvent(rows, event, key){
+  const id = event.data[key]
+  if (event.type === 'created') return rows.some(r => r[key] === id) ? rows : [...rows, event.data]
+  if (event.type === 'updated') return rows.map(r => r[key] === id ? { ...r, ...event.data } : r)
+  if (event.type === 'deleted') return rows.filter(r => r[key] !== id)
+  return rows
+}
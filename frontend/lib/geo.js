@@ -0,0 +1,27 @@
+// Helper function to parse location string to coordinates
+// Format: "lat,lng" or just a location name (returns default coords)
+export function parseCoords(location) {
+  if (!location) return null
+  
+  // If it's already in "lat,lng" format
+  if (location.includes(',')) {
+    const parts = location.split(',').map(p => parseFloat(p.trim()))
+    if (parts.length === 2 && !isNaN(parts[0]) && !isNaN(parts[1])) {
+      return parts
+    }
+  }
+  
+  // Mock coordinates for common location names
+  const mockLocations = {
+    'koramangala': [12.9352, 77.6245],
+    'indiranagar': [12.9716, 77.6412],
+    'whitefield': [12.9698, 77.7500],
+    'jayanagar': [12.9250, 77.5838],
+    'mg road': [12.9750, 77.6060],
+    'banashankari': [12.9250, 77.5480],
+    'airport': [13.1986, 77.7066],
+  }
+  
+  const normalized = location.toLowerCase().trim()
+  return mockLocations[normalized] || [12.9716, 77.5946] // Default to Bangalore center
+}
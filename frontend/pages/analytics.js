@@ -22,76 +22,28 @@ export default function Analytics() {
 
   async function fetchAnalytics() {
     try {
-      const users = await apiGet('/api/users/list')
-      const drivers = await apiGet('/api/drivers/list')
-      const restaurants = await apiGet('/api/restaurants/list')
-      const rides = await apiGet('/api/rides/list')
-      const orders = await apiGet('/api/orders/list')
-      
-      // Calculate revenue
-      const rideRevenue = rides.reduce((sum, r) => sum + parseFloat(r.fare || 0), 0)
-      const orderRevenue = orders.reduce((sum, o) => sum + parseFloat(o.total_amount || 0), 0)
-      
+      const [totals, drivers, restaurants, revenue] = await Promise.all([
+        apiGet('/api/analytics/totals'),
+        apiGet('/api/analytics/top-drivers?limit=5'),
+        apiGet('/api/analytics/top-restaurants?limit=5'),
+        apiGet('/api/analytics/revenue?period=monthly'),
+      ])
+
       setStats({
-        totalUsers: users.length,
-        totalDrivers: drivers.length,
-        totalRestaurants: restaurants.length,
-        totalRides: rides.length,
-        totalOrders: orders.length,
-        totalRevenue: rideRevenue + orderRevenue,
-      })
-      
-      // Top drivers by number of rides
-      const driverRideCounts = {}
-      rides.forEach(r => {
-        driverRideCounts[r.driver_id] = (driverRideCounts[r.driver_id] || 0) + 1
-      })
-      
-      const topDriversList = Object.entries(driverRideCounts)
-        .map(([driverId, count]) => {
-          const driver = drivers.find(d => d.driver_id === parseInt(driverId))
-          return {
-            name: driver ? driver.name : `Driver ${driverId}`,
-            rides: count,
-            rating: driver ? driver.rating : 0
-          }
-        })
-        .sort((a, b) => b.rides - a.rides)
-        .slice(0, 5)
-      
-      setTopDrivers(topDriversList)
-      
-      // Top restaurants by number of orders
-      const restaurantOrderCounts = {}
-      orders.forEach(o => {
-        restaurantOrderCounts[o.restaurant_id] = (restaurantOrderCounts[o.restaurant_id] || 0) + 1
+        totalUsers: totals.users,
+        totalDrivers: totals.drivers,
+        totalRestaurants: totals.restaurants,
+        totalRides: totals.rides,
+        totalOrders: totals.orders,
+        totalRevenue: parseFloat(totals.total_revenue || 0),
       })
-      
-      const topRestaurantsList = Object.entries(restaurantOrderCounts)
-        .map(([restaurantId, count]) => {
-          const restaurant = restaurants.find(r => r.restaurant_id === parseInt(restaurantId))
-          return {
-            name: restaurant ? restaurant.name : `Restaurant ${restaurantId}`,
-            orders: count,
-            rating: restaurant ? restaurant.rating : 0
-          }
-        })
-        .sort((a, b) => b.orders - a.orders)
-        .slice(0, 5)
-      
-      setTopRestaurants(topRestaurantsList)
-      
-      // Mock revenue data (in real app, would aggregate by date)
-      const mockRevenueData = [
-        { month: 'Jan', rides: 4500, orders: 3200 },
-        { month: 'Feb', rides: 5200, orders: 3800 },
-        { month: 'Mar', rides: 6100, orders: 4200 },
-        { month: 'Apr', rides: 5800, orders: 4500 },
-        { month: 'May', rides: 7200, orders: 5100 },
-        { month: 'Jun', rides: 8100, orders: 5800 },
-      ]
-      setRevenueData(mockRevenueData)
-      
+      setTopDrivers(drivers)
+      setTopRestaurants(restaurants)
+      setRevenueData(revenue.map(p => ({
+        month: p.period,
+        rides: parseFloat(p.rides || 0),
+        orders: parseFloat(p.orders || 0),
+      })))
     } catch (err) {
       console.error('Error fetching analytics:', err)
     }
@@ -132,7 +84,7 @@ export default function Analytics() {
       </div>
 
       <div className="card mt-20">
-        <h2>Revenue Trends (Mock Data)</h2>
+        <h2>Revenue Trends</h2>
         <ResponsiveContainer width="100%" height={300}>
           <LineChart data={revenueData}>
             <CartesianGrid strokeDasharray="3 3" />
@@ -1,77 +1,101 @@
 import { useState, useEffect } from 'react'
 import dynamic from 'next/dynamic'
 import { apiGet, apiPost } from '../lib/api'
+import { parseCoords } from '../lib/geo'
 
 // Dynamic import for Map to avoid SSR issues
 const Map = dynamic(() => import('../components/Map'), { ssr: false })
 
+const VEHICLE_CLASSES = ['bike', 'auto', 'mini', 'sedan', 'suv']
+
 export default function BookRide() {
   const [userId, setUserId] = useState('')
   const [driverId, setDriverId] = useState('')
   const [source, setSource] = useState('')
   const [destination, setDestination] = useState('')
-  const [fare, setFare] = useState('')
+  const [vehicleClass, setVehicleClass] = useState('mini')
+  const [quotes, setQuotes] = useState([])
   
   const [users, setUsers] = useState([])
-  const [drivers, setDrivers] = useState([])
   const [availableDrivers, setAvailableDrivers] = useState([])
 
+  // Pickup point used for the nearby-driver search
+  const [pickupLat, pickupLng] = parseCoords(source) || [12.9716, 77.5946]
+
   useEffect(() => {
     fetchData()
   }, [])
 
+  useEffect(() => {
+    fetchNearbyDrivers()
+  }, [pickupLat, pickupLng])
+
+  useEffect(() => {
+    fetchQuotes()
+  }, [source, destination])
+
   async function fetchData() {
     try {
-      const usersData = await apiGet('/api/users/list')
-      const driversData = await apiGet('/api/drivers/list')
-      
+      const usersData = await apiGet('/api/users/list?fields=user_id,name')
       setUsers(Array.isArray(usersData) ? usersData : [])
-      
-      const driversList = Array.isArray(driversData) ? driversData : []
-      setDrivers(driversList)
-      setAvailableDrivers(driversList.filter(d => d.status === 'available'))
     } catch (err) {
       console.error('Failed to fetch data:', err)
-      alert('Failed to load users or drivers. Please try again.')
+      alert('Failed to load users. Please try again.')
+    }
+  }
+
+  async function fetchNearbyDrivers() {
+    try {
+      const driversData = await apiGet(`/api/drivers/nearby?lat=${pickupLat}&lng=${pickupLng}&k=10&radius_km=25`)
+      setAvailableDrivers(Array.isArray(driversData) ? driversData : [])
+    } catch (err) {
+      console.error('Failed to fetch nearby drivers:', err)
+    }
+  }
+
+  // One batch call prices the trip for every vehicle class
+  async function fetchQuotes() {
+    if (!source || !destination) {
+      setQuotes([])
+      return
+    }
+    try {
+      const trips = VEHICLE_CLASSES.map(vc => ({ source, destination, vehicle_class: vc }))
+      const data = await apiPost('/api/fares/quote', { trips })
+      setQuotes(data.quotes)
+    } catch (err) {
+      setQuotes([])
     }
   }
 
   async function handleSubmit(e) {
     e.preventDefault()
     
-    // Calculate fare based on distance (mock calculation)
-    const calculatedFare = fare || calculateFare(source, destination)
-    
     try {
-      await apiPost('/api/rides/create', {
+      // The backend claims the driver atomically; without a choice it picks the nearest free one
+      const ride = await apiPost('/api/rides/dispatch', {
         user_id: parseInt(userId, 10),
-        driver_id: parseInt(driverId, 10),
+        driver_id: driverId ? parseInt(driverId, 10) : undefined,
+        lat: pickupLat,
+        lng: pickupLng,
         source,
         destination,
-        fare: parseFloat(calculatedFare)
+        vehicle_class: vehicleClass
       })
       
-      alert('Ride booked successfully!')
+      alert(`Ride booked successfully! Driver ID: ${ride.driver_id}, Fare: ₹${ride.fare}`)
+      fetchNearbyDrivers()
       
       // Reset form
       setUserId('')
       setDriverId('')
       setSource('')
       setDestination('')
-      setFare('')
     } catch (err) {
       alert('Error booking ride: ' + (err.message || err))
     }
   }
 
-  function calculateFare(src, dest) {
-    // Mock fare calculation
-    const baseRate = 50
-    const perKmRate = 12
-    const mockDistance = Math.random() * 15 + 2 // 2-17 km
-    return (baseRate + (mockDistance * perKmRate)).toFixed(2)
-  }
-
   return (
     <div>
       <h1>Book a Ride</h1>
@@ -107,8 +131,8 @@ export default function BookRide() {
             />
 
             <label>Driver</label>
-            <select value={driverId} onChange={e => setDriverId(e.target.value)} required>
-              <option value="">Select Driver</option>
+            <select value={driverId} onChange={e => setDriverId(e.target.value)}>
+              <option value="">Nearest available driver</option>
               {availableDrivers.map(d => (
                 <option key={d.driver_id} value={d.driver_id}>
                   {d.name} - Rating: {d.rating || 'N/A'}
@@ -116,21 +140,24 @@ export default function BookRide() {
               ))}
             </select>
 
-            <label>Fare (₹) - Optional (Auto-calculated)</label>
-            <input 
-              type="number"
-              step="0.01"
-              placeholder="Auto-calculated if empty"
-              value={fare}
-              onChange={e => setFare(e.target.value)}
-            />
+            <label>Vehicle</label>
+            <select value={vehicleClass} onChange={e => setVehicleClass(e.target.value)}>
+              {VEHICLE_CLASSES.map(vc => {
+                const q = quotes.find(q => q.vehicle_class === vc)
+                return (
+                  <option key={vc} value={vc}>
+                    {vc}{q ? ` - ₹${q.fare} (${q.distance_km} km)` : ''}
+                  </option>
+                )
+              })}
+            </select>
 
             <button type="submit">Book Ride</button>
           </form>
         </div>
 
         <div className="card">
-          <h2>Available Drivers ({availableDrivers.length})</h2>
+          <h2>Nearby Drivers ({availableDrivers.length})</h2>
           {availableDrivers.length === 0 ? (
             <p>No drivers available at the moment</p>
           ) : (
@@ -140,6 +167,7 @@ export default function BookRide() {
                   <th>Name</th>
                   <th>Vehicle</th>
                   <th>Rating</th>
+                  <th>Distance</th>
                 </tr>
               </thead>
               <tbody>
@@ -148,6 +176,7 @@ export default function BookRide() {
                     <td>{d.name}</td>
                     <td>{d.vehicle_no || 'N/A'}</td>
                     <td>{d.rating || 'N/A'}</td>
+                    <td>{d.distance_km} km</td>
                   </tr>
                 ))}
               </tbody>
@@ -1,6 +1,6 @@
 import { useState, useEffect } from 'react'
 import Link from 'next/link'
-import { apiGet } from '../lib/api'
+import { apiBatch } from '../lib/api'
 
 export default function Dashboard() {
   const [stats, setStats] = useState({
@@ -19,26 +19,23 @@ export default function Dashboard() {
 
   async function fetchDashboardData() {
     try {
-      const users = await apiGet('/api/users/list')
-      const drivers = await apiGet('/api/drivers/list')
-      const rides = await apiGet('/api/rides/list')
-      const orders = await apiGet('/api/orders/list')
-      
-      // Calculate total revenue
-      const rideRevenue = rides.reduce((sum, r) => sum + parseFloat(r.fare || 0), 0)
-      const orderRevenue = orders.reduce((sum, o) => sum + parseFloat(o.total_amount || 0), 0)
-      
+      const { platform_totals, rides, orders } = await apiBatch([
+        { entity: 'platform_totals', limit: 20 },
+        { entity: 'rides', order: 'desc', limit: 5 },
+        { entity: 'orders', order: 'desc', limit: 5 },
+      ])
+      const totals = Object.fromEntries(platform_totals.map(row => [row.metric, Number(row.value)]))
+
       setStats({
-        totalUsers: users.length,
-        totalDrivers: drivers.length,
-        totalRides: rides.length,
-        totalOrders: orders.length,
-        totalRevenue: rideRevenue + orderRevenue,
+        totalUsers: totals.users || 0,
+        totalDrivers: totals.drivers || 0,
+        totalRides: totals.rides || 0,
+        totalOrders: totals.orders || 0,
+        totalRevenue: (totals.ride_revenue || 0) + (totals.order_revenue || 0),
       })
-      
-      // Get recent rides and orders (last 5)
-      setRecentRides(rides.slice(-5).reverse())
-      setRecentOrders(orders.slice(-5).reverse())
+
+      setRecentRides(rides)
+      setRecentOrders(orders)
     } catch (err) {
       console.error('Error fetching dashboard data:', err)
     }
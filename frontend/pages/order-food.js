@@ -1,5 +1,5 @@
 import { useState, useEffect } from 'react'
-import { apiGet, apiPost } from '../lib/api'
+import { apiBatch, apiGet, apiPost } from '../lib/api'
 
 export default function OrderFood() {
   const [restaurants, setRestaurants] = useState([])
@@ -9,19 +9,40 @@ export default function OrderFood() {
   const [users, setUsers] = useState([])
   const [selectedUser, setSelectedUser] = useState('')
   const [searchQuery, setSearchQuery] = useState('')
+  const [searchResults, setSearchResults] = useState(null)
 
   useEffect(() => {
     fetchData()
   }, [])
 
+  useEffect(() => {
+    runSearch()
+  }, [searchQuery])
+
   async function fetchData() {
-    const restaurantsData = await apiGet('/api/restaurants/list')
-    const usersData = await apiGet('/api/users/list')
-    const menuData = await apiGet('/api/menu-items/list')
-    
-    setRestaurants(restaurantsData)
-    setUsers(usersData)
-    setMenuItems(menuData)
+    const data = await apiBatch([
+      { entity: 'restaurants', limit: 1000 },
+      { entity: 'users', fields: ['user_id', 'name', 'wallet_balance'], limit: 1000 },
+      { entity: 'menu_items', limit: 1000 },
+    ])
+
+    setRestaurants(data.restaurants)
+    setUsers(data.users)
+    setMenuItems(data.menu_items)
+  }
+
+  // Server-side full-text search; dish matches surface their restaurant
+  async function runSearch() {
+    if (!searchQuery.trim()) {
+      setSearchResults(null)
+      return
+    }
+    try {
+      const data = await apiGet(`/api/search?q=${encodeURIComponent(searchQuery)}&limit=50`)
+      setSearchResults(data.results)
+    } catch (err) {
+      setSearchResults([])
+    }
   }
 
   function selectRestaurant(restaurant) {
@@ -67,14 +88,15 @@ export default function OrderFood() {
     }
 
     try {
+      // The server prices the order from the menu; getTotal() is only the preview
       const orderData = {
         user_id: parseInt(selectedUser, 10),
         restaurant_id: selectedRestaurant.restaurant_id,
-        total_amount: getTotal()
+        items: cart.map(c => ({ item_id: c.item_id, quantity: c.quantity }))
       }
       
-      await apiPost('/api/orders/create', orderData)
-      alert('Order placed successfully!')
+      const order = await apiPost('/api/orders/create', orderData)
+      alert(`Order placed successfully! Total: ₹${order.total_amount}`)
       
       // Reset
       setCart([])
@@ -85,10 +107,11 @@ export default function OrderFood() {
     }
   }
 
-  const filteredRestaurants = restaurants.filter(r => 
-    r.name.toLowerCase().includes(searchQuery.toLowerCase()) ||
-    (r.cuisine && r.cuisine.toLowerCase().includes(searchQuery.toLowerCase()))
-  )
+  const filteredRestaurants = searchResults === null
+    ? restaurants
+    : [...new Set(searchResults.map(r => r.restaurant_id))]
+        .map(id => restaurants.find(r => r.restaurant_id === id))
+        .filter(Boolean)
 
   const restaurantMenuItems = selectedRestaurant 
     ? menuItems.filter(m => m.restaurant_id === selectedRestaurant.restaurant_id && m.availability)
@@ -116,7 +139,7 @@ export default function OrderFood() {
             <h2>Restaurants</h2>
             <input 
               type="text"
-              placeholder="Search restaurants or cuisine..."
+              placeholder="Search restaurants, cuisine or dishes..."
               value={searchQuery}
               onChange={e => setSearchQuery(e.target.value)}
             />
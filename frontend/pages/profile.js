@@ -7,6 +7,7 @@ export default function Profile() {
   const [userInfo, setUserInfo] = useState(null)
   const [userRides, setUserRides] = useState([])
   const [userOrders, setUserOrders] = useState([])
+  const [summary, setSummary] = useState(null)
 
   useEffect(() => {
     fetchUsers()
@@ -19,7 +20,7 @@ export default function Profile() {
   }, [selectedUserId])
 
   async function fetchUsers() {
-    const usersData = await apiGet('/api/users/list')
+    const usersData = await apiGet('/api/users/list?fields=user_id,name')
     setUsers(usersData)
     if (usersData.length > 0) {
       setSelectedUserId(usersData[0].user_id.toString())
@@ -27,15 +28,14 @@ export default function Profile() {
   }
 
   async function fetchUserData() {
-    const allRides = await apiGet('/api/rides/list')
-    const allOrders = await apiGet('/api/orders/list')
-    
-    const userId = parseInt(selectedUserId, 10)
-    const user = users.find(u => u.user_id === userId)
-    const rides = allRides.filter(r => r.user_id === userId)
-    const orders = allOrders.filter(o => o.user_id === userId)
-    
-    setUserInfo(user)
+    const [userSummary, rides, orders] = await Promise.all([
+      apiGet(`/api/users/${selectedUserId}/summary`),
+      apiGet(`/api/users/${selectedUserId}/rides?limit=10`),
+      apiGet(`/api/users/${selectedUserId}/orders?limit=10`),
+    ])
+
+    setSummary(userSummary)
+    setUserInfo(userSummary.user)
     setUserRides(rides)
     setUserOrders(orders)
   }
@@ -44,9 +44,7 @@ export default function Profile() {
     return <div><h1>Profile</h1><p>Loading...</p></div>
   }
 
-  const totalSpent = 
-    userRides.reduce((sum, r) => sum + parseFloat(r.fare || 0), 0) +
-    userOrders.reduce((sum, o) => sum + parseFloat(o.total_amount || 0), 0)
+  const totalSpent = summary ? parseFloat(summary.lifetime_spend || 0) : 0
 
   return (
     <div>
@@ -68,11 +66,11 @@ export default function Profile() {
           <div className="grid grid-3 mt-20">
             <div className="stat-card">
               <p>Total Rides</p>
-              <h3>{userRides.length}</h3>
+              <h3>{summary ? summary.ride_count : 0}</h3>
             </div>
             <div className="stat-card">
               <p>Total Orders</p>
-              <h3>{userOrders.length}</h3>
+              <h3>{summary ? summary.order_count : 0}</h3>
             </div>
             <div className="stat-card">
               <p>Total Spent</p>
@@ -126,7 +124,7 @@ export default function Profile() {
                   </tr>
                 </thead>
                 <tbody>
-                  {userRides.slice(-10).reverse().map(r => (
+                  {userRides.map(r => (
                     <tr key={r.ride_id}>
                       <td>{r.ride_id}</td>
                       <td>{r.source}</td>
@@ -158,7 +156,7 @@ export default function Profile() {
                   </tr>
                 </thead>
                 <tbody>
-                  {userOrders.slice(-10).reverse().map(o => (
+                  {userOrders.map(o => (
                     <tr key={o.order_id}>
                       <td>{o.order_id}</td>
                       <td>{o.restaurant_id}</td>
@@ -1,5 +1,5 @@
 import { useState, useEffect } from 'react'
-import { apiPost, apiGet, apiDelete } from '../lib/api'
+import { apiPost, apiGet, apiDelete, subscribe, applyEvent } from '../lib/api'
 
 export default function Rides(){
   const [userId, setUserId] = useState('')
@@ -8,9 +8,16 @@ export default function Rides(){
   const [destination, setDestination] = useState('')
   const [fare, setFare] = useState('')
   const [list, setList] = useState([])
-  useEffect(()=>{ fetchList() }, [])
+  useEffect(()=>{
+    fetchList()
+    // Creates, status changes and deletes (from any client) arrive as deltas
+    return subscribe(['rides'], {
+      onEvent: (_, event) => event.type.startsWith('bulk_') ? fetchList() : setList(rows => applyEvent(rows, event, 'ride_id')),
+      onReset: fetchList,
+    })
+  }, [])
   async function fetchList(){ setList(await apiGet('/api/rides/list')) }
-  async function submit(e){ e.preventDefault(); await apiPost('/api/rides/create',{user_id:parseInt(userId,10), driver_id:parseInt(driverId,10), source, destination, fare:parseFloat(fare)}); setUserId(''); setDriverId(''); setSource(''); setDestination(''); setFare(''); fetchList() }
+  async function submit(e){ e.preventDefault(); await apiPost('/api/rides/create',{user_id:parseInt(userId,10), driver_id:parseInt(driverId,10), source, destination, fare:parseFloat(fare)}); setUserId(''); setDriverId(''); setSource(''); setDestination(''); setFare('') }
 
   return (
     <div>
@@ -26,7 +33,7 @@ export default function Rides(){
 
       <table>
         <thead><tr><th>ID</th><th>User</th><th>Driver</th><th>Source</th><th>Destination</th><th>Fare</th><th>Status</th><th>Timestamp</th><th>Action</th></tr></thead>
-  <tbody>{list.map(r=> (<tr key={r.ride_id}><td>{r.ride_id}</td><td>{r.user_id}</td><td>{r.driver_id}</td><td>{r.source}</td><td>{r.destination}</td><td>{r.fare}</td><td>{r.status}</td><td>{r.timestamp}</td><td><button onClick={async ()=>{ if(confirm('Delete ride?')){ try{ await apiDelete(`/api/rides/${r.ride_id}`); fetchList() }catch(err){ console.error('delete ride error', err); alert('Delete failed: '+(err.message||err)) } } }}>Delete</button></td></tr>))}</tbody>
+  <tbody>{list.map(r=> (<tr key={r.ride_id}><td>{r.ride_id}</td><td>{r.user_id}</td><td>{r.driver_id}</td><td>{r.source}</td><td>{r.destination}</td><td>{r.fare}</td><td>{r.status}</td><td>{r.timestamp}</td><td><button onClick={async ()=>{ if(confirm('Delete ride?')){ try{ await apiDelete(`/api/rides/${r.ride_id}`) }catch(err){ console.error('delete ride error', err); alert('Delete failed: '+(err.message||err)) } } }}>Delete</button></td></tr>))}</tbody>
       </table>
     </div>
   )